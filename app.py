@@ -1,16 +1,27 @@
+import argparse
 import asyncio
 import logging
-from multiprocessing import Process
+import multiprocessing
+import os
 import sys
 import time
 
 from slack_sdk.web.async_client import AsyncSlackResponse, AsyncWebClient
 
 import exporter
-from exporter import patch
+from exporter import constants, patch, utils
+from exporter.blobstore import BlobStore
+from exporter.cache import FileMetadataCache
+from exporter.checkpoint import RunCheckpoint
+from exporter.connections import Connections, ConnectionSettings
 from exporter.context import ExporterContext
-from exporter.downloader import FileDownloader
+from exporter.downloader import PARTIAL_SUFFIX, FileDownloader
 from exporter.fragment import FragmentFactory
+from exporter.profiling import Profiler
+from exporter.ratelimit import RateLimiter, SharedRateBudget, SharedRateLimiter
+from exporter.shard import ShardPool
+from exporter.tracker import ProgressTracker, create_shared_counts
+from exporter.writer import BackgroundWriter
 import settings
 
 log = logging.getLogger()
@@ -22,38 +33,179 @@ formatter = logging.Formatter('[%(asctime)s][%(levelname)s][%(name)s] %(message)
 handler.setFormatter(formatter)
 log.addHandler(handler)
 
-async def run_exporter():
-    # Patch Slack API functions
-    patch.patch()
+# Shards are spawned rather than forked, as the parent has an event loop running
+mp_context = multiprocessing.get_context("spawn")
+
+def create_context(export_time: int, last_export_time: int, checkpoint: RunCheckpoint = None,
+        shard: int = None, slack_token: str = None) -> ExporterContext:
+    # Shards are handed the token, which may have come from the OAuth flow in the parent
+    if slack_token is None:
+        slack_token = settings.slack_token
+
+    # JSON output is serialized and written off the event loop
+    writer = BackgroundWriter(queue_size=settings.write_queue_size, fsync=settings.write_fsync)
+    utils.writer = writer
+
+    # Downloads and API calls each keep a pool of connections alive between requests
+    max_connections = settings.http_max_connections or settings.download_concurrency * settings.download_chunk_count
+    connections = Connections(ConnectionSettings(
+        max_connections=max_connections,
+        max_keepalive_connections=min(settings.download_concurrency, max_connections),
+        keepalive_expiry=settings.http_keepalive_expiry,
+        http2=settings.http2,
+        api_max_connections=settings.api_max_connections
+    ))
 
     # Construct all needed instances of objects
+    blob_store = None
+    if settings.blob_store_directory:
+        blob_store = BlobStore(settings.blob_store_directory)
+        blob_store.load()
+
+    # Shards may come across the same file at the same time
+    partial_suffix = PARTIAL_SUFFIX
+    if shard is not None:
+        partial_suffix = f".shard{shard}{PARTIAL_SUFFIX}"
+
     downloader = FileDownloader(settings.file_output_directory,
-        settings.slack_token)
+        slack_token,
+        concurrency=settings.download_concurrency,
+        queue_size=settings.download_queue_size,
+        retries=settings.download_retries,
+        chunk_threshold=settings.download_chunk_threshold,
+        chunk_count=settings.download_chunk_count,
+        blob_store=blob_store,
+        writer=writer,
+        partial_suffix=partial_suffix,
+        httpclient=connections.download_client)
+
+    slack_client = AsyncWebClient(token=slack_token, base_url=settings.slack_api_url,
+        session=connections.api_session)
+
+    fragment_factory = FragmentFactory(max_fragments=settings.fragment_cache_size,
+        max_bytes=settings.fragment_cache_bytes, compression=settings.fragment_compression,
+        writer=writer)
+
+    file_cache_filename = None
+    if settings.file_cache_persist:
+        file_cache_filename = os.path.join(settings.file_output_directory,
+            constants.FILES_EXPORT_DIR, constants.FILE_CACHE_JSON_FILE)
+
+    # Only the coordinating process saves the file cache; shards just read it
+    if shard is None:
+        file_cache = FileMetadataCache(file_cache_filename)
+        file_cache.load()
+    else:
+        file_cache = FileMetadataCache()
+        file_cache.load(file_cache_filename)
+
+    return ExporterContext(
+        export_time=export_time,
+        last_export_time=last_export_time,
+        output_directory=settings.file_output_directory,
+        slack_client=slack_client,
+        downloader=downloader,
+        fragments=fragment_factory,
+        conversation_workers=settings.conversation_workers,
+        reply_concurrency=settings.reply_concurrency,
+        thread_refresh_days=settings.thread_refresh_days,
+        file_cache=file_cache,
+        checkpoint=checkpoint,
+        writer=writer,
+        connections=connections
+    )
 
-    slack_client = AsyncWebClient(token=settings.slack_token)
+async def run_exporter(profile_directory: str = None):
+    # Patch Slack API functions
+    patch.patch()
 
-    fragment_factory = FragmentFactory()
+    if profile_directory is not None:
+        utils.profiler = Profiler(profile_directory)
+        await utils.profiler.start()
+
+    # Shards pace their API calls against one budget, shared with this process,
+    # and publish their progress for this process to report
+    budget = None
+    progress_counts = None
+    if settings.shard_processes > 1:
+        budget = SharedRateBudget(headroom=settings.rate_limit_headroom,
+            burst=settings.rate_limit_burst, context=mp_context)
+        utils.rate_limiter = SharedRateLimiter(budget)
+        progress_counts = create_shared_counts(settings.shard_processes, context=mp_context)
+    else:
+        utils.rate_limiter = RateLimiter(headroom=settings.rate_limit_headroom,
+            burst=settings.rate_limit_burst)
+
+    utils.tracker = ProgressTracker(interval=settings.progress_interval,
+        log_interval=settings.progress_log_interval, shared=progress_counts)
+    await utils.tracker.start()
 
     # Initialize context
     last_export_time = ExporterContext.get_last_export_time(settings.file_output_directory)
 
-    ctx = ExporterContext(
-        export_time=int(time.time()),
-        last_export_time=last_export_time,
-        output_directory=settings.file_output_directory,
-        slack_client=slack_client,
-        downloader=downloader,
-        fragments=fragment_factory
+    # Picks up the export window of an unfinished run, if there is one
+    os.makedirs(settings.file_output_directory, exist_ok=True)
+    checkpoint = RunCheckpoint.load_or_create(
+        os.path.join(settings.file_output_directory, constants.CHECKPOINT_JSON_FILE),
+        int(time.time()),
+        last_export_time
     )
 
+    ctx = create_context(checkpoint.export_time, last_export_time, checkpoint=checkpoint)
+
+    if budget is not None:
+        ctx.shard_pool = ShardPool(settings.shard_processes, run_shard,
+            (settings.slack_token, budget, progress_counts, checkpoint.export_time, last_export_time, profile_directory),
+            context=mp_context)
+
     # Run
     try:
         await exporter.export_all(ctx)
     except Exception as e:
         log.error(f"Uncaught {e.__class__.__name__}", exc_info=e)
 
+    ctx.save_report(settings.metrics_textfile)
+
     # Clean up
     await ctx.close()
+    await utils.tracker.stop()
+
+    if utils.profiler is not None:
+        await utils.profiler.stop()
+
+def run_shard(shard: int, conversations, results, slack_token: str, budget: SharedRateBudget, progress_counts,
+        export_time: int, last_export_time: int, profile_directory: str = None):
+    asyncio.run(run_shard_exporter(shard, conversations, results, slack_token, budget, progress_counts, export_time,
+        last_export_time, profile_directory))
+
+async def run_shard_exporter(shard: int, conversations, results, slack_token: str, budget: SharedRateBudget,
+        progress_counts, export_time: int, last_export_time: int, profile_directory: str = None):
+    patch.patch()
+
+    utils.rate_limiter = SharedRateLimiter(budget)
+
+    utils.tracker = ProgressTracker(interval=settings.progress_interval, shared=progress_counts, shard=shard)
+    utils.tracker.set_phase("conversations")
+    await utils.tracker.start()
+
+    # Each shard profiles its share of the conversations phase on its own
+    if profile_directory is not None:
+        utils.profiler = Profiler(os.path.join(profile_directory, f"shard{shard}"))
+        await utils.profiler.start()
+
+    ctx = create_context(export_time, last_export_time, shard=shard, slack_token=slack_token)
+
+    try:
+        with utils.profile_phase("conversations"):
+            failed = await exporter.export_shard(ctx, conversations)
+    finally:
+        await ctx.close()
+        await utils.tracker.stop()
+
+        if utils.profiler is not None:
+            await utils.profiler.stop()
+
+    results.put((shard, failed, utils.metrics.to_dict()))
 
 async def authenticate():
     if settings.slack_token is None:
@@ -61,9 +213,15 @@ async def authenticate():
 
         auth.server.run()
 
-async def main():
+async def main(profile_directory: str = None):
     await authenticate()
-    await run_exporter()
+    await run_exporter(profile_directory)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Exports a Slack workspace.")
+    parser.add_argument("--profile", nargs="?", const="profile", metavar="DIRECTORY",
+        help="profile each export phase with cProfile, and sample event loop lag, writing the results to "
+             "DIRECTORY (default: ./profile)")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.profile))
\ No newline at end of file
@@ -0,0 +1,85 @@
+"""
+Compares writing and reading history fragments with each compression codec.
+
+    python -m benchmarks.bench_compression --messages 100000
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from exporter.compression import CODECS, zstandard
+from exporter.fragment import FragmentedJsonList
+
+from .messages import create_messages
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+def run(compression, messages, fragment_size, page_size):
+    data_dir = tempfile.mkdtemp(prefix="bench_compression_")
+
+    try:
+        # Written a page at a time, committing after each one, like the exporter does
+        start = time.perf_counter()
+        fragment = FragmentedJsonList(data_dir, fragment_size=fragment_size, compression=compression)
+
+        for offset in range(0, len(messages), page_size):
+            fragment.extend(messages[offset:offset + page_size])
+            fragment.commit_fragments()
+            fragment.unload_clean_fragments()
+
+        fragment.close()
+        write_time = time.perf_counter() - start
+
+        size = directory_size(data_dir)
+
+        start = time.perf_counter()
+        count = sum(1 for _ in FragmentedJsonList(data_dir, fragment_size=fragment_size).stream())
+        read_time = time.perf_counter() - start
+
+        assert count == len(messages)
+
+        # Appends add a frame per page; compacting recompresses each fragment as one
+        fragment = FragmentedJsonList(data_dir, fragment_size=fragment_size, compression=compression)
+        fragment.compact()
+        fragment.close()
+
+        compact_size = directory_size(data_dir)
+
+        return (write_time, read_time, size, compact_size)
+    finally:
+        shutil.rmtree(data_dir)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--fragment-size", type=int, default=5000)
+    parser.add_argument("--page-size", type=int, default=200)
+    args = parser.parse_args()
+
+    messages = create_messages(args.messages)
+
+    codecs = [None] + [name for name in CODECS if name != "zstd" or zstandard is not None]
+
+    print(f"{'codec':<8}{'write s':>10}{'write MB/s':>12}{'read s':>10}{'read MB/s':>11}"
+          f"{'size MB':>10}{'ratio':>8}{'compacted MB':>14}")
+
+    plain_size = None
+
+    for compression in codecs:
+        write_time, read_time, size, compact_size = run(compression, messages, args.fragment_size, args.page_size)
+
+        if plain_size is None:
+            plain_size = size
+
+        # Throughput is measured against the uncompressed JSON, so codecs compare directly
+        megabytes = plain_size / 1e6
+
+        print(f"{compression or 'none':<8}{write_time:>10.2f}{megabytes / write_time:>12.1f}{read_time:>10.2f}"
+              f"{megabytes / read_time:>11.1f}{size / 1e6:>10.1f}{plain_size / size:>8.1f}{compact_size / 1e6:>14.1f}")
+
+if __name__ == "__main__":
+    main()
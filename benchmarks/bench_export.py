@@ -0,0 +1,127 @@
+"""
+Runs a whole export against a local fake Slack workspace and reports its throughput.
+
+    python -m benchmarks.bench_export --channels 20 --messages 5000 --speedup 60
+
+The workspace is served by benchmarks.slack_server in a separate process.
+Slack's rate limits are scaled up by --speedup on both sides, so the
+exporter paces itself the way it would against the real API, only faster.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+import httpx
+
+from .memory import peak_rss_mb
+from .slack_server import add_workspace_arguments, create_server
+
+def run_server(args: argparse.Namespace, ready, stop):
+    asyncio.run(_run_server(args, ready, stop))
+
+async def _run_server(args: argparse.Namespace, ready, stop):
+    server = create_server(args)
+    ready.put(await server.start())
+
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, stop.wait)
+    finally:
+        await server.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_workspace_arguments(parser)
+    parser.add_argument("--shards", type=int, default=1, help="SHARD_PROCESSES for the exporter")
+    parser.add_argument("--workers", type=int, default=None, help="CONVERSATION_WORKERS for the exporter")
+    parser.add_argument("--output", default=None, help="export here and keep it, instead of a temporary directory")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    stop = context.Event()
+
+    server = context.Process(target=run_server, args=(args, ready, stop), name="slack-server")
+    server.start()
+
+    url = ready.get()
+    output = args.output or tempfile.mkdtemp(prefix="bench_export_")
+
+    try:
+        # Settings are read when the exporter is imported, and again by every shard
+        os.environ.update({
+            "SLACK_TOKEN": "xoxb-benchmark",
+            "SLACK_API_URL": f"{url}/api/",
+            "FILE_OUTPUT_DIRECTORY": output,
+            "SHARD_PROCESSES": str(args.shards),
+            "RATE_LIMIT_HEADROOM": str(0.9 * (args.speedup or 1000))
+        })
+
+        if args.workers is not None:
+            os.environ["CONVERSATION_WORKERS"] = str(args.workers)
+
+        import app
+        from exporter import constants
+
+        start = time.perf_counter()
+        asyncio.run(app.run_exporter())
+        elapsed = time.perf_counter() - start
+
+        exporter_rss = peak_rss_mb(resource.RUSAGE_SELF)
+        shard_rss = peak_rss_mb(resource.RUSAGE_CHILDREN) if args.shards > 1 else None
+
+        stats = httpx.get(f"{url}/stats").json()
+
+        # Includes what the shards did
+        with open(os.path.join(output, constants.RUN_REPORT_JSON_FILE), "r") as fd:
+            report = json.load(fd)
+    finally:
+        stop.set()
+        server.join()
+
+        if args.output is None:
+            shutil.rmtree(output, ignore_errors=True)
+
+    calls = sum(stats["calls"].values())
+    rate_limited = sum(stats["rate_limited"].values())
+
+    print()
+    print(f"{'messages':<24}{stats['messages_served']:>12}")
+    print(f"{'elapsed (s)':<24}{elapsed:>12.2f}")
+    print(f"{'messages/s':<24}{stats['messages_served'] / elapsed:>12.1f}")
+    print(f"{'API calls':<24}{calls:>12}")
+    print(f"{'API calls/s':<24}{calls / elapsed:>12.1f}")
+    print(f"{'rate limited (429)':<24}{rate_limited:>12}")
+    print(f"{'Retry-After total (s)':<24}{stats['retry_after']:>12}")
+    print(f"{'pacing sleep (s)':<24}{sum(m['pacing_time'] for m in report['methods'].values()):>12.2f}")
+    print(f"{'rate limited sleep (s)':<24}{sum(m['backoff_time'] for m in report['methods'].values()):>12.2f}")
+    print(f"{'files downloaded':<24}{stats['files_served']:>12}")
+    print(f"{'MB downloaded':<24}{stats['bytes_served'] / 1024 / 1024:>12.1f}")
+    print(f"{'peak RSS (MB)':<24}{exporter_rss:>12.1f}")
+
+    if shard_rss is not None:
+        print(f"{'peak shard RSS (MB)':<24}{shard_rss:>12.1f}")
+
+    print()
+    print(f"  {'method':<24}{'calls':>8}{'429s':>8}{'mean latency (ms)':>20}")
+
+    for method, count in sorted(stats["calls"].items()):
+        latency = report["methods"].get(method, {}).get("latency", {"sum": 0, "count": 0})
+        mean = latency["sum"] / latency["count"] * 1000 if latency["count"] > 0 else 0
+
+        print(f"  {method:<24}{count:>8}{stats['rate_limited'].get(method, 0):>8}{mean:>20.1f}")
+
+    print()
+    print("Phases:")
+
+    for phase, seconds in report["phases"].items():
+        print(f"  {phase:<24}{seconds:>8.2f}s")
+
+if __name__ == "__main__":
+    main()
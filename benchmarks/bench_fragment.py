@@ -0,0 +1,301 @@
+"""
+Measures FragmentedJsonList operations on real disk, and checks them against a baseline.
+
+    python -m benchmarks.bench_fragment --records 100000 1000000 --fragment-sizes 1000 5000 20000
+    python -m benchmarks.bench_fragment --save-baseline
+
+Each combination of record count and fragment size runs in a fresh
+process, so that its peak memory can be told apart from the others'.
+Throughput is reported per operation, in items (or calls) per second.
+Compared against a baseline, the run fails if any operation got slower by
+more than --threshold, or a case's peak memory grew by more than
+--memory-threshold.
+"""
+
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Dict, Iterator, List
+
+from exporter.fragment import FragmentedJsonList
+
+from .memory import peak_rss_mb
+from .messages import WORDS, create_message
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "fragment_baseline.json")
+
+# Operations, in the order they are run and reported
+OPERATIONS = ("append", "extend", "commit_fragments", "load_file_map", "stream", "iterate", "random_get", "reverse_slice")
+
+# Loaded fragments kept in memory, as the exporter does by default
+MAX_FRAGMENTS = 4
+
+# Number of times load_file_map is called, to time something measurable
+LOAD_FILE_MAP_CALLS = 200
+
+def create_record(n: int) -> Dict[str, Any]:
+    """A small message, for runs where building full messages would dominate."""
+
+    return {
+        "type": "message",
+        "ts": f"{1600000000 + n}.000100",
+        "user": f"U{n % 50:08d}",
+        "text": " ".join(WORDS[(n + i) % len(WORDS)] for i in range(8))
+    }
+
+def create_pages(records: int, page_size: int, full_messages: bool) -> Iterator[List[Dict[str, Any]]]:
+    rng = random.Random(0)
+
+    for start in range(0, records, page_size):
+        end = min(start + page_size, records)
+
+        if full_messages:
+            yield [create_message(n, rng) for n in range(start, end)]
+        else:
+            yield [create_record(n) for n in range(start, end)]
+
+def run_case(records: int, fragment_size: int, page_size: int, lookups: int, slice_length: int,
+        full_messages: bool, compression: str) -> Dict[str, Any]:
+    data_dir = tempfile.mkdtemp(prefix="bench_fragment_")
+    timings = {}
+
+    def open_list(name):
+        return FragmentedJsonList(os.path.join(data_dir, name), fragment_size=fragment_size,
+            max_fragments=MAX_FRAGMENTS, compression=compression)
+
+    try:
+        # Items appended one at a time, committing a page at a time like the exporter
+        history = open_list("append")
+        elapsed = 0.0
+
+        for page in create_pages(records, page_size, full_messages):
+            start = time.perf_counter()
+
+            for item in page:
+                history.append(item)
+
+            history.commit_fragments()
+            history.unload_clean_fragments()
+            elapsed += time.perf_counter() - start
+
+        history.close()
+        timings["append"] = (records, elapsed)
+
+        # Whole pages at a time, with the commits timed on their own
+        history = open_list("extend")
+        extend_time = 0.0
+        commit_time = 0.0
+
+        for page in create_pages(records, page_size, full_messages):
+            start = time.perf_counter()
+            history.extend(page)
+            extended = time.perf_counter()
+            history.commit_fragments()
+            commit_time += time.perf_counter() - extended
+            extend_time += extended - start
+
+            history.unload_clean_fragments()
+
+        history.close()
+        timings["extend"] = (records, extend_time)
+        timings["commit_fragments"] = (records, commit_time)
+
+        history = open_list("extend")
+
+        start = time.perf_counter()
+        for _ in range(LOAD_FILE_MAP_CALLS):
+            history.load_file_map()
+        timings["load_file_map"] = (LOAD_FILE_MAP_CALLS, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        count = sum(1 for _ in history.stream())
+        timings["stream"] = (count, time.perf_counter() - start)
+
+        assert count == records
+
+        history = open_list("extend")
+
+        start = time.perf_counter()
+        count = sum(1 for _ in history)
+        timings["iterate"] = (count, time.perf_counter() - start)
+
+        rng = random.Random(1)
+        indices = [rng.randrange(records) for _ in range(lookups)]
+
+        history = open_list("extend")
+
+        start = time.perf_counter()
+        for index in indices:
+            history[index]
+        timings["random_get"] = (lookups, time.perf_counter() - start)
+
+        # The newest items, newest first
+        history = open_list("extend")
+        length = min(records, slice_length)
+
+        start = time.perf_counter()
+        items = history[-1:-length - 1:-1]
+        timings["reverse_slice"] = (len(items), time.perf_counter() - start)
+
+        assert len(items) == length
+    finally:
+        shutil.rmtree(data_dir)
+
+    return {
+        "operations": {
+            name: {"seconds": seconds, "per_second": count / seconds if seconds > 0 else 0.0}
+            for name, (count, seconds) in timings.items()
+        },
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+def case_key(records: int, fragment_size: int) -> str:
+    return f"records={records},fragment_size={fragment_size}"
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float, memory_threshold: float) -> List[str]:
+    """Describes every operation that got slower, and every case that used more memory, beyond the thresholds."""
+
+    regressions = []
+
+    for key, case in results["cases"].items():
+        base = baseline["cases"].get(key)
+        if base is None:
+            continue
+
+        for name, result in case["operations"].items():
+            base_result = base["operations"].get(name)
+
+            if base_result is None or base_result["per_second"] <= 0:
+                continue
+
+            change = result["per_second"] / base_result["per_second"] - 1
+
+            if change < -threshold:
+                regressions.append(f"{key} {name}: {result['per_second']:.0f}/s, {change:+.0%} from "
+                                   f"{base_result['per_second']:.0f}/s")
+
+        change = case["peak_rss_mb"] / base["peak_rss_mb"] - 1
+
+        if change > memory_threshold:
+            regressions.append(f"{key} peak RSS: {case['peak_rss_mb']:.1f} MB, {change:+.0%} from "
+                               f"{base['peak_rss_mb']:.1f} MB")
+
+    return regressions
+
+def print_results(results: Dict[str, Any], baseline: Dict[str, Any] = None):
+    for key, case in results["cases"].items():
+        base = baseline["cases"].get(key) if baseline is not None else None
+
+        print(key)
+        print(f"  {'operation':<20}{'per second':>14}{'seconds':>10}{'vs baseline':>13}")
+
+        for name in OPERATIONS:
+            result = case["operations"][name]
+            change = ""
+
+            if base is not None and name in base["operations"] and base["operations"][name]["per_second"] > 0:
+                change = f"{result['per_second'] / base['operations'][name]['per_second'] - 1:+.0%}"
+
+            print(f"  {name:<20}{result['per_second']:>14.0f}{result['seconds']:>10.2f}{change:>13}")
+
+        change = ""
+        if base is not None:
+            change = f"{case['peak_rss_mb'] / base['peak_rss_mb'] - 1:+.0%}"
+
+        print(f"  {'peak RSS (MB)':<20}{case['peak_rss_mb']:>14.1f}{'':>10}{change:>13}")
+        print()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, nargs="+", default=[100000])
+    parser.add_argument("--fragment-sizes", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--page-size", type=int, default=200)
+    parser.add_argument("--lookups", type=int, default=500, help="number of random reads")
+    parser.add_argument("--slice-length", type=int, default=10000, help="number of items in the reverse slice")
+    parser.add_argument("--full-messages", action="store_true", help="use full synthetic messages instead of small records")
+    parser.add_argument("--compression", default=None)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case; the best of them is kept")
+    parser.add_argument("--output", help="write the results here as JSON")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="fraction of throughput an operation may lose")
+    parser.add_argument("--memory-threshold", type=float, default=0.25, help="fraction of peak memory a case may gain")
+    args = parser.parse_args()
+
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": {"page_size": args.page_size, "lookups": args.lookups,
+                    "slice_length": args.slice_length, "full_messages": args.full_messages,
+                    "compression": args.compression},
+        "cases": {}
+    }
+
+    context = multiprocessing.get_context("spawn")
+
+    for records in args.records:
+        for fragment_size in args.fragment_sizes:
+            key = case_key(records, fragment_size)
+            runs = []
+
+            for _ in range(args.repeat):
+                with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as pool:
+                    runs.append(pool.submit(run_case, records, fragment_size, args.page_size, args.lookups,
+                        args.slice_length, args.full_messages, args.compression).result())
+
+            results["cases"][key] = {
+                "operations": {
+                    name: max((run["operations"][name] for run in runs), key=lambda result: result["per_second"])
+                    for name in OPERATIONS
+                },
+                "peak_rss_mb": min(run["peak_rss_mb"] for run in runs)
+            }
+
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump(results, fd, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as fd:
+            json.dump(results, fd, indent=2)
+
+        print_results(results)
+        print(f"Saved baseline to {args.baseline}")
+        return
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as fd:
+            baseline = json.load(fd)
+
+        if baseline["options"] != results["options"]:
+            print(f"Baseline {args.baseline} was measured with other options; not comparing")
+            baseline = None
+
+    print_results(results, baseline)
+
+    if baseline is None:
+        return
+
+    regressions = compare(results, baseline, args.threshold, args.memory_threshold)
+
+    if len(regressions) > 0:
+        print("Regressions against the baseline:")
+
+        for regression in regressions:
+            print(f"  {regression}")
+
+        sys.exit(1)
+
+    print("No regressions against the baseline")
+
+if __name__ == "__main__":
+    main()
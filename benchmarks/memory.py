@@ -0,0 +1,13 @@
+import resource
+import sys
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    """Peak resident set size in megabytes, of this process or (with RUSAGE_CHILDREN) its largest child."""
+
+    rss = resource.getrusage(who).ru_maxrss
+
+    # Linux reports kilobytes, macOS bytes
+    if sys.platform == "darwin":
+        rss /= 1024
+
+    return rss / 1024
@@ -0,0 +1,45 @@
+import random
+from typing import Any, Dict, List
+
+WORDS = ("deploy", "review", "lunch", "meeting", "ticket", "release", "bug", "thanks", "standup", "merge",
+         "incident", "dashboard", "customer", "roadmap", "ship", "tomorrow", "please", "looks", "good", "here")
+
+def create_message(n: int, rng: random.Random) -> Dict[str, Any]:
+    """A message shaped like what conversations.history returns, user profile copy and blocks included."""
+
+    user = f"U{rng.randrange(50):08d}"
+    text = " ".join(rng.choice(WORDS) for _ in range(rng.randrange(3, 40)))
+
+    return {
+        "client_msg_id": f"{rng.getrandbits(128):032x}",
+        "type": "message",
+        "text": text,
+        "user": user,
+        "ts": f"{1600000000 + n}.{rng.randrange(1000000):06d}",
+        "team": "T00000001",
+        "user_team": "T00000001",
+        "source_team": "T00000001",
+        "user_profile": {
+            "avatar_hash": f"{rng.getrandbits(48):012x}",
+            "image_72": f"https://avatars.slack-edge.com/2020-01-01/{user}_72.png",
+            "first_name": user.lower(),
+            "real_name": f"{user.lower()} example",
+            "display_name": user.lower(),
+            "team": "T00000001",
+            "name": user.lower(),
+            "is_restricted": False,
+            "is_ultra_restricted": False
+        },
+        "blocks": [{
+            "type": "rich_text",
+            "block_id": f"{rng.getrandbits(20):05x}",
+            "elements": [{
+                "type": "rich_text_section",
+                "elements": [{"type": "text", "text": text}]
+            }]
+        }]
+    }
+
+def create_messages(count: int, seed: int = 0) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    return [create_message(n, rng) for n in range(count)]
@@ -0,0 +1,547 @@
+"""
+Serves a synthetic Slack workspace over HTTP, for running the exporter locally.
+
+    python -m benchmarks.slack_server --channels 20 --messages 5000
+"""
+
+import argparse
+import asyncio
+import base64
+import collections
+import math
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+from exporter.ratelimit import METHOD_TIERS, TIER_RATES
+
+from .messages import WORDS, create_message
+
+# Slack's own epoch for the synthetic history; messages are a second apart
+BASE_TS = 1600000000
+
+# Number of channels' histories kept generated at once
+HISTORY_CACHE_SIZE = 16
+
+def encode_cursor(offset: int) -> str:
+    return base64.b64encode(f"next:{offset}".encode()).decode()
+
+def decode_cursor(cursor: Optional[str]) -> Optional[int]:
+    if not cursor:
+        return None
+
+    return int(base64.b64decode(cursor).decode().partition(":")[2])
+
+class FakeWorkspace:
+    """
+    A workspace of `channels` channels with `messages` messages each, and
+    the users, files and emoji they refer to.
+
+    Everything is generated from `seed`, so the same arguments always give
+    the same workspace. Channel histories are generated when first asked
+    for, and only the most recently used ones are kept.
+    """
+
+    def __init__(self, channels: int = 10, messages: int = 1000, users: int = 50, files: int = 100,
+            emoji: int = 20, thread_ratio: float = 0.05, replies: int = 5, file_ratio: float = 0.02,
+            file_size: int = 16 * 1024, seed: int = 0):
+        self.channels = channels
+        self.messages = messages
+        self.users = users
+        self.files = files
+        self.emoji = emoji
+        self.thread_ratio = thread_ratio
+        self.replies = replies
+        self.file_ratio = file_ratio
+        self.file_size = file_size
+        self.seed = seed
+
+        # Where the server is listening, for the URLs of files
+        self.base_url = ""
+
+        self._histories: collections.OrderedDict = collections.OrderedDict()
+
+    def channel_id(self, n: int) -> str:
+        return f"C{n:08d}"
+
+    def channel_index(self, channel_id: str) -> Optional[int]:
+        if not channel_id.startswith("C") or not channel_id[1:].isdigit():
+            return None
+
+        n = int(channel_id[1:])
+        return n if n < self.channels else None
+
+    def channel(self, n: int) -> Dict[str, Any]:
+        return {
+            "id": self.channel_id(n),
+            "name": f"channel-{n}",
+            "is_channel": True,
+            "is_group": False,
+            "is_im": False,
+            "is_archived": False,
+            "is_general": n == 0,
+            "created": BASE_TS,
+            "creator": self.user_id(0),
+            "num_members": self.users
+        }
+
+    def user_id(self, n: int) -> str:
+        return f"U{n:08d}"
+
+    def user(self, n: int) -> Dict[str, Any]:
+        user_id = self.user_id(n)
+
+        return {
+            "id": user_id,
+            "team_id": "T00000001",
+            "name": user_id.lower(),
+            "real_name": f"{user_id.lower()} example",
+            "deleted": False,
+            "profile": {
+                "real_name": f"{user_id.lower()} example",
+                "display_name": user_id.lower(),
+                "image_72": f"{self.base_url}/avatars/{user_id}_72.png"
+            }
+        }
+
+    def file_id(self, n: int) -> str:
+        return f"F{n:08d}"
+
+    def file_index(self, file_id: str) -> Optional[int]:
+        if not file_id.startswith("F") or not file_id[1:].isdigit():
+            return None
+
+        n = int(file_id[1:])
+        return n if n < self.files else None
+
+    def file(self, n: int) -> Dict[str, Any]:
+        file_id = self.file_id(n)
+        name = f"{WORDS[n % len(WORDS)]}-{n}.txt"
+
+        return {
+            "id": file_id,
+            "created": BASE_TS + n,
+            "timestamp": BASE_TS + n,
+            "name": name,
+            "title": name,
+            "mimetype": "text/plain",
+            "filetype": "text",
+            "user": self.user_id(n % self.users),
+            "mode": "hosted",
+            "size": self.file_size,
+            "url_private": f"{self.base_url}/files/{file_id}/{name}"
+        }
+
+    def file_content(self, n: int) -> bytes:
+        line = f"{self.file_id(n)} ".encode() * 16 + b"\n"
+        return (line * (self.file_size // len(line) + 1))[:self.file_size]
+
+    def emoji_list(self) -> Dict[str, str]:
+        return {f"emoji-{n}": f"{self.base_url}/emoji/emoji-{n}.png" for n in range(self.emoji)}
+
+    def history(self, n: int) -> Tuple[List[Dict[str, Any]], Dict[str, List[Dict[str, Any]]]]:
+        """A channel's messages oldest first, and the replies to its threads by thread ts."""
+
+        if n in self._histories:
+            self._histories.move_to_end(n)
+            return self._histories[n]
+
+        self._histories[n] = self._generate_history(n)
+
+        while len(self._histories) > HISTORY_CACHE_SIZE:
+            self._histories.popitem(last=False)
+
+        return self._histories[n]
+
+    def _generate_history(self, channel: int) -> Tuple[List[Dict[str, Any]], Dict[str, List[Dict[str, Any]]]]:
+        rng = random.Random(self.seed * 1000003 + channel)
+        messages = []
+        replies = {}
+
+        for n in range(self.messages):
+            message = create_message(n, rng)
+            message["ts"] = f"{BASE_TS + n}.000000"
+
+            if self.files > 0 and rng.random() < self.file_ratio:
+                message["files"] = [self.file(rng.randrange(self.files))]
+
+            if self.replies > 0 and rng.random() < self.thread_ratio:
+                thread = []
+
+                # Replies fall between the parent and the next message
+                for r in range(self.replies):
+                    reply = create_message(n, rng)
+                    reply["ts"] = f"{BASE_TS + n}.{r + 1:06d}"
+                    reply["thread_ts"] = message["ts"]
+                    reply["parent_user_id"] = message["user"]
+                    thread.append(reply)
+
+                message["thread_ts"] = message["ts"]
+                message["reply_count"] = len(thread)
+                message["reply_users"] = sorted(set(reply["user"] for reply in thread))
+                message["latest_reply"] = thread[-1]["ts"]
+                replies[message["ts"]] = thread
+
+            messages.append(message)
+
+        return (messages, replies)
+
+class RateLimits:
+    """
+    Slack's per-method rate limits, as token buckets.
+
+    Rates are the tiers' multiplied by `speedup`, so that a benchmark doesn't
+    have to run for hours; `burst` calls may be made back to back.
+    """
+
+    def __init__(self, speedup: float = 60.0, burst: float = 3.0):
+        self.speedup = speedup
+        self.burst = burst
+        self._buckets: Dict[str, List[float]] = {}
+
+    def check(self, method: str) -> float:
+        """Takes a call to `method`, returning 0, or how many seconds to wait if it's over the limit."""
+
+        tier = METHOD_TIERS.get(method)
+        if tier is None:
+            return 0
+
+        rate = TIER_RATES[tier] * self.speedup / 60
+        now = time.monotonic()
+        bucket = self._buckets.setdefault(method, [self.burst, now])
+
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0
+
+        return (1 - bucket[0]) / rate
+
+class FakeSlackServer:
+    """
+    Serves the Web API methods the exporter calls, and the workspace's files.
+
+    API methods live under /api/, and page with cursors or page numbers like
+    Slack's do. Calls over their method's rate limit get a 429 with a
+    Retry-After header, in whole seconds. Files support range requests.
+    What was served so far is counted, and can be fetched from /stats.
+    """
+
+    def __init__(self, workspace: FakeWorkspace, rate_limits: RateLimits = None):
+        self.workspace = workspace
+        self.rate_limits = rate_limits
+
+        self.calls: collections.Counter = collections.Counter()
+        self.rate_limited: collections.Counter = collections.Counter()
+        self.retry_after = 0
+        self.messages_served = 0
+        self.files_served = 0
+        self.bytes_served = 0
+
+        self._runner: web.AppRunner = None
+
+        self._methods = {
+            "auth.test": self._auth_test,
+            "conversations.history": self._conversations_history,
+            "conversations.info": self._conversations_info,
+            "conversations.list": self._conversations_list,
+            "conversations.replies": self._conversations_replies,
+            "emoji.list": self._emoji_list,
+            "files.info": self._files_info,
+            "files.list": self._files_list,
+            "pins.list": self._pins_list,
+            "reminders.list": self._reminders_list,
+            "team.info": self._team_info,
+            "users.info": self._users_info,
+            "users.list": self._users_list,
+        }
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/api/{method}", self._handle_api)
+        app.router.add_get("/files/{id}/{name}", self._handle_file)
+        app.router.add_get("/stats", self._handle_stats)
+
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Starts listening, and returns the server's URL."""
+
+        self._runner = web.AppRunner(self.create_app(), access_log=None)
+        await self._runner.setup()
+
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+
+        host, port = self._runner.addresses[0][:2]
+        self.workspace.base_url = f"http://{host}:{port}"
+
+        return self.workspace.base_url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": dict(self.calls),
+            "rate_limited": dict(self.rate_limited),
+            "retry_after": self.retry_after,
+            "messages_served": self.messages_served,
+            "files_served": self.files_served,
+            "bytes_served": self.bytes_served
+        }
+
+    async def _handle_api(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+
+        if not request.headers.get("Authorization", "").startswith("Bearer "):
+            return web.json_response({"ok": False, "error": "not_authed"})
+
+        if method not in self._methods:
+            return web.json_response({"ok": False, "error": "unknown_method"})
+
+        if self.rate_limits is not None:
+            wait = self.rate_limits.check(method)
+
+            if wait > 0:
+                retry_after = max(1, math.ceil(wait))
+                self.rate_limited[method] += 1
+                self.retry_after += retry_after
+
+                return web.json_response({"ok": False, "error": "ratelimited"}, status=429,
+                    headers={"Retry-After": str(retry_after)})
+
+        params = dict(request.query)
+
+        if request.content_type == "application/json":
+            params.update(await request.json())
+        elif request.can_read_body:
+            params.update(await request.post())
+
+        data = self._methods[method](params)
+        data.setdefault("ok", True)
+
+        return web.json_response(data)
+
+    async def _handle_file(self, request: web.Request) -> web.StreamResponse:
+        n = self.workspace.file_index(request.match_info["id"])
+        if n is None:
+            raise web.HTTPNotFound()
+
+        content = self.workspace.file_content(n)
+        status = 200
+        headers = {}
+
+        # Only single "bytes=start-" or "bytes=start-end" ranges, which is all the downloader asks for
+        if "Range" in request.headers:
+            start, _, end = request.headers["Range"].partition("=")[2].partition("-")
+            start = int(start)
+            end = int(end) if end else len(content) - 1
+
+            if start >= len(content):
+                raise web.HTTPRequestRangeNotSatisfiable(headers={"Content-Range": f"bytes */{len(content)}"})
+
+            headers["Content-Range"] = f"bytes {start}-{min(end, len(content) - 1)}/{len(content)}"
+            content = content[start:end + 1]
+            status = 206
+
+        self.files_served += 1
+        self.bytes_served += len(content)
+
+        return web.Response(body=content, status=status, headers=headers, content_type="text/plain")
+
+    async def _handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+    def _cursor_page(self, key: str, items: List[Any], params: Dict[str, Any], default_limit: int = 100) -> Dict[str, Any]:
+        limit = min(int(params.get("limit") or default_limit), 1000)
+        start = decode_cursor(params.get("cursor")) or 0
+        end = start + limit
+
+        return {
+            key: items[start:end],
+            "response_metadata": {"next_cursor": encode_cursor(end) if end < len(items) else ""}
+        }
+
+    def _channel(self, params: Dict[str, Any]) -> Optional[int]:
+        return self.workspace.channel_index(params.get("channel", ""))
+
+    def _auth_test(self, params):
+        return {"team_id": "T00000001", "user_id": self.workspace.user_id(0)}
+
+    def _conversations_list(self, params):
+        channels = [self.workspace.channel(n) for n in range(self.workspace.channels)]
+        return self._cursor_page("channels", channels, params)
+
+    def _conversations_info(self, params):
+        n = self._channel(params)
+        if n is None:
+            return {"ok": False, "error": "channel_not_found"}
+
+        return {"channel": self.workspace.channel(n)}
+
+    def _conversations_history(self, params):
+        n = self._channel(params)
+        if n is None:
+            return {"ok": False, "error": "channel_not_found"}
+
+        messages, _ = self.workspace.history(n)
+
+        # Message n was sent at BASE_TS + n; both bounds are exclusive
+        lower, end = 0, len(messages)
+        if params.get("oldest"):
+            lower = min(max(math.floor(float(params["oldest"])) - BASE_TS + 1, 0), len(messages))
+        if params.get("latest"):
+            end = min(max(math.ceil(float(params["latest"])) - BASE_TS, 0), len(messages))
+
+        # Newest first; the cursor is where the next page ends
+
+        cursor = decode_cursor(params.get("cursor"))
+        if cursor is not None:
+            end = min(end, cursor)
+
+        limit = min(int(params.get("limit") or 100), 1000)
+        start = max(lower, end - limit)
+        self.messages_served += max(end - start, 0)
+
+        return {
+            "messages": messages[start:end][::-1],
+            "has_more": start > lower,
+            "pin_count": 0,
+            "response_metadata": {"next_cursor": encode_cursor(start) if start > lower else ""}
+        }
+
+    def _conversations_replies(self, params):
+        n = self._channel(params)
+        if n is None:
+            return {"ok": False, "error": "channel_not_found"}
+
+        messages, replies = self.workspace.history(n)
+        ts = params.get("ts", "")
+
+        parent = messages[int(float(ts)) - BASE_TS] if ts in replies else None
+        if parent is None:
+            return {"ok": False, "error": "thread_not_found"}
+
+        oldest = float(params["oldest"]) if params.get("oldest") else None
+        thread = [parent] + [reply for reply in replies[ts] if oldest is None or float(reply["ts"]) > oldest]
+
+        page = self._cursor_page("messages", thread, params, default_limit=1000)
+        self.messages_served += sum(1 for message in page["messages"] if message is not parent)
+
+        return page
+
+    def _emoji_list(self, params):
+        return {"emoji": self.workspace.emoji_list()}
+
+    def _files_info(self, params):
+        n = self.workspace.file_index(params.get("file", ""))
+        if n is None:
+            return {"ok": False, "error": "file_not_found"}
+
+        return {"file": self.workspace.file(n)}
+
+    def _files_list(self, params):
+        ts_from = int(params.get("ts_from") or 0)
+        ts_to = int(params.get("ts_to") or 0) or None
+
+        files = [
+            self.workspace.file(n) for n in range(self.workspace.files)
+            if BASE_TS + n >= ts_from and (ts_to is None or BASE_TS + n <= ts_to)
+        ]
+
+        # Newest first, paged by page number like the real files.list
+        files.reverse()
+        count = int(params.get("count") or 100)
+        page = int(params.get("page") or 1)
+        pages = max(1, math.ceil(len(files) / count))
+
+        return {
+            "files": files[(page - 1) * count:page * count],
+            "paging": {"count": count, "total": len(files), "page": page, "pages": pages}
+        }
+
+    def _pins_list(self, params):
+        return {"items": []}
+
+    def _reminders_list(self, params):
+        return {"reminders": []}
+
+    def _team_info(self, params):
+        return {
+            "team": {
+                "id": "T00000001",
+                "name": "Benchmark",
+                "domain": "benchmark",
+                "icon": {"image_68": f"{self.workspace.base_url}/icons/team_68.png", "image_default": True}
+            }
+        }
+
+    def _users_info(self, params):
+        user_id = params.get("user", "")
+        if not user_id.startswith("U") or not user_id[1:].isdigit() or int(user_id[1:]) >= self.workspace.users:
+            return {"ok": False, "error": "user_not_found"}
+
+        return {"user": self.workspace.user(int(user_id[1:]))}
+
+    def _users_list(self, params):
+        users = [self.workspace.user(n) for n in range(self.workspace.users)]
+        return self._cursor_page("members", users, params, default_limit=200)
+
+def add_workspace_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=1000, help="messages per channel")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--emoji", type=int, default=20)
+    parser.add_argument("--thread-ratio", type=float, default=0.05, help="fraction of messages that start a thread")
+    parser.add_argument("--replies", type=int, default=5, help="replies per thread")
+    parser.add_argument("--file-ratio", type=float, default=0.02, help="fraction of messages with a file")
+    parser.add_argument("--file-size", type=int, default=16 * 1024)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--speedup", type=float, default=60.0,
+        help="multiple of Slack's rate limits to allow; 0 disables rate limiting")
+    parser.add_argument("--burst", type=float, default=3.0)
+
+def create_server(args: argparse.Namespace) -> FakeSlackServer:
+    workspace = FakeWorkspace(channels=args.channels, messages=args.messages, users=args.users, files=args.files,
+        emoji=args.emoji, thread_ratio=args.thread_ratio, replies=args.replies, file_ratio=args.file_ratio,
+        file_size=args.file_size, seed=args.seed)
+
+    rate_limits = None
+    if args.speedup > 0:
+        rate_limits = RateLimits(speedup=args.speedup, burst=args.burst)
+
+    return FakeSlackServer(workspace, rate_limits)
+
+async def serve(args: argparse.Namespace):
+    server = create_server(args)
+    url = await server.start(args.host, args.port)
+
+    print(f"Serving a fake Slack workspace at {url}; set SLACK_API_URL={url}/api/")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_workspace_arguments(parser)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
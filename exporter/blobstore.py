@@ -0,0 +1,143 @@
+import contextlib
+import hashlib
+import logging
+import os
+import shutil
+from typing import Dict, Optional
+
+import ujson as json
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where saving the index isn't serialized between processes
+    fcntl = None
+
+log = logging.getLogger("blobstore")
+
+INDEX_JSON_FILE = "index.json"
+INDEX_LOCK_FILE = "index.json.lock"
+
+class BlobStore:
+    """
+    Content-addressed store that keeps every downloaded blob once, by SHA-256.
+
+    Files at their usual export paths are hardlinks into the store (or copies,
+    if the store lives on another filesystem). An index from source URL to
+    digest is kept on disk, so URLs seen in earlier runs, or in exports of
+    other workspaces sharing the store, aren't downloaded again.
+
+    Several processes may save the index at once, such as shards of one
+    export; each merges its entries with the index on disk under a file lock.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = os.path.abspath(directory)
+        self._index_filename = os.path.join(self.directory, INDEX_JSON_FILE)
+        self._index: Dict[str, str] = {}
+        self._dirty = False
+
+        self.deduplicated = 0
+
+    def load(self):
+        self._index.update(self._read_index())
+
+    def save(self):
+        if not self._dirty:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Other exporters may share the store, so merge with what's on disk
+        with self._lock():
+            index = self._read_index()
+            index.update(self._index)
+
+            temp_filename = f"{self._index_filename}.{os.getpid()}.tmp"
+
+            with open(temp_filename, "w") as fd:
+                json.dump(index, fd)
+
+            os.replace(temp_filename, self._index_filename)
+
+        self._dirty = False
+
+        log.info(f"Blob store holds {len(index)} URLs; {self.deduplicated} downloads were deduplicated")
+
+    @contextlib.contextmanager
+    def _lock(self):
+        if fcntl is None:
+            yield
+            return
+
+        with open(os.path.join(self.directory, INDEX_LOCK_FILE), "a") as fd:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _read_index(self) -> Dict[str, str]:
+        if not os.path.isfile(self._index_filename):
+            return {}
+
+        try:
+            with open(self._index_filename, "r") as fd:
+                return json.load(fd)
+        except ValueError as e:
+            log.warning(f"Ignoring unreadable blob index {self._index_filename}", exc_info=e)
+            return {}
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def lookup(self, url: str) -> Optional[str]:
+        """Returns the digest of the blob previously downloaded from `url`, if it is still stored."""
+
+        digest = self._index.get(url)
+
+        if digest is None or not os.path.isfile(self.blob_path(digest)):
+            return None
+
+        return digest
+
+    def remember(self, url: str, digest: str):
+        self._index[url] = digest
+        self._dirty = True
+
+    def ingest(self, filename: str) -> str:
+        """Moves `filename` into the store, or drops it if the store already has its contents."""
+
+        sha = hashlib.sha256()
+
+        with open(filename, "rb") as fd:
+            for chunk in iter(lambda: fd.read(1024 * 1024), b""):
+                sha.update(chunk)
+
+        digest = sha.hexdigest()
+        blob_filename = self.blob_path(digest)
+
+        if os.path.isfile(blob_filename):
+            os.remove(filename)
+            self.deduplicated += 1
+        else:
+            os.makedirs(os.path.dirname(blob_filename), exist_ok=True)
+            os.replace(filename, blob_filename)
+
+        return digest
+
+    def link(self, digest: str, filename: str):
+        """Makes `filename` refer to the blob with the given digest."""
+
+        temp_filename = filename + ".link"
+
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+
+        try:
+            os.link(self.blob_path(digest), temp_filename)
+        except OSError:
+            shutil.copyfile(self.blob_path(digest), temp_filename)
+
+        os.replace(temp_filename, filename)
@@ -0,0 +1,68 @@
+import logging
+import os
+from typing import Any, Dict, Optional
+
+import ujson as json
+
+from . import utils
+
+log = logging.getLogger("cache")
+
+class FileMetadataCache:
+    """
+    Process-wide cache of Slack file metadata, keyed by file ID.
+
+    If a filename is given, the cache can be loaded from and saved to disk so
+    that it carries over between runs.
+    """
+
+    def __init__(self, filename: str = None):
+        self._filename = filename
+        self._files: Dict[str, Dict[str, Any]] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, id: str) -> bool:
+        return id in self._files
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def get(self, id: str) -> Optional[Dict[str, Any]]:
+        data = self._files.get(id)
+
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return data
+
+    def put(self, data: Dict[str, Any]):
+        self._files[data["id"]] = data
+
+    def load(self, filename: str = None):
+        """Loads the cache from its own file, or from another cache's `filename` without taking it over."""
+
+        if filename is None:
+            filename = self._filename
+
+        if filename is None or not os.path.isfile(filename):
+            return
+
+        try:
+            with open(filename, "r") as fd:
+                self._files.update(json.load(fd))
+        except ValueError as e:
+            log.warning(f"Ignoring unreadable file metadata cache {filename}", exc_info=e)
+
+    def save(self):
+        if self._filename is None:
+            return
+
+        os.makedirs(os.path.dirname(self._filename), exist_ok=True)
+
+        utils.write_json_atomic(self._filename, self._files)
+
+        log.info(f"Saved metadata for {len(self._files)} files ({self.hits} hits, {self.misses} misses)")
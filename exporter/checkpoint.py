@@ -0,0 +1,110 @@
+from dataclasses import dataclass, field
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+from . import utils
+from .utils import JsonSerializable
+
+log = logging.getLogger("checkpoint")
+
+def _read_json(filename: str) -> Optional[Dict[str, Any]]:
+    utils.wait_for_writes(filename)
+
+    if not os.path.isfile(filename):
+        return None
+
+    try:
+        with open(filename, "r") as fd:
+            return json.load(fd)
+    except ValueError as e:
+        log.warning(f"Ignoring unreadable checkpoint {filename}", exc_info=e)
+        return None
+
+@dataclass
+class RunCheckpoint(JsonSerializable):
+    """
+    Progress of an export run that hasn't finished yet.
+
+    A run that is restarted picks up the same export window, skipping the
+    phases that already completed.
+    """
+
+    export_time: int
+    last_export_time: int
+    completed_phases: List[str] = field(default_factory=list)
+    phase_state: Dict[str, Any] = field(default_factory=dict)
+
+    def is_phase_complete(self, phase: str) -> bool:
+        return phase in self.completed_phases
+
+    def complete_phase(self, phase: str):
+        if phase not in self.completed_phases:
+            self.completed_phases.append(phase)
+
+    def save(self, filename: str):
+        utils.write_json_atomic(filename, self.to_dict(), barrier=True)
+
+    @staticmethod
+    def remove(filename: str):
+        utils.remove_path(filename)
+
+    @classmethod
+    def load(cls, filename: str) -> Optional["RunCheckpoint"]:
+        data = _read_json(filename)
+
+        if data is None:
+            return None
+
+        return cls(**data)
+
+    @classmethod
+    def load_or_create(cls, filename: str, export_time: int, last_export_time: int) -> "RunCheckpoint":
+        checkpoint = cls.load(filename)
+
+        # Only resume runs that started from the same previous export
+        if checkpoint is not None and checkpoint.last_export_time == last_export_time:
+            log.info(f"Resuming unfinished export started at {checkpoint.export_time}")
+            return checkpoint
+
+        checkpoint = cls(export_time, last_export_time)
+        checkpoint.save(filename)
+
+        return checkpoint
+
+@dataclass
+class ConversationCheckpoint(JsonSerializable):
+    """
+    Progress of a single conversation within the run with the given export_time.
+
+    Slack returns history newest first, so `history_latest_ts` is the oldest
+    message committed so far, and paging resumes just before it.
+    """
+
+    export_time: int
+    pins_complete: bool = False
+    history_latest_ts: Optional[str] = None
+    history_message_count: int = 0
+    # Length of the stored history before merging started, so a merge that
+    # was interrupted can be undone and redone
+    history_merge_length: Optional[int] = None
+    history_complete: bool = False
+    complete: bool = False
+
+    def save(self, filename: str):
+        # Whatever the checkpoint covers has to be on disk before it is
+        utils.write_json_atomic(filename, self.to_dict(), barrier=True)
+
+    @classmethod
+    def load(cls, filename: str, export_time: int) -> "ConversationCheckpoint":
+        data = _read_json(filename)
+
+        # Checkpoints left behind by other runs don't apply
+        if data is None or data.get("export_time") != export_time:
+            return cls(export_time)
+
+        # Saved by earlier versions, which never read it back
+        data.pop("history_cursor", None)
+
+        return cls(**data)
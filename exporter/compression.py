@@ -0,0 +1,114 @@
+import abc
+import gzip
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+class Codec(abc.ABC):
+    """
+    Compresses JSON Lines fragments.
+
+    Appends are written as separate compressed frames, one after another, so
+    data already on disk never has to be recompressed.
+    """
+
+    name = None
+    magic = b""
+    error = Exception
+
+    @abc.abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        pass
+
+    @abc.abstractmethod
+    def _decompressor(self):
+        pass
+
+    def decompress(self, content: bytes):
+        """Decompresses every complete frame in `content`.
+
+        Returns the decompressed data, and the offset just past the last
+        complete frame. Anything after it was cut off mid-write."""
+
+        data = []
+        offset = 0
+
+        while offset < len(content):
+            decompressor = self._decompressor()
+
+            try:
+                data.append(decompressor.decompress(content[offset:]))
+            except self.error:
+                break
+
+            if not decompressor.eof:
+                # The frame's output is only kept once the whole frame is there
+                data.pop()
+                break
+
+            offset = len(content) - len(decompressor.unused_data)
+
+        return (b"".join(data), offset)
+
+class GzipCodec(Codec):
+    name = "gzip"
+    magic = b"\x1f\x8b"
+    error = zlib.error
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+    def _decompressor(self):
+        return zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+
+class ZstdCodec(Codec):
+    name = "zstd"
+    magic = b"\x28\xb5\x2f\xfd"
+
+    def __init__(self, level: int = 3):
+        if zstandard is None:
+            raise RuntimeError("zstd compression needs the zstandard package installed")
+
+        self.level = level
+        self.error = zstandard.ZstdError
+        self._compressor = zstandard.ZstdCompressor(level=level)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def _decompressor(self):
+        return zstandard.ZstdDecompressor().decompressobj()
+
+CODECS = {
+    GzipCodec.name: GzipCodec,
+    ZstdCodec.name: ZstdCodec
+}
+
+def get_codec(name: str, level: int = None) -> Codec:
+    """Returns the codec called `name`, or None for uncompressed storage."""
+
+    if not name:
+        return None
+
+    if name not in CODECS:
+        raise ValueError(f"Unknown compression {name}, expected one of {', '.join(CODECS)}")
+
+    if level is None:
+        return CODECS[name]()
+
+    return CODECS[name](level)
+
+def detect_codec(header: bytes) -> Codec:
+    """Returns the codec that wrote data starting with `header`, or None if it isn't compressed."""
+
+    for codec in CODECS.values():
+        if header.startswith(codec.magic):
+            return codec()
+
+    return None
@@ -0,0 +1,147 @@
+import importlib.util
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict
+
+import aiohttp
+import httpx
+
+log = logging.getLogger("connections")
+
+@dataclass
+class ConnectionSettings:
+    # Connections open at once for file downloads, and how many of them are kept alive when idle
+    max_connections: int = 40
+    max_keepalive_connections: int = 10
+    # Seconds an idle connection is kept open for
+    keepalive_expiry: float = 30.0
+    # Whether downloads may use HTTP/2 (needs the h2 package)
+    http2: bool = False
+    # Connections open at once for Slack API calls
+    api_max_connections: int = 16
+    # Seconds to wait on connecting, or on the server, before giving up
+    timeout: float = 5.0
+
+@dataclass
+class ConnectionStats:
+    requests: int = 0
+    connections: int = 0
+    tls_handshakes: int = 0
+
+    @property
+    def reused(self) -> int:
+        return max(self.requests - self.connections, 0)
+
+    def to_dict(self) -> Dict[str, int]:
+        return {
+            "requests": self.requests,
+            "connections": self.connections,
+            "tls_handshakes": self.tls_handshakes,
+            "reused": self.reused
+        }
+
+class Connections:
+    """
+    Connection pools shared by everything that talks to Slack.
+
+    File downloads go through an httpx client, and API calls through an
+    aiohttp session (which is what `AsyncWebClient` is built on). The two
+    libraries can't share one pool, but both are sized and kept alive from
+    the same `ConnectionSettings`, and both count how many requests were made
+    over how many new connections, so that reuse can be checked in the logs.
+
+    Clients are created on first use, and have to be used from the event
+    loop they were created on. Whoever creates a `Connections` closes it.
+    """
+
+    def __init__(self, settings: ConnectionSettings = None):
+        self.settings = settings if settings is not None else ConnectionSettings()
+
+        self.download_stats = ConnectionStats()
+        self.api_stats = ConnectionStats()
+
+        self._download_client: httpx.AsyncClient = None
+        self._api_session: aiohttp.ClientSession = None
+
+    @property
+    def download_client(self) -> httpx.AsyncClient:
+        if self._download_client is None:
+            self._download_client = self._create_download_client()
+
+        return self._download_client
+
+    @property
+    def api_session(self) -> aiohttp.ClientSession:
+        if self._api_session is None:
+            self._api_session = self._create_api_session()
+
+        return self._api_session
+
+    async def close(self):
+        if self._download_client is not None:
+            await self._download_client.aclose()
+            self._download_client = None
+
+        if self._api_session is not None:
+            await self._api_session.close()
+            self._api_session = None
+
+        for name, stats in (("downloads", self.download_stats), ("API calls", self.api_stats)):
+            if stats.requests > 0:
+                log.info(f"Made {stats.requests} requests for {name} over {stats.connections} connections "
+                         f"({stats.reused} reused, {stats.tls_handshakes} TLS handshakes)")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "downloads": self.download_stats.to_dict(),
+            "api": self.api_stats.to_dict()
+        }
+
+    def _create_download_client(self) -> httpx.AsyncClient:
+        http2 = self.settings.http2
+
+        if http2 and importlib.util.find_spec("h2") is None:
+            log.warning("HTTP/2 needs the h2 package installed (pip install httpx[http2]); using HTTP/1.1")
+            http2 = False
+
+        limits = httpx.Limits(
+            max_connections=self.settings.max_connections,
+            max_keepalive_connections=self.settings.max_keepalive_connections,
+            keepalive_expiry=self.settings.keepalive_expiry
+        )
+
+        # Downloads wait for a free connection for as long as it takes
+        timeout = httpx.Timeout(self.settings.timeout, pool=None)
+
+        return httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2,
+            event_hooks={"request": [self._trace_download]})
+
+    async def _trace_download(self, request: httpx.Request):
+        self.download_stats.requests += 1
+        request.extensions["trace"] = self._on_download_trace
+
+    async def _on_download_trace(self, event: str, info: Dict[str, Any]):
+        if event == "connection.connect_tcp.complete":
+            self.download_stats.connections += 1
+        elif event == "connection.start_tls.complete":
+            self.download_stats.tls_handshakes += 1
+
+    def _create_api_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(limit=self.settings.api_max_connections,
+            keepalive_timeout=self.settings.keepalive_expiry)
+
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(self._on_api_request)
+        trace.on_connection_create_end.append(self._on_api_connection)
+
+        return aiohttp.ClientSession(connector=connector, trace_configs=[trace])
+
+    async def _on_api_request(self, session, context, params: aiohttp.TraceRequestStartParams):
+        self.api_stats.requests += 1
+        context.secure = params.url.scheme == "https"
+
+    async def _on_api_connection(self, session, context, params):
+        self.api_stats.connections += 1
+
+        if getattr(context, "secure", False):
+            self.api_stats.tls_handshakes += 1
@@ -1,17 +1,23 @@
 CONVERSATIONS_EXPORT_DIR = "conversations"
 CONVERSATIONS_JSON_FILE = "conversations.json"
 CONVERSATIONS_TYPES = "public_channel,private_channel,mpim,im"
+CHECKPOINT_JSON_FILE = "checkpoint.json"
 CONTEXT_JSON_FILE = "metadata.json"
 EMOJI_EXPORT_DIR = "emoji"
 EMOJI_JSON_FILE = "emoji.json"
+FILE_CACHE_JSON_FILE = "file_cache.json"
 FILES_EXPORT_DIR = "files"
 FILES_JSON_FILE = "files.json"
 HISTORY_JSON_DIR = "history"
+HISTORY_PARTIAL_DIR = "history.partial"
 ITEM_COUNT_LIMIT = 1000
 PINS_JSON_FILE = "pins.json"
 REMINDERS_JSON_FILE = "reminders.json"
 REPLIES_KEY = "$replies"
+RUN_REPORT_JSON_FILE = "run_report.json"
 TEAM_EXPORT_DIR = "team"
 TEAM_JSON_FILE = "team.json"
+THREADS_JSON_FILE = "threads.json"
+TS_INDEX_JSON_FILE = "ts_index.json"
 USERS_EXPORT_DIR = "users"
 USERS_JSON_FILE = "users.json"
\ No newline at end of file
@@ -1,20 +1,19 @@
-from dataclasses import dataclass
+import asyncio
+from dataclasses import dataclass, field
 import json
 import os
-from typing import Dict, Any
 
 from slack_sdk.web.async_client import AsyncWebClient
 
-from . import constants
+from . import constants, utils
+from .cache import FileMetadataCache
+from .checkpoint import RunCheckpoint
+from .connections import Connections
 from .downloader import FileDownloader
 from .fragment import FragmentFactory
-
-class JsonSerializable:
-    def to_json(self) -> str:
-        return json.dumps(self.__dict__, separators=(',', ':'))
-
-    def to_dict(self) -> Dict[str, Any]:
-        return self.__dict__
+from .shard import ShardPool
+from .utils import JsonSerializable
+from .writer import BackgroundWriter
 
 @dataclass
 class ExporterMetadata(JsonSerializable):
@@ -28,10 +27,28 @@ class ExporterContext:
     downloader: FileDownloader
     fragments: FragmentFactory
     last_export_time: int = 0
+    conversation_workers: int = 1
+    reply_concurrency: int = 8
+    thread_refresh_days: int = 30
+    file_cache: FileMetadataCache = field(default_factory=FileMetadataCache)
+    checkpoint: RunCheckpoint = None
+    writer: BackgroundWriter = None
+    shard_pool: ShardPool = None
+    connections: Connections = None
 
     async def close(self):
-        await self.downloader.close()
-        self.fragments.close()
+        try:
+            await self.downloader.close()
+        finally:
+            self.fragments.close()
+            self.file_cache.save()
+
+            # Everything written so far has to be on disk before we're done
+            if self.writer is not None:
+                await asyncio.get_running_loop().run_in_executor(None, self.writer.close)
+
+            if self.connections is not None:
+                await self.connections.close()
 
     def to_metadata(self) -> ExporterMetadata:
         return ExporterMetadata(self.export_time)
@@ -39,6 +56,27 @@ class ExporterContext:
     def save(self):
         self.downloader.write_json(constants.CONTEXT_JSON_FILE, self.to_metadata().to_dict())
 
+    def save_report(self, prometheus_textfile: str = None):
+        """Writes the run's metrics next to the metadata, and optionally as a Prometheus textfile."""
+
+        report = utils.metrics.to_dict()
+        report["fragment_cache"] = self.fragments.stats()
+
+        if self.writer is not None:
+            report["writer"] = self.writer.stats()
+
+        if self.connections is not None:
+            report["connections"] = self.connections.stats()
+
+        self.downloader.write_json(constants.RUN_REPORT_JSON_FILE, report)
+
+        if prometheus_textfile:
+            utils.write_text_atomic(prometheus_textfile, utils.metrics.to_prometheus())
+
+    def save_checkpoint(self):
+        if self.checkpoint is not None:
+            self.checkpoint.save(os.path.join(self.output_directory, constants.CHECKPOINT_JSON_FILE))
+
     @staticmethod
     def get_last_export_time(base_dir) -> int:
         context_file = os.path.join(base_dir, constants.CONTEXT_JSON_FILE)
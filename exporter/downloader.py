@@ -1,12 +1,20 @@
 import asyncio
-import collections
+import math
 import os
-from typing import Any, List
+import shutil
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 import httpx
 import ujson as json
 
+from . import utils
+from .blobstore import BlobStore
 from .utils import AggregateError
+from .writer import BackgroundWriter
+
+# Suffix of files that are still being downloaded
+PARTIAL_SUFFIX = ".part"
 
 class FileDownloadError(Exception):
     def __init__(self, url: str, inner_exception: Exception):
@@ -18,57 +26,120 @@ class FileDownloadError(Exception):
 
         super(FileDownloadError, self).__init__(message)
 
+class IncompleteDownloadError(Exception):
+    def __init__(self, expected_size: int, actual_size: int):
+        self.expected_size = expected_size
+        self.actual_size = actual_size
+
+        super(IncompleteDownloadError, self).__init__(f"Expected {expected_size} bytes, got {actual_size}")
+
+class RangeNotSupportedError(Exception):
+    def __init__(self, url: str):
+        self.url = url
+
+        super(RangeNotSupportedError, self).__init__(f"Server did not honor the requested byte range (URL: {url})")
+
 class FileDownloader:
     """
     Helper class for asynchronous file downloads.
+
+    Downloads are handed to a fixed pool of workers through a bounded queue.
+    Errors are collected per file and can be picked up with `pop_errors` at
+    any time, without waiting for other downloads to finish.
+
+    Interrupted downloads are resumed with HTTP range requests. Files of at
+    least `chunk_threshold` bytes (when their size is known up front) are
+    fetched as `chunk_count` byte ranges in parallel and then reassembled.
+
+    If a `BlobStore` is given, downloaded bytes are kept there once by content
+    and only linked to at their export paths.
+
+    If a `BackgroundWriter` is given, `write_json` and `append_json_list`
+    hand their work to it instead of writing on the event loop. Appends to a
+    JSON list are made at an offset tracked here, so one that was cut short
+    is overwritten by the next.
+
+    Downloaders in different processes sharing an output directory need
+    their own `partial_suffix`, so they never write to the same partial file.
+
+    Downloads go through `httpclient` if one is given, so that its connection
+    pool is shared; it's left open on `close`. Otherwise the downloader opens
+    a client of its own.
     """
 
-    def __init__(self, output_directory: str, bearer_token: str, concurrency: int = 10):
+    def __init__(self, output_directory: str, bearer_token: str, concurrency: int = 10, queue_size: int = 1000,
+            retries: int = 3, chunk_threshold: int = 64 * 1024 * 1024, chunk_count: int = 4,
+            blob_store: BlobStore = None, writer: BackgroundWriter = None, partial_suffix: str = PARTIAL_SUFFIX,
+            httpclient: httpx.AsyncClient = None):
         self._bearer_token = bearer_token
         self._outdir = output_directory
         self._concurrency = concurrency
-        self._httpclient = httpx.AsyncClient()
-
-        self._waiting_queue = collections.deque()
-        self._download_tasks: List[asyncio.Task] = []
-        self._pending_exceptions: List[Exception] = []
+        self._queue_size = queue_size
+        self._retries = retries
+        self._chunk_threshold = chunk_threshold
+        self._chunk_count = chunk_count
+        self._blob_store = blob_store
+        self._writer = writer
+        self._partial_suffix = partial_suffix
+        self._owns_httpclient = httpclient is None
+        self._httpclient = httpclient if httpclient is not None else httpx.AsyncClient()
+
+        self._queue: asyncio.Queue = None
+        self._workers: List[asyncio.Task] = []
+        self._in_flight: Set[str] = set()
+        self._errors: List[FileDownloadError] = []
+
+        # Offset of the closing bracket, and whether the array is empty, of JSON lists being appended to
+        self._json_lists: Dict[str, Tuple[int, bool]] = {}
 
     async def close(self):
-        """Attempts to finish up all running tasks."""
+        """Attempts to finish up all queued downloads, then stops the workers."""
+
+        try:
+            await self.flush_download_queue()
+        finally:
+            for worker in self._workers:
+                worker.cancel()
 
-        await self.flush_download_queue()
-        await self._httpclient.aclose()
+            await asyncio.gather(*self._workers, return_exceptions=True)
+            self._workers = []
+
+            if self._blob_store is not None:
+                # May wait on other processes saving the index
+                await asyncio.get_running_loop().run_in_executor(None, self._blob_store.save)
+
+            if self._owns_httpclient:
+                await self._httpclient.aclose()
 
     def _ensure_directories_exist(self, filename: str):
         file_dirname = os.path.dirname(filename)
         full_path = os.path.join(self._outdir, file_dirname)
 
-        if not os.path.exists(full_path):
-            os.makedirs(full_path)
+        # The writer thread may be creating the same directory
+        os.makedirs(full_path, exist_ok=True)
 
-    async def _process_waiting_queue(self):
-        i = 0
-        while i < len(self._download_tasks):
-            task, url = self._download_tasks[i]
+    def _start_workers(self):
+        if self._queue is not None:
+            return
 
-            if task.done():
-                task_exc = task.exception()
-                if task_exc is not None:
-                    exc = FileDownloadError(url, task_exc)
-                    self._pending_exceptions.append(exc)
-                else:
-                    await task
+        self._queue = asyncio.Queue(maxsize=self._queue_size)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self._concurrency)]
 
-                del self._download_tasks[i]
-            else:
-                i += 1
+    async def _worker(self):
+        while True:
+            url, filename, kwargs = await self._queue.get()
 
-        while len(self._download_tasks) < self._concurrency and len(self._waiting_queue) > 0:
-            url, args, kwargs = self._waiting_queue.popleft()
-            self.enqueue_download(url, *args, **kwargs)
+            try:
+                await self._download(url, filename, **kwargs)
+            except Exception as e:
+                self._errors.append(FileDownloadError(url, e))
+                utils.metrics.record_download_failure()
+            finally:
+                self._in_flight.discard(filename)
+                self._queue.task_done()
 
-    def enqueue_download(self, url: str, *args, **kwargs):
-        """Queues up the download for future processing, limited by the downloader's concurrency.
+    async def enqueue_download(self, url: str, filename: str = None, **kwargs):
+        """Queues up the download for one of the workers. Waits while the queue is full.
 
         Parameters are equivalent to `_download`, that is:
 
@@ -84,42 +155,59 @@ class FileDownloader:
             Whether to use the bearer token for the download.
         throw_on_nonsuccess : bool, optional
             Whether to throw on a non-success response (4xx, 5xx).
+        size : int, optional
+            The expected size of the file, used for chunking and to verify the download.
         """
 
-        if len(self._download_tasks) >= self._concurrency:
-            self._waiting_queue.append((url, args, kwargs))
-        else:
-            task = asyncio.create_task(self._download(url, *args, **kwargs))
+        if filename is None:
+            filename = self._get_filename(url)
+
+        # The same file may be referenced many times, e.g. from several messages
+        if filename in self._in_flight:
+            return
+
+        self._start_workers()
+
+        self._in_flight.add(filename)
+        await self._queue.put((url, filename, kwargs))
+
+    def pop_errors(self) -> List[FileDownloadError]:
+        """Returns and forgets the errors of all downloads that failed so far."""
+
+        errors, self._errors = self._errors, []
 
-            self._download_tasks.append((task, url))
+        return errors
 
     async def flush_download_queue(self):
         """Finish downloading all queued files."""
 
-        if len(self._download_tasks) == 0 and len(self._waiting_queue) == 0:
-            return
-
-        while len(self._download_tasks) != 0 or len(self._waiting_queue) != 0:
-            all_tasks = map(lambda x: x[0], self._download_tasks)
+        if self._queue is not None:
+            await self._queue.join()
 
-            await asyncio.wait(all_tasks, return_when=asyncio.FIRST_COMPLETED)
-            await self._process_waiting_queue()
+        errors = self.pop_errors()
 
-        if len(self._pending_exceptions) > 0:
-            raise AggregateError("One or more errors occurred.", self._pending_exceptions)
+        if len(errors) > 0:
+            raise AggregateError("One or more errors occurred.", errors)
 
     def exists(self, filename: str) -> bool:
         full_filename = os.path.join(self._outdir, filename)
 
         return os.path.exists(full_filename)
 
-    def _save_file(self, filename: str, content: bytes):
-        full_filename = os.path.join(self._outdir, filename)
-
-        with open(full_filename, "wb") as fd:
-            fd.write(content)
+    def _submit(self, filename: str, fn, *args):
+        if self._writer is None:
+            fn(*args)
+        else:
+            self._writer.submit(os.path.join(self._outdir, filename), fn, *args)
 
     def write_json(self, filename: str, content: Any):
+        """Writes `content` to `filename`. With a writer, `content` must not change afterwards."""
+
+        self._json_lists.pop(filename, None)
+        self._submit(filename, self._write_json, filename, content)
+
+    @utils.profiled("json serialization")
+    def _write_json(self, filename: str, content: Any):
         self._ensure_directories_exist(filename)
 
         full_filename = os.path.join(self._outdir, filename)
@@ -127,6 +215,70 @@ class FileDownloader:
         with open(full_filename, "w") as fd:
             json.dump(content, fd)
 
+    def append_json_list(self, filename: str, items: List[Any]) -> int:
+        """Appends items to the JSON array stored in `filename`, without reading the existing array.
+
+        Returns the length of the array in bytes once written. Handing that to
+        `resume_json_list` later drops whatever was appended after it, such
+        as a half-written page."""
+
+        array_end = self._array_end(filename)
+        encoded = json.dumps(items).encode()
+
+        if array_end is None:
+            offset, data = 0, encoded
+        elif len(items) == 0:
+            return array_end[0] + 1
+        else:
+            # Overwrite the closing bracket with the new items (and a new closing bracket)
+            offset, data = array_end[0], (b"" if array_end[1] else b",") + encoded[1:]
+
+        self._json_lists[filename] = (offset + len(data) - 1, len(items) == 0)
+        self._submit(filename, self._write_at, filename, offset, data)
+
+        return offset + len(data)
+
+    def json_list_length(self, filename: str) -> int:
+        """The length in bytes of the JSON array in `filename`, as `append_json_list` returns it; 0 if there is none."""
+
+        array_end = self._array_end(filename)
+
+        return 0 if array_end is None else array_end[0] + 1
+
+    def resume_json_list(self, filename: str, length: int):
+        """Appends to `filename` from `length`, as returned by `append_json_list`, from now on."""
+
+        self._json_lists[filename] = self._read_array_end(filename, length)
+
+    def _array_end(self, filename: str) -> Optional[Tuple[int, bool]]:
+        if filename not in self._json_lists:
+            self._json_lists[filename] = self._read_array_end(filename)
+
+        return self._json_lists[filename]
+
+    def _read_array_end(self, filename: str, length: int = None) -> Optional[Tuple[int, bool]]:
+        full_filename = os.path.join(self._outdir, filename)
+
+        if self._writer is not None:
+            self._writer.wait(full_filename)
+
+        if not os.path.exists(full_filename):
+            return None
+
+        with open(full_filename, "rb") as fd:
+            return _find_array_end(fd, length)
+
+    def _write_at(self, filename: str, offset: int, data: bytes):
+        self._ensure_directories_exist(filename)
+
+        full_filename = os.path.join(self._outdir, filename)
+
+        # Anything after offset, even a write cut short by a crash, is replaced
+        with open(full_filename, "r+b" if os.path.exists(full_filename) else "wb") as fd:
+            fd.seek(offset)
+            fd.truncate()
+            fd.write(data)
+
     def _get_filename(self, url: str) -> str:
         last_path_element = url.split("/")[-1]
 
@@ -135,7 +287,7 @@ class FileDownloader:
 
         return last_path_element
 
-    async def _download(self, url: str, filename: str = None, overwrite=False, use_auth=False, throw_on_nonsuccess=True):
+    async def _download(self, url: str, filename: str = None, overwrite=False, use_auth=False, throw_on_nonsuccess=True, size: int = None):
         if filename is None:
             filename = self._get_filename(url)
 
@@ -144,16 +296,198 @@ class FileDownloader:
         if self.exists(filename):
             return
 
+        full_filename = os.path.join(self._outdir, filename)
+        loop = asyncio.get_running_loop()
+
+        if self._blob_store is not None:
+            digest = self._blob_store.lookup(url)
+
+            if digest is not None:
+                await loop.run_in_executor(None, self._blob_store.link, digest, full_filename)
+                return
+
         headers = {}
 
         if use_auth:
             headers["Authorization"] = f"Bearer {self._bearer_token}"
 
-        res = await self._httpclient.get(url, headers=headers)
+        temp_filename = full_filename + self._partial_suffix
+        start = time.perf_counter()
+
+        retry = 0
+        while True:
+            try:
+                if size is not None and size >= self._chunk_threshold and self._chunk_count > 1:
+                    try:
+                        await self._download_chunked(url, temp_filename, headers, size)
+                    except RangeNotSupportedError:
+                        await loop.run_in_executor(None, _remove_chunks, temp_filename, self._chunk_count)
+                        await self._download_stream(url, temp_filename, headers, throw_on_nonsuccess)
+                else:
+                    await self._download_stream(url, temp_filename, headers, throw_on_nonsuccess)
+
+                break
+            except httpx.TransportError:
+                # Whatever made it to disk is kept, so the retry picks up where this left off
+                retry += 1
+                if retry > self._retries:
+                    raise
+
+                await asyncio.sleep(retry)
+
+        utils.metrics.record_download(time.perf_counter() - start)
+        utils.tracker.add("downloads")
+
+        if size is not None:
+            actual_size = await loop.run_in_executor(None, os.path.getsize, temp_filename)
+
+            if actual_size != size:
+                if actual_size > size:
+                    await loop.run_in_executor(None, os.remove, temp_filename)
+
+                raise IncompleteDownloadError(size, actual_size)
+
+        if self._blob_store is not None:
+            digest = await loop.run_in_executor(None, self._blob_store.ingest, temp_filename)
+            self._blob_store.remember(url, digest)
+
+            await loop.run_in_executor(None, self._blob_store.link, digest, full_filename)
+            return
+
+        # Only complete downloads ever show up under the real filename
+        await loop.run_in_executor(None, os.replace, temp_filename, full_filename)
+
+    def _partial_size(self, filename: str) -> int:
+        if os.path.exists(filename):
+            return os.path.getsize(filename)
+
+        return 0
+
+    async def _download_stream(self, url: str, temp_filename: str, headers: Dict[str, str], throw_on_nonsuccess: bool):
+        loop = asyncio.get_running_loop()
+
+        # Resume from whatever an earlier attempt left behind
+        offset = await loop.run_in_executor(None, self._partial_size, temp_filename)
+        request_headers = headers
+        if offset > 0:
+            request_headers = dict(headers, Range=f"bytes={offset}-")
+
+        async with self._httpclient.stream("GET", url, headers=request_headers) as res:
+            if offset > 0 and res.status_code == 416:
+                # Nothing left to fetch; the size check decides whether it's complete
+                return
+
+            if throw_on_nonsuccess:
+                res.raise_for_status()
 
-        if throw_on_nonsuccess:
+            restart = False
+            mode = "wb"
+            if offset > 0 and res.status_code == 206:
+                restart = _content_range_start(res) != offset
+                mode = "ab"
+
+            if not restart:
+                await self._write_stream(res, temp_filename, mode)
+                return
+
+        # The server sent some other range than the one asked for; start over from the beginning
+        await loop.run_in_executor(None, os.remove, temp_filename)
+        await self._download_stream(url, temp_filename, headers, throw_on_nonsuccess)
+
+    async def _download_chunked(self, url: str, temp_filename: str, headers: Dict[str, str], size: int):
+        chunk_size = math.ceil(size / self._chunk_count)
+        ranges = [(start, min(start + chunk_size, size) - 1) for start in range(0, size, chunk_size)]
+        chunk_filenames = [f"{temp_filename}.{i}" for i in range(len(ranges))]
+
+        results = await asyncio.gather(
+            *[self._download_range(url, chunk_filename, headers, start, end)
+                for chunk_filename, (start, end) in zip(chunk_filenames, ranges)],
+            return_exceptions=True
+        )
+
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, _concatenate, chunk_filenames, temp_filename)
+
+    async def _download_range(self, url: str, chunk_filename: str, headers: Dict[str, str], start: int, end: int):
+        loop = asyncio.get_running_loop()
+
+        offset = await loop.run_in_executor(None, self._partial_size, chunk_filename)
+        if start + offset > end:
+            return
+
+        headers = dict(headers, Range=f"bytes={start + offset}-{end}")
+
+        async with self._httpclient.stream("GET", url, headers=headers) as res:
             res.raise_for_status()
 
-        self._save_file(filename, res.content)
+            if res.status_code != 206 or _content_range_start(res) != start + offset:
+                raise RangeNotSupportedError(url)
+
+            await self._write_stream(res, chunk_filename, "ab" if offset > 0 else "wb")
+
+    async def _write_stream(self, res: httpx.Response, filename: str, mode: str):
+        loop = asyncio.get_running_loop()
+
+        # Stream the body to disk, doing all file I/O off the event loop, so
+        # that memory use doesn't depend on the size of the file
+        fd = await loop.run_in_executor(None, open, filename, mode)
+
+        try:
+            async for chunk in res.aiter_bytes():
+                await loop.run_in_executor(None, fd.write, chunk)
+                utils.metrics.record_download_bytes(len(chunk))
+        finally:
+            await loop.run_in_executor(None, fd.close)
+
+def _content_range_start(res: httpx.Response) -> int:
+    # Content-Range: bytes 100-199/1000
+    try:
+        return int(res.headers["Content-Range"].split(" ")[1].split("-")[0])
+    except (KeyError, IndexError, ValueError):
+        return -1
+
+def _find_array_end(fd, end: int = None) -> Tuple[int, bool]:
+    # Returns the offset of the closing bracket of the JSON array in fd, and whether the array is empty.
+    # With `end`, the array is the one that ended there when it had `end` bytes; later appends have
+    # since overwritten its closing bracket.
+    if end is None:
+        fd.seek(0, os.SEEK_END)
+        start = max(0, fd.tell() - 64)
+
+        fd.seek(start)
+        tail = fd.read().rstrip()
+    else:
+        start = max(0, end - 64)
+
+        fd.seek(start)
+        tail = fd.read(end - 1 - start) + b"]"
+
+    closing_bracket = start + len(tail) - 1
+
+    if not tail.endswith(b"]"):
+        raise ValueError(f"{fd.name} does not contain a JSON array")
+
+    # No JSON value ends in "[", so this can only be the opening bracket
+    is_empty = tail[:-1].rstrip().endswith(b"[")
+
+    return (closing_bracket, is_empty)
+
+def _concatenate(filenames: List[str], output_filename: str):
+    with open(output_filename, "wb") as output:
+        for filename in filenames:
+            with open(filename, "rb") as fd:
+                shutil.copyfileobj(fd, output)
+
+    for filename in filenames:
+        os.remove(filename)
+
+def _remove_chunks(temp_filename: str, chunk_count: int):
+    for i in range(chunk_count):
+        chunk_filename = f"{temp_filename}.{i}"
 
-        await self._process_waiting_queue()
\ No newline at end of file
+        if os.path.exists(chunk_filename):
+            os.remove(chunk_filename)
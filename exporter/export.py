@@ -1,14 +1,17 @@
+import asyncio
 import json
 import logging
 import os
-import tempfile
-from typing import Any, Dict
+from typing import Any, Awaitable, Callable, Dict, List
 
-from progress.counter import Counter
 from slack_sdk.errors import SlackApiError
 
 from . import constants, models, utils
+from .checkpoint import ConversationCheckpoint, RunCheckpoint
 from .context import ExporterContext
+from .fragment import FragmentedJsonList
+from .threads import ThreadIndex
+from .tsindex import TsIndex
 
 log = logging.getLogger("exporter")
 
@@ -16,8 +19,6 @@ log = logging.getLogger("exporter")
 async def export_emojis(ctx: ExporterContext):
     emojis = await utils.with_retry(ctx.slack_client.emoji_list)
 
-    print("Exporting emojis")
-
     try:
         for emoji, url in emojis["emoji"].items():
             if not url.startswith("https://"):
@@ -25,9 +26,7 @@ async def export_emojis(ctx: ExporterContext):
 
             emoji_filename = os.path.basename(url)
             emoji_fullname = os.path.join(constants.EMOJI_EXPORT_DIR, emoji_filename)
-            ctx.downloader.enqueue_download(url, emoji_fullname, use_auth=True)
-
-        await ctx.downloader.flush_download_queue() # probably catch something here
+            await ctx.downloader.enqueue_download(url, emoji_fullname, use_auth=True)
     except SlackApiError as e:
         log.error("Got an API error while trying to export emojis", exc_info=e)
 
@@ -36,19 +35,16 @@ async def export_emojis(ctx: ExporterContext):
 async def export_team(ctx: ExporterContext):
     team_data = await utils.with_retry(ctx.slack_client.team_info)
 
-    print("Exporting team info")
-
     try:
         for icon_name, icon_url in team_data["team"]["icon"].items():
-            if not icon_url.startswith("https://"):
+            # Alongside the URLs is an "image_default" flag
+            if not isinstance(icon_url, str) or not icon_url.startswith("https://"):
                 continue
 
             icon_filename = os.path.basename(icon_url)
             icon_fullname = os.path.join(constants.TEAM_EXPORT_DIR, icon_filename)
 
-            ctx.downloader.enqueue_download(icon_url, icon_fullname)
-
-        await ctx.downloader.flush_download_queue() # probably catch something here
+            await ctx.downloader.enqueue_download(icon_url, icon_fullname)
     except SlackApiError as e:
         log.error("Got an API error while trying to export team info", exc_info=e)
 
@@ -58,8 +54,6 @@ async def export_reminders(ctx: ExporterContext):
     try:
         reminders = await utils.with_retry(ctx.slack_client.reminders_list)
 
-        print("Exporting reminders")
-
         ctx.downloader.write_json(constants.REMINDERS_JSON_FILE, reminders["reminders"])
     except SlackApiError as e:
         log.error("Got an API error while trying to export reminders", exc_info=e)
@@ -68,98 +62,236 @@ async def export_users(ctx: ExporterContext):
     users_generator = await utils.with_retry(ctx.slack_client.users_list)
     all_users = []
 
-    counter = Counter("Exporting users ")
-
     try:
         async for users in users_generator:
             all_users.extend(users["members"])
             for user in users["members"]:
                 user_obj = models.SlackUser(user)
-                counter.next()
+                utils.tracker.add("users")
 
                 for url, filename in user_obj.get_exportable_data():
                     full_filename = os.path.join(constants.USERS_EXPORT_DIR, filename)
-                    ctx.downloader.enqueue_download(url, full_filename)
-
-        await ctx.downloader.flush_download_queue()
+                    await ctx.downloader.enqueue_download(url, full_filename)
     except SlackApiError as e:
         log.error("Got an API error while trying to export user info", exc_info=e)
 
     ctx.downloader.write_json(os.path.join(constants.USERS_EXPORT_DIR, constants.USERS_JSON_FILE), all_users)
-    counter.finish()
 
-def export_file(ctx: ExporterContext, slack_file: models.SlackFile):
+def log_download_errors(errors: List[Exception]):
+    if len(errors) == 0:
+        return
+
+    log.warning(f"Caught {len(errors)} errors while downloading files.")
+
+    for err in errors:
+        log.warning(str(err))
+
+def report_download_errors(ctx: ExporterContext):
+    # Downloads keep running in the background; just pick up what failed so far
+    log_download_errors(ctx.downloader.pop_errors())
+
+async def finish_downloads(ctx: ExporterContext):
+    try:
+        await ctx.downloader.flush_download_queue()
+    except utils.AggregateError as e:
+        log_download_errors(e.errors)
+
+async def export_file(ctx: ExporterContext, slack_file: models.SlackFile):
     for url, filename in slack_file.get_exportable_data():
         full_filename = os.path.join(constants.FILES_EXPORT_DIR, filename)
-        ctx.downloader.enqueue_download(url, full_filename, use_auth=True)
+        await ctx.downloader.enqueue_download(url, full_filename, use_auth=True, size=slack_file.size)
 
 async def export_files(ctx: ExporterContext):
-    files_generator = utils.AsyncIteratorWithRetry(
-        ctx.slack_client.files_list, count=constants.ITEM_COUNT_LIMIT, ts_to=ctx.export_time #, ts_from=ctx.last_export_time
-    )
-    all_files = []
+    files_kwargs = {"count": constants.ITEM_COUNT_LIMIT, "ts_to": ctx.export_time}
+
+    # files.list's bounds are inclusive, and the last export already covered its export_time
+    if ctx.last_export_time > 0:
+        files_kwargs["ts_from"] = ctx.last_export_time + 1
+
+    # Pages appended to files.json by an interrupted attempt at this run, and its length after them
+    files_state = {}
+    if ctx.checkpoint is not None:
+        files_state = ctx.checkpoint.phase_state.get("files", {})
 
-    counter = Counter("Exporting files ")
+    pages_done = files_state.get("pages", 0)
+
+    if pages_done > 0:
+        files_kwargs["page"] = pages_done + 1
+
+    files_generator = utils.AsyncIteratorWithRetry(ctx.slack_client.files_list, **files_kwargs)
+    files_filename = os.path.join(constants.FILES_EXPORT_DIR, constants.FILES_JSON_FILE)
+
+    # Incremental runs add the new files to the end of the existing list
+    if ctx.last_export_time == 0 and pages_done == 0:
+        ctx.downloader.write_json(files_filename, [])
+
+    # Drops a page that was appended, or cut short, after the last one recorded
+    if "length" in files_state:
+        ctx.downloader.resume_json_list(files_filename, files_state["length"])
+    elif ctx.checkpoint is not None:
+        ctx.checkpoint.phase_state["files"] = {"pages": pages_done, "length": ctx.downloader.json_list_length(files_filename)}
+        ctx.save_checkpoint()
 
     try:
         await files_generator.run()
 
         async for file_resp in files_generator:
-            all_files.extend(file_resp["files"])
             for sfile in file_resp["files"]:
+                ctx.file_cache.put(sfile)
+
                 file_obj = models.SlackFile(sfile)
-                export_file(ctx, file_obj)
-                counter.next()
+                await export_file(ctx, file_obj)
+                utils.tracker.add("files")
 
-            try:
-                await ctx.downloader.flush_download_queue()
-            except utils.AggregateError as e:
-                log.warning(f"Caught {len(e.errors)} errors while downloading files.")
+            length = ctx.downloader.append_json_list(files_filename, file_resp["files"])
 
-                for err in e.errors:
-                    log.warning(str(err))
+            pages_done += 1
+            if ctx.checkpoint is not None:
+                ctx.checkpoint.phase_state["files"] = {"pages": pages_done, "length": length}
+                ctx.save_checkpoint()
+
+            report_download_errors(ctx)
     except SlackApiError as e:
         log.error(f"Got an API error while trying to obtain file info", exc_info=e)
 
-    ctx.downloader.write_json(os.path.join(constants.FILES_EXPORT_DIR, constants.FILES_JSON_FILE), all_files)
-    counter.finish()
-
 async def export_conversations(ctx: ExporterContext):
     convo_generator = utils.AsyncIteratorWithRetry(
         ctx.slack_client.conversations_list, limit=constants.ITEM_COUNT_LIMIT, types=constants.CONVERSATIONS_TYPES
     )
     all_conversations = []
 
-    print("Exporting conversation list")
+    # Conversations are handed off to a fixed pool of workers as the list is
+    # paged in, so one large channel doesn't hold up all of the small ones.
+    # With a shard pool, the workers are other processes.
+    queue = asyncio.Queue()
+    failed: List[str] = []
+    workers = []
+
+    if ctx.shard_pool is not None:
+        ctx.shard_pool.start()
+    else:
+        workers = [asyncio.create_task(_conversation_worker(ctx, queue, failed)) for _ in range(max(1, ctx.conversation_workers))]
 
     try:
         await convo_generator.run()
 
         async for convo_resp in convo_generator:
             all_conversations.extend(convo_resp["channels"])
+            utils.tracker.add("conversations_listed", len(convo_resp["channels"]))
             for convo in convo_resp["channels"]:
-                convo_obj = models.SlackConversation(convo)
-                convo_folder = os.path.join(constants.CONVERSATIONS_EXPORT_DIR, convo_obj.id)
-
-                await export_pins(ctx, convo_obj)
-                await export_conversation_history(ctx, convo_obj)
+                if ctx.shard_pool is not None:
+                    ctx.shard_pool.put(convo)
+                else:
+                    queue.put_nowait(models.SlackConversation(convo))
     except SlackApiError as e:
         log.error("Got an API error while trying to export conversations", exc_info=e)
+    finally:
+        for _ in workers:
+            queue.put_nowait(None)
+
+        await asyncio.gather(*workers)
+
+        if ctx.shard_pool is not None:
+            failed.extend(await ctx.shard_pool.join())
+
+            for shard_metrics in ctx.shard_pool.metrics:
+                utils.metrics.merge(shard_metrics)
 
     ctx.downloader.write_json(os.path.join(constants.CONVERSATIONS_EXPORT_DIR, constants.CONVERSATIONS_JSON_FILE), all_conversations)
 
+    if len(failed) > 0:
+        raise RuntimeError(f"{len(failed)} conversations did not finish exporting; run the exporter again to resume them")
+
+async def _conversation_worker(ctx: ExporterContext, queue: asyncio.Queue, failed: List[str]):
+    while True:
+        convo = await queue.get()
+
+        if convo is None:
+            return
+
+        try:
+            if not await export_conversation(ctx, convo):
+                failed.append(convo.id)
+        except Exception as e:
+            log.error(f"Uncaught {e.__class__.__name__} while exporting conversation {convo.id}", exc_info=e)
+            failed.append(convo.id)
+
+async def export_shard(ctx: ExporterContext, conversations) -> List[str]:
+    """Exports the conversations a `ShardPool` hands to this process, until it sends None.
+
+    Returns the IDs of the conversations that failed."""
+
+    loop = asyncio.get_running_loop()
+
+    # Only take on as many conversations as there are workers, leaving the rest to other shards
+    queue = asyncio.Queue(maxsize=max(1, ctx.conversation_workers))
+    failed: List[str] = []
+    workers = [asyncio.create_task(_conversation_worker(ctx, queue, failed)) for _ in range(max(1, ctx.conversation_workers))]
+
+    try:
+        while True:
+            convo = await loop.run_in_executor(None, conversations.get)
+
+            if convo is None:
+                break
+
+            await queue.put(models.SlackConversation(convo))
+    finally:
+        for _ in workers:
+            await queue.put(None)
+
+        await asyncio.gather(*workers)
+
+    await finish_downloads(ctx)
+
+    return failed
+
+def conversation_checkpoint_filename(ctx: ExporterContext, convo: models.SlackConversation) -> str:
+    return os.path.join(ctx.output_directory, constants.CONVERSATIONS_EXPORT_DIR, convo.id, constants.CHECKPOINT_JSON_FILE)
+
+async def export_conversation(ctx: ExporterContext, convo: models.SlackConversation) -> bool:
+    checkpoint_filename = conversation_checkpoint_filename(ctx, convo)
+    # Waits for the checkpoint's queued writes, off the event loop
+    loop = asyncio.get_running_loop()
+    checkpoint = await loop.run_in_executor(None, ConversationCheckpoint.load, checkpoint_filename, ctx.export_time)
+
+    if checkpoint.complete:
+        log.debug(f"Skipping conversation {convo.name}; already exported")
+        utils.tracker.add("conversations_done")
+        return True
+
+    os.makedirs(os.path.dirname(checkpoint_filename), exist_ok=True)
+
+    if not checkpoint.pins_complete:
+        await export_pins(ctx, convo)
+
+        checkpoint.pins_complete = True
+        checkpoint.save(checkpoint_filename)
+
+    if not checkpoint.history_complete:
+        if not await export_conversation_history(ctx, convo, checkpoint):
+            return False
+
+    # Threads started before this run's window may have gotten new replies since
+    if ctx.last_export_time > 0:
+        await refresh_threads(ctx, convo)
+
+    checkpoint.complete = True
+    checkpoint.save(checkpoint_filename)
+    utils.tracker.add("conversations_done")
+
+    return True
+
 async def export_pins(ctx: ExporterContext, convo: models.SlackConversation):
     try:
         pins = await utils.with_retry(ctx.slack_client.pins_list, channel=convo.id)
 
-        print(f"Exporting conversation pins ({convo.name})")
-
         filename = os.path.join(constants.CONVERSATIONS_EXPORT_DIR, convo.id, constants.PINS_JSON_FILE)
         ctx.downloader.write_json(filename, pins["items"])
     except SlackApiError as e:
         log.error(f"Got an API error while trying to export pins for conversation {convo.id}", exc_info=e)
 
-async def export_conversation_history(ctx: ExporterContext, convo: models.SlackConversation):
+async def export_conversation_history(ctx: ExporterContext, convo: models.SlackConversation, checkpoint: ConversationCheckpoint) -> bool:
     def file_filter(raw_file: Dict[str, Any]) -> bool:
         if "mode" in raw_file and raw_file["mode"] == "tombstone":
             return False
@@ -168,78 +300,275 @@ async def export_conversation_history(ctx: ExporterContext, convo: models.SlackC
 
         return not ctx.downloader.exists(filename)
 
+    checkpoint_filename = conversation_checkpoint_filename(ctx, convo)
+    convo_folder = os.path.join(ctx.output_directory, constants.CONVERSATIONS_EXPORT_DIR, convo.id)
+    history_folder = os.path.join(convo_folder, constants.HISTORY_JSON_DIR)
+
+    # Pages are collected newest first in a partial store next to the history,
+    # so that an interrupted run can pick up where it left off
+    partial_folder = os.path.join(convo_folder, constants.HISTORY_PARTIAL_DIR)
+
+    latest = ctx.export_time
+    if checkpoint.history_latest_ts is not None:
+        latest = checkpoint.history_latest_ts
+    else:
+        utils.remove_path(partial_folder)
+
     history_generator = utils.AsyncIteratorWithRetry(
         ctx.slack_client.conversations_history,
         channel=convo.id,
         limit=constants.ITEM_COUNT_LIMIT,
-        latest=ctx.export_time,
+        latest=latest,
         oldest=ctx.last_export_time
     )
 
-    history_folder = os.path.join(ctx.output_directory, constants.CONVERSATIONS_EXPORT_DIR, convo.id, constants.HISTORY_JSON_DIR)
-
-    history_fragment = ctx.fragments.create(history_folder)
+    temp_fragment = ctx.fragments.create(partial_folder)
 
-    temporary_dir = tempfile.TemporaryDirectory()
-    temp_fragment = ctx.fragments.create(temporary_dir.name)
+    # Pages committed after the checkpoint was last saved are fetched again
+    if checkpoint.history_merge_length is None:
+        temp_fragment.truncate(checkpoint.history_message_count)
 
-    counter = Counter(f"Exporting conversation history ({convo.name}) ")
+    message_count = checkpoint.history_message_count
+    # Only what this run fetched counts towards the progress ETA
+    fetched = 0
 
     try:
-        await history_generator.run()
+        # Everything was already fetched if the merge was interrupted
+        if checkpoint.history_merge_length is None:
+            await history_generator.run()
 
-        async for history_resp in history_generator:
-            for msg in history_resp["messages"]:
-                msg_obj = models.SlackMessage(msg)
+            async for history_resp in history_generator:
+                messages = [models.SlackMessage(msg) for msg in history_resp["messages"]]
 
-                try:
-                    if msg_obj.has_files:
-                        files = await msg_obj.get_files(ctx, file_filter)
+                await populate_replies(ctx, convo, messages)
 
-                        for f in files:
-                            export_file(ctx, f)
-                except SlackApiError as e:
-                    log.error(f"Error while obtaining file metadata for message {msg_obj.ts} in channel {convo.id}", exc_info=e)
+                for msg_obj in messages:
+                    try:
+                        if msg_obj.has_files:
+                            files = await msg_obj.get_files(ctx, file_filter)
 
-                try:
-                    if msg_obj.has_replies:
-                        await msg_obj.populate_replies(ctx, convo)
-                except SlackApiError as e:
-                    log.error(f"Error while obtaining reply metadata for message {msg_obj.ts} in channel {convo.id}", exc_info=e)
+                            for f in files:
+                                await export_file(ctx, f)
+                    except SlackApiError as e:
+                        log.error(f"Error while obtaining file metadata for message {msg_obj.ts} in channel {convo.id}", exc_info=e)
 
-                temp_fragment.append(msg_obj.data)
-                counter.next()
+                    temp_fragment.append(msg_obj.data)
+                    message_count += 1
+                    fetched += 1
+                    utils.tracker.add("messages")
 
-            try:
-                await ctx.downloader.flush_download_queue()
-            except utils.AggregateError as e:
-                log.warning(f"Caught {len(e.errors)} errors while downloading files.")
+                report_download_errors(ctx)
 
-                for err in e.errors:
-                    log.warning(str(err))
+                temp_fragment.commit_fragments()
+                temp_fragment.unload_clean_fragments()
 
-            temp_fragment.commit_fragments()
+                if len(messages) > 0:
+                    checkpoint.history_latest_ts = messages[-1].ts
+                    checkpoint.history_message_count = message_count
+                    checkpoint.save(checkpoint_filename)
     except SlackApiError as e:
         log.error(f"Got an API error while trying to obtain conversation history", exc_info=e)
     except Exception as e:
-        log.error(f"Uncaught {e.__class__.__name__}; you may need to do a full resync", exc_info=e)
+        log.error(f"Uncaught {e.__class__.__name__} while exporting history of {convo.id}; it will resume from here on the next run", exc_info=e)
+
+        temp_fragment.close()
+        return False
+
+    history_fragment = ctx.fragments.create(history_folder)
+    thread_index = load_thread_index(convo_folder, history_fragment)
+
+    if checkpoint.history_merge_length is None:
+        checkpoint.history_merge_length = len(history_fragment)
+        checkpoint.save(checkpoint_filename)
+    else:
+        # Undo whatever part of the merge made it to disk
+        history_fragment.truncate(checkpoint.history_merge_length)
+
+    ts_index = load_ts_index(convo_folder, history_fragment)
+    merge_position = checkpoint.history_merge_length
+
+    def merged_messages():
+        nonlocal merge_position
+
+        # Slack messages are stored in descending order. The partial store is
+        # walked backwards a fragment at a time, so memory use stays bounded.
+        for msg in temp_fragment.stream(reverse=True):
+            position = ts_index.find(msg["ts"]) if "ts" in msg else None
+
+            if position is None:
+                position = merge_position
+                merge_position += 1
+
+                if "ts" in msg:
+                    ts_index.add(msg["ts"], position)
+            elif position < checkpoint.history_merge_length:
+                # Overlapping windows and retried runs fetch some messages
+                # again; the copy fetched last replaces the stored one
+                history_fragment.update(position, msg)
+            else:
+                # Fetched twice within this run; the first copy is kept
+                continue
+
+            thread_index.record(msg, position)
 
-    history_fragment.extend(temp_fragment[::-1]) # Slack messages are stored in descending order
+            if position >= checkpoint.history_merge_length:
+                yield msg
+
+    history_fragment.extend_from(merged_messages())
 
     temp_fragment.close()
     history_fragment.close()
-    temporary_dir.cleanup()
+    thread_index.save()
+    ts_index.save()
+    utils.remove_path(partial_folder)
+
+    checkpoint.history_complete = True
+    checkpoint.save(checkpoint_filename)
+
+    utils.tracker.add("conversations_exported")
+    utils.tracker.add("conversation_messages", fetched)
+
+    log.debug(f"Exported conversation history ({convo.name}): {message_count} messages")
+
+    return True
+
+def load_thread_index(convo_folder: str, history_fragment: FragmentedJsonList) -> ThreadIndex:
+    thread_index = ThreadIndex(os.path.join(convo_folder, constants.THREADS_JSON_FILE))
+
+    if thread_index.exists():
+        thread_index.load()
+    else:
+        # Histories exported before threads were indexed need one full scan
+        thread_index.build(history_fragment)
+
+    return thread_index
+
+def load_ts_index(convo_folder: str, history_fragment: FragmentedJsonList) -> TsIndex:
+    ts_index = TsIndex(os.path.join(convo_folder, constants.TS_INDEX_JSON_FILE))
+    ts_index.load()
+
+    # Histories exported before messages were indexed, or changed behind the
+    # index's back, need one full scan
+    if ts_index.length != len(history_fragment):
+        ts_index.build(history_fragment.stream())
+
+    return ts_index
+
+@utils.profiled("replies")
+async def refresh_threads(ctx: ExporterContext, convo: models.SlackConversation):
+    convo_folder = os.path.join(ctx.output_directory, constants.CONVERSATIONS_EXPORT_DIR, convo.id)
+    history_fragment = ctx.fragments.create(os.path.join(convo_folder, constants.HISTORY_JSON_DIR))
+    thread_index = load_thread_index(convo_folder, history_fragment)
+
+    # Threads that started in this run's window were fetched in full already
+    since = ctx.export_time - ctx.thread_refresh_days * 24 * 60 * 60 if ctx.thread_refresh_days > 0 else 0
+    candidates = [
+        (thread_ts, thread) for thread_ts, thread in thread_index.active_since(since)
+        if float(thread_ts) <= ctx.last_export_time
+    ]
+
+    semaphore = asyncio.Semaphore(max(1, ctx.reply_concurrency))
+    refreshed = 0
+
+    async def refresh(thread_ts: str, thread: Dict[str, Any]):
+        nonlocal refreshed
+
+        async with semaphore:
+            try:
+                replies_iterator = utils.AsyncIteratorWithRetry(
+                    ctx.slack_client.conversations_replies, channel=convo.id, ts=thread_ts, oldest=thread["latest_reply"]
+                )
+                await replies_iterator.run()
+
+                parent = None
+                new_replies = []
+
+                async for reply_resp in replies_iterator:
+                    for msg in reply_resp["messages"]:
+                        if msg["ts"] == thread_ts:
+                            parent = msg
+                        elif float(msg["ts"]) > float(thread["latest_reply"]):
+                            new_replies.append(msg)
+            except SlackApiError as e:
+                log.error(f"Error while refreshing thread {thread_ts} in channel {convo.id}", exc_info=e)
+                return
+
+        if len(new_replies) == 0:
+            return
+
+        stored = history_fragment[thread["index"]]
+        if stored.get("ts") != thread_ts:
+            log.warning(f"Thread {thread_ts} in channel {convo.id} is not where the thread index says it is")
+            return
+
+        # Patch the stored parent with the new reply metadata and replies
+        patched = dict(stored)
+        if parent is not None:
+            patched.update(parent)
+
+        known = set(reply["ts"] for reply in stored.get(constants.REPLIES_KEY, []))
+        patched[constants.REPLIES_KEY] = stored.get(constants.REPLIES_KEY, []) + [
+            reply for reply in new_replies if reply["ts"] not in known
+        ]
+
+        history_fragment.update(thread["index"], patched)
+        thread_index.record(patched, thread["index"])
+        refreshed += 1
+
+    await utils.gather_or_cancel(*[refresh(thread_ts, thread) for thread_ts, thread in candidates])
+
+    history_fragment.close()
+    thread_index.save()
+
+    if refreshed > 0:
+        log.debug(f"Refreshed {refreshed} of {len(candidates)} threads ({convo.name})")
+
+@utils.profiled("replies")
+async def populate_replies(ctx: ExporterContext, convo: models.SlackConversation, messages: List[models.SlackMessage]):
+    # Threads are fetched concurrently, at most ctx.reply_concurrency at a time.
+    # Replies are attached to their message objects in place, so page order is kept.
+    semaphore = asyncio.Semaphore(max(1, ctx.reply_concurrency))
 
-    counter.finish()
+    async def populate(msg_obj: models.SlackMessage):
+        async with semaphore:
+            try:
+                await msg_obj.populate_replies(ctx, convo)
+            except SlackApiError as e:
+                log.error(f"Error while obtaining reply metadata for message {msg_obj.ts} in channel {convo.id}", exc_info=e)
+
+    await utils.gather_or_cancel(*[populate(msg_obj) for msg_obj in messages if msg_obj.has_replies])
 
 def export_metadata(ctx):
     ctx.downloader.write_json(constants.CONTEXT_JSON_FILE, ctx.to_metadata().to_dict())
 
+async def run_phase(ctx: ExporterContext, phase: str, export_fn: Callable[[ExporterContext], Awaitable[None]]):
+    if ctx.checkpoint is not None and ctx.checkpoint.is_phase_complete(phase):
+        log.info(f"Skipping {phase}; already exported")
+        return
+
+    utils.tracker.set_phase(phase)
+
+    with utils.metrics.phase(phase), utils.profile_phase(phase):
+        await export_fn(ctx)
+
+    if ctx.checkpoint is not None:
+        ctx.checkpoint.complete_phase(phase)
+        ctx.save_checkpoint()
+
 async def export_all(ctx: ExporterContext):
-    await export_emojis(ctx)
-    await export_team(ctx)
-    await export_reminders(ctx)
-    await export_users(ctx)
-    await export_files(ctx)
-    await export_conversations(ctx)
-    export_metadata(ctx)
\ No newline at end of file
+    await run_phase(ctx, "emojis", export_emojis)
+    await run_phase(ctx, "team", export_team)
+    await run_phase(ctx, "reminders", export_reminders)
+    await run_phase(ctx, "users", export_users)
+    await run_phase(ctx, "files", export_files)
+    await run_phase(ctx, "conversations", export_conversations)
+
+    utils.tracker.set_phase("downloads")
+
+    with utils.metrics.phase("downloads"), utils.profile_phase("downloads"):
+        await finish_downloads(ctx)
+    export_metadata(ctx)
+
+    # The run is complete; the next one starts from this run's export_time
+    if ctx.checkpoint is not None:
+        RunCheckpoint.remove(os.path.join(ctx.output_directory, constants.CHECKPOINT_JSON_FILE))
\ No newline at end of file
@@ -1,10 +1,28 @@
+import collections
 import math
 import os
 import threading
-import time
 
 import ujson as json
 
+from . import utils
+from .compression import detect_codec, get_codec
+
+# Older lists store each fragment as a single JSON array
+JSON_FORMAT = "{}.json"
+JSONL_FORMAT = "{}.jsonl"
+
+# Record counts and ts bounds of every fragment, so a list can be opened
+# and measured without reading any of them
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+
+def _item_ts(value):
+    if isinstance(value, dict):
+        return value.get("ts")
+
+    return None
+
 class Fragment:
     def __init__(self, index, data):
         self.index = index
@@ -22,60 +40,110 @@ class Fragment:
     def __setitem__(self, item, value):
         self.data[item] = value
 
-class FragmentCommitThreadRunner:
-    def __init__(self, fragment, frequency=900):
-        self.fragment = fragment
-        self.frequency = frequency
-
-        self.thread = threading.Thread(target=self._thread_run)
-        self.unloading = False
-
-    def start(self):
-        self.thread.start()
-
-    def close(self):
-        self.unloading = True
-        self.thread.join()
-
-    def _thread_run(self):
-        i = 0
-        while not self.unloading:
-            if i == self.frequency:
-                self.fragment.commit_fragments()
-                i = 0
-
-            time.sleep(1)
-            i += 1
-
 class FragmentFactory:
-    def __init__(self):
+    def __init__(self, **defaults):
+        self._defaults = defaults
         self._fragments: List[FragmentedJsonList] = []
 
     def close(self):
         for frag in self._fragments:
             frag.close()
 
+    def stats(self):
+        """Sums up the fragment cache counters of every list created so far."""
+
+        totals = {"hits": 0, "misses": 0, "evictions": 0}
+
+        for frag in self._fragments:
+            for key, value in frag.stats().items():
+                totals[key] += value
+
+        return totals
+
     def create(self, *args, **kwargs):
-        frag = FragmentedJsonList(*args, **kwargs)
-        
+        frag = FragmentedJsonList(*args, **dict(self._defaults, **kwargs))
+
         self._fragments.append(frag)
 
         return frag
 
 class FragmentedJsonList:
-    def __init__(self, data_dir, fragment_file_format="{}.json", fragment_size=5000):
+    """
+    A list of JSON values stored on disk as fixed-size fragments.
+
+    New lists store each fragment as JSON Lines (`{n}.jsonl`), so committing
+    appended items only writes the new lines; a fragment is only rewritten
+    in full after `update` or `truncate`, or by `compact`. Lists stored in
+    the older `{n}.json` layout are detected and keep using it until they
+    are compacted.
+
+    With `compression` ("gzip", or "zstd" if zstandard is installed), JSON
+    Lines fragments are written compressed, and each append adds a frame of
+    its own. Compression is detected per fragment when reading, so a list
+    can hold fragments written either way.
+
+    Loaded fragments are kept in an LRU cache, bounded by `max_fragments`
+    and/or (roughly, going by file size) `max_bytes`. Fragments with pending
+    changes are committed before they are evicted.
+
+    Given a `BackgroundWriter`, commits only queue up the writes, and
+    serializing and writing happen on the writer's thread; `writer.flush()`
+    makes them durable. Without one, commits write right away. Either way,
+    this is a blocking API: reading a fragment waits for its queued writes,
+    and committing waits for room in a full queue, holding up the event loop
+    in the meantime.
+    """
+
+    def __init__(self, data_dir, fragment_file_format=None, fragment_size=5000, max_fragments=None, max_bytes=None,
+                 compression=None, writer=None):
         self.fragment_size = fragment_size
         self.data_dir = os.path.abspath(data_dir)
-        self.fragment_file_format = fragment_file_format
+        self.max_fragments = max_fragments
+        self.max_bytes = max_bytes
+        self.writer = writer
+
+        # Another list over the same directory may still have writes queued
+        if self.writer is not None:
+            self.writer.wait(self.data_dir)
 
         if not os.path.exists(self.data_dir):
             os.makedirs(self.data_dir)
 
+        if fragment_file_format is None:
+            fragment_file_format = JSON_FORMAT if self._has_fragments(JSON_FORMAT) else JSONL_FORMAT
+
+        self.fragment_file_format = fragment_file_format
+        self.is_jsonl = fragment_file_format.endswith(".jsonl")
+
+        # Fragments written from now on are compressed with this; existing ones
+        # are read, and appended to, with whatever they were written with
+        self.codec = get_codec(compression)
+        self.fragment_codecs = dict()
+
+        # For JSON Lines fragments: how many items, and how many bytes, of
+        # each fragment are known to be on disk. Appends start from there.
+        # The byte counts are only known once a write has been made, so they
+        # are kept up to date by the writes themselves, under _bytes_lock
+        # along with fragment_bytes.
+        self.persisted = dict()
+        self.persisted_bytes = dict()
+        self._bytes_lock = threading.Lock()
+        self.rewrite_fragments = set()
+
         self.file_map = dict()
-        self.fragment_map = dict()
+        self.fragment_map = collections.OrderedDict()
+        self.fragment_bytes = dict()
         self.dirty_fragments = set()
         self.fragment_count = 0
 
+        # Manifest entries for every fragment whose contents on disk are known
+        self.fragment_info = dict()
+        self.manifest_dirty = False
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
         self.load_file_map()
 
         if self.fragment_count == 0:
@@ -86,7 +154,24 @@ class FragmentedJsonList:
         self.file_map.clear()
         self.fragment_map.clear()
         self.dirty_fragments.clear()
+        self.persisted.clear()
+        self.rewrite_fragments.clear()
+        self.fragment_info.clear()
+        self.fragment_codecs.clear()
+
+        with self._bytes_lock:
+            self.fragment_bytes.clear()
+
+    def _submit(self, path, fn, *args):
+        if self.writer is None:
+            fn(*args)
+        else:
+            self.writer.submit(path, fn, *args)
+
+    def _has_fragments(self, fragment_file_format):
+        return os.path.isfile(os.path.join(self.data_dir, fragment_file_format.format(0)))
 
+    @utils.profiled("json serialization")
     def _write_json(self, filename, data):
         with open(filename, "w") as fd:
             json.dump(data, fd)
@@ -95,7 +180,180 @@ class FragmentedJsonList:
         with open(filename, "r") as fd:
             return json.load(fd)
 
+    @utils.profiled("json serialization")
+    def _encode_jsonl(self, data, codec):
+        encoded = b"".join(json.dumps(value).encode() + b"\n" for value in data)
+
+        if codec is not None:
+            encoded = codec.compress(encoded)
+
+        return encoded
+
+    def _write_jsonl(self, filename, data):
+        encoded = self._encode_jsonl(data, self.codec)
+
+        temp_filename = filename + ".tmp"
+        with open(temp_filename, "wb") as fd:
+            fd.write(encoded)
+
+        os.replace(temp_filename, filename)
+
+        return len(encoded)
+
+    def _append_jsonl(self, filename, data, offset, codec=None):
+        encoded = self._encode_jsonl(data, codec)
+
+        # Anything after the last known good line is a torn write; overwrite it
+        with open(filename, "r+b" if os.path.exists(filename) else "wb") as fd:
+            fd.seek(offset)
+            fd.truncate()
+            fd.write(encoded)
+
+        return offset + len(encoded)
+
+    def _read_jsonl(self, filename):
+        with open(filename, "rb") as fd:
+            content = fd.read()
+
+        codec = detect_codec(content[:4])
+
+        # Only whole frames are decompressed, so what's left is whole lines
+        if codec is not None:
+            content, persisted_bytes = codec.decompress(content)
+
+        data = []
+        offset = 0
+
+        while offset < len(content):
+            end = content.find(b"\n", offset)
+
+            # A line without a newline was cut off mid-write
+            if end == -1:
+                break
+
+            data.append(json.loads(content[offset:end]))
+            offset = end + 1
+
+        if codec is None:
+            persisted_bytes = offset
+
+        return (data, persisted_bytes, codec)
+
+    def _file_size(self, filename):
+        try:
+            return os.path.getsize(filename)
+        except OSError:
+            return None
+
+    def _manifest_filename(self):
+        return os.path.join(self.data_dir, MANIFEST_FILE)
+
+    def _read_manifest(self):
+        filename = self._manifest_filename()
+
+        if not os.path.isfile(filename):
+            return None
+
+        try:
+            with open(filename, "r") as fd:
+                return json.load(fd)
+        except ValueError:
+            return None
+
+    def _write_manifest(self, manifest):
+        filename = self._manifest_filename()
+        temp_filename = filename + ".tmp"
+
+        with open(temp_filename, "w") as fd:
+            json.dump(manifest, fd)
+
+        os.replace(temp_filename, filename)
+
+    def _record_fragment(self, fragment, data, persisted_bytes):
+        info = {
+            "count": len(data),
+            "bytes": persisted_bytes,
+            "first_ts": _item_ts(data[0]) if len(data) > 0 else None,
+            "last_ts": _item_ts(data[-1]) if len(data) > 0 else None
+        }
+
+        self.fragment_info[fragment] = info
+
+        return info
+
+    def save_manifest(self):
+        """Writes the manifest for every fragment, as of the last commit."""
+
+        last_index = self.fragment_count - 1
+
+        if last_index not in self.fragment_info:
+            self.load_fragment(last_index)
+
+        fragments = []
+        for fragment in range(self.fragment_count):
+            info = self.fragment_info.get(fragment)
+
+            # Fragments before the last are always full, even if we haven't read them
+            if info is None:
+                info = {"count": self.fragment_size, "bytes": None, "first_ts": None, "last_ts": None}
+
+            fragments.append((self.file_map[fragment], info))
+
+        self._submit(self._manifest_filename(), self._save_manifest, self.fragment_file_format, fragments)
+
+        self.manifest_dirty = False
+
+    def _save_manifest(self, fragment_file_format, fragments):
+        # Byte counts are filled in by the fragment writes queued before this one
+        self._write_manifest({
+            "version": MANIFEST_VERSION,
+            "format": fragment_file_format,
+            "fragment_size": self.fragment_size,
+            "fragments": [
+                info if info["bytes"] is not None else dict(info, bytes=self._file_size(filename))
+                for filename, info in fragments
+            ]
+        })
+
+    def load_manifest(self):
+        """Fills in the file map from the manifest, if there is one that matches the fragments on disk."""
+
+        manifest = self._read_manifest()
+
+        if manifest is None or manifest.get("version") != MANIFEST_VERSION:
+            return False
+
+        if manifest.get("format") != self.fragment_file_format or manifest.get("fragment_size") != self.fragment_size:
+            return False
+
+        fragments = manifest.get("fragments") or []
+        if len(fragments) == 0:
+            return False
+
+        dir_format = os.path.join(self.data_dir, self.fragment_file_format)
+        last_index = len(fragments) - 1
+
+        # The manifest is written after the fragments, so a run that died in
+        # between leaves a newer fragment, or a last fragment of another size
+        if os.path.isfile(dir_format.format(last_index + 1)):
+            return False
+
+        last_bytes = fragments[last_index].get("bytes")
+        if last_bytes is None or self._file_size(dir_format.format(last_index)) != last_bytes:
+            return False
+
+        for fragment, info in enumerate(fragments):
+            self.file_map[fragment] = dir_format.format(fragment)
+            self.fragment_info[fragment] = info
+
+        self.fragment_count = len(fragments)
+
+        return True
+
     def load_file_map(self):
+        if self.load_manifest():
+            return
+
         dir_format = os.path.join(self.data_dir, self.fragment_file_format)
 
         self.fragment_count = 0
@@ -118,26 +376,155 @@ class FragmentedJsonList:
     def is_fragment_loaded(self, fragment):
         return fragment in self.fragment_map.keys()
 
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
     def load_fragment(self, fragment):
         if fragment not in self.file_map.keys():
             raise RuntimeError()
 
         if self.is_fragment_loaded(fragment):
+            self.hits += 1
+            self.fragment_map.move_to_end(fragment)
             return
 
+        self.misses += 1
+
         fragment_file = self.file_map[fragment]
 
-        fragment_data = self._read_json(fragment_file)
+        if self.writer is not None:
+            self.writer.wait(fragment_file)
+
+        if self.is_jsonl:
+            fragment_data, persisted_bytes, codec = self._read_jsonl(fragment_file)
+            self.persisted[fragment] = len(fragment_data)
+
+            with self._bytes_lock:
+                self.persisted_bytes[fragment] = persisted_bytes
+
+            self.fragment_codecs[fragment] = codec if persisted_bytes > 0 else self.codec
+        else:
+            fragment_data = self._read_json(fragment_file)
+            persisted_bytes = self._file_size(fragment_file)
+
+        if fragment not in self.fragment_info:
+            self._record_fragment(fragment, fragment_data, persisted_bytes)
+
         self.fragment_map[fragment] = Fragment(fragment, fragment_data)
 
+        if self.max_bytes is not None:
+            size = os.path.getsize(fragment_file)
+
+            with self._bytes_lock:
+                self.fragment_bytes[fragment] = size
+
+        self._evict()
+
+    def _is_over_budget(self):
+        if self.max_fragments is not None and len(self.fragment_map) > self.max_fragments:
+            return True
+
+        if self.max_bytes is not None:
+            with self._bytes_lock:
+                resident = sum(self.fragment_bytes.get(fragment, 0) for fragment in self.fragment_map)
+
+            return resident > self.max_bytes
+
+        return False
+
+    def _evict(self):
+        # The most recently used fragment always stays, whatever the budget
+        while len(self.fragment_map) > 1 and self._is_over_budget():
+            fragment = next(iter(self.fragment_map))
+
+            self.unload_fragment(fragment)
+            self.evictions += 1
+
+    def unload_fragment(self, fragment):
+        """Drops a fragment from memory, committing it first if it has changes."""
+
+        if not self.is_fragment_loaded(fragment):
+            return
+
+        if fragment in self.dirty_fragments:
+            self._write_fragment(fragment)
+
+        del self.fragment_map[fragment]
+
+    def unload_clean_fragments(self):
+        """Drops every fragment without pending changes from memory, except the last one."""
+
+        last_index = self.fragment_count - 1
+
+        for fragment in list(self.fragment_map.keys()):
+            if fragment != last_index and fragment not in self.dirty_fragments:
+                del self.fragment_map[fragment]
+
+    @utils.profiled("fragment commits")
     def commit_fragments(self):
-        for fragment in self.dirty_fragments:
-            fragment_file = self.file_map[fragment]
-            fragment_data = self.fragment_map[fragment]
+        for fragment in list(self.dirty_fragments):
+            self._write_fragment(fragment)
 
-            self._write_json(fragment_file, fragment_data.data)
+        if self.manifest_dirty:
+            self.save_manifest()
 
-        self.dirty_fragments.clear()
+    def _write_fragment(self, fragment):
+        fragment_file = self.file_map[fragment]
+        data = self.fragment_map[fragment].data
+
+        # The byte count is filled in once the write is made
+        info = self._record_fragment(fragment, data, None)
+
+        # Writes get a copy of the items, as the fragment keeps changing in the meantime
+        if not self.is_jsonl:
+            self._submit(fragment_file, self._commit_json, fragment, fragment_file, list(data), info)
+        elif fragment in self.rewrite_fragments or fragment not in self.persisted:
+            self._submit(fragment_file, self._commit_jsonl, fragment, fragment_file, list(data), info)
+            self.fragment_codecs[fragment] = self.codec
+        else:
+            self._submit(fragment_file, self._commit_jsonl_append, fragment, fragment_file,
+                         data[self.persisted[fragment]:], self.fragment_codecs.get(fragment, self.codec), info)
+
+        self.persisted[fragment] = len(data)
+        self.dirty_fragments.discard(fragment)
+        self.rewrite_fragments.discard(fragment)
+        self.manifest_dirty = True
+
+    def _commit_json(self, fragment, filename, data, info):
+        self._write_json(filename, data)
+        self._committed(fragment, self._file_size(filename), info)
+
+    def _commit_jsonl(self, fragment, filename, data, info):
+        self._committed(fragment, self._write_jsonl(filename, data), info)
+
+    def _commit_jsonl_append(self, fragment, filename, data, codec, info):
+        with self._bytes_lock:
+            offset = self.persisted_bytes.get(fragment, 0)
+
+        self._committed(fragment, self._append_jsonl(filename, data, offset, codec), info)
+
+    def _committed(self, fragment, persisted_bytes, info):
+        info["bytes"] = persisted_bytes
+
+        with self._bytes_lock:
+            self.persisted_bytes[fragment] = persisted_bytes
+
+            if self.max_bytes is not None:
+                self.fragment_bytes[fragment] = persisted_bytes or 0
+
+    def _remove_fragment(self, fragment, filename):
+        with self._bytes_lock:
+            self.persisted_bytes.pop(fragment, None)
+
+        self._remove_file(filename)
+
+    def _remove_file(self, filename):
+        if os.path.isfile(filename):
+            os.remove(filename)
+
+    def _set_persisted_bytes(self, fragment, persisted_bytes):
+        with self._bytes_lock:
+            self.persisted_bytes[fragment] = persisted_bytes
 
     def create_new_fragment(self):
         fragment_index = self.fragment_count
@@ -146,9 +533,82 @@ class FragmentedJsonList:
         self.file_map[fragment_index] = fragment_name
         self.fragment_map[fragment_index] = Fragment(fragment_index, [])
         self.dirty_fragments.add(fragment_index)
+        self.persisted[fragment_index] = 0
+        self.fragment_codecs[fragment_index] = self.codec
+        self._submit(fragment_name, self._set_persisted_bytes, fragment_index, 0)
 
         self.fragment_count += 1
 
+        self._evict()
+
+    def truncate(self, length):
+        """Drops every item from `length` onwards, and commits the result."""
+
+        if length >= len(self):
+            return
+
+        keep = max(1, math.ceil(length / self.fragment_size))
+
+        for fragment in range(keep, self.fragment_count):
+            self._submit(self.file_map[fragment], self._remove_fragment, fragment, self.file_map[fragment])
+
+            del self.file_map[fragment]
+            self.fragment_map.pop(fragment, None)
+            self.dirty_fragments.discard(fragment)
+            self.persisted.pop(fragment, None)
+            self.rewrite_fragments.discard(fragment)
+            self.fragment_info.pop(fragment, None)
+            self.fragment_codecs.pop(fragment, None)
+
+            with self._bytes_lock:
+                self.fragment_bytes.pop(fragment, None)
+
+        self.fragment_count = keep
+        self.manifest_dirty = True
+
+        last_index = keep - 1
+        self.load_fragment(last_index)
+        del self.fragment_map[last_index].data[length - last_index * self.fragment_size:]
+        self.dirty_fragments.add(last_index)
+        self.rewrite_fragments.add(last_index)
+
+        self.commit_fragments()
+
+    def compact(self):
+        """Rewrites every fragment in full, one at a time, as JSON Lines.
+
+        This converts lists stored in the older `{n}.json` layout, and
+        recompresses fragments with the list's codec."""
+
+        self.commit_fragments()
+
+        old_files = dict(self.file_map)
+        old_format = self.is_jsonl
+
+        for fragment in range(self.fragment_count):
+            self.load_fragment(fragment)
+            data = self.fragment_map[fragment].data
+
+            filename = os.path.join(self.data_dir, JSONL_FORMAT.format(fragment))
+            info = self._record_fragment(fragment, data, None)
+            self._submit(filename, self._commit_jsonl, fragment, filename, list(data), info)
+
+            self.file_map[fragment] = filename
+            self.persisted[fragment] = len(data)
+            self.fragment_codecs[fragment] = self.codec
+
+            if fragment != self.fragment_count - 1:
+                del self.fragment_map[fragment]
+
+        self.fragment_file_format = JSONL_FORMAT
+        self.is_jsonl = True
+
+        self.save_manifest()
+
+        if not old_format:
+            for filename in old_files.values():
+                self._submit(filename, self._remove_file, filename)
+
     def update(self, index, value):
         if index < 0:
             index += len(self)
@@ -161,8 +621,9 @@ class FragmentedJsonList:
         # update value
         self.fragment_map[fragment][fragment_index] = value
 
-        # mark as dirty
+        # mark as dirty, and as needing more than an append
         self.dirty_fragments.add(fragment)
+        self.rewrite_fragments.add(fragment)
 
     def append(self, value):
         self.extend([value])
@@ -198,10 +659,90 @@ class FragmentedJsonList:
             # even more fragments if the list is THAT big
             self.extend(values[size_to_add:])
 
-    def get(self, fragment, fragment_index):
-        if not self.is_fragment_loaded(fragment):
+    def extend_from(self, iterable):
+        """Extends the list from any iterable, one fragment's worth at a time.
+
+        Full fragments are committed and dropped from memory as they are
+        written, so arbitrarily long iterables can be appended."""
+
+        batch = []
+
+        for value in iterable:
+            batch.append(value)
+
+            if len(batch) == self.fragment_size:
+                self._extend_batch(batch)
+                batch = []
+
+        self._extend_batch(batch)
+
+    def _extend_batch(self, batch):
+        self.extend(batch)
+        self.commit_fragments()
+        self.unload_clean_fragments()
+
+    def stream(self, reverse=False):
+        """Iterates over the list one fragment at a time.
+
+        Fragments that weren't already in memory are dropped again once they
+        have been iterated over."""
+
+        fragments = range(self.fragment_count)
+        if reverse:
+            fragments = reversed(fragments)
+
+        for fragment in fragments:
+            was_loaded = self.is_fragment_loaded(fragment)
             self.load_fragment(fragment)
 
+            data = self.fragment_map[fragment].data
+            yield from (reversed(data) if reverse else data)
+
+            if not was_loaded:
+                self.unload_fragment(fragment)
+
+    def fragments_in_range(self, oldest=None, latest=None):
+        """Fragments that may hold items with a ts between `oldest` and `latest`, inclusive.
+
+        Only the ts bounds in the manifest are consulted; fragments whose
+        bounds aren't known, or that have uncommitted changes, are always included."""
+
+        fragments = []
+
+        for fragment in range(self.fragment_count):
+            info = self.fragment_info.get(fragment)
+
+            if info is not None and fragment not in self.dirty_fragments and info["first_ts"] is not None and info["last_ts"] is not None:
+                low, high = sorted((float(info["first_ts"]), float(info["last_ts"])))
+
+                if (oldest is not None and high < float(oldest)) or (latest is not None and low > float(latest)):
+                    continue
+
+            fragments.append(fragment)
+
+        return fragments
+
+    def seek_ts(self, ts):
+        """Index of the first item whose ts is at least `ts`, in a list kept oldest first.
+
+        Returns the length of the list if every item is older."""
+
+        ts = float(ts)
+
+        for fragment in self.fragments_in_range(oldest=ts):
+            self.load_fragment(fragment)
+
+            for index, value in enumerate(self.fragment_map[fragment].data):
+                value_ts = _item_ts(value)
+
+                if value_ts is not None and float(value_ts) >= ts:
+                    return fragment * self.fragment_size + index
+
+        return len(self)
+
+    def get(self, fragment, fragment_index):
+        self.load_fragment(fragment)
+
         return self.fragment_map[fragment][fragment_index]
 
     def __iter__(self):
@@ -217,8 +758,16 @@ class FragmentedJsonList:
 
     def __len__(self):
         last_fragment_index = self.fragment_count - 1
-        self.load_fragment(last_fragment_index)
-        return last_fragment_index * self.fragment_size + len(self.fragment_map[last_fragment_index])
+
+        if self.is_fragment_loaded(last_fragment_index):
+            last_count = len(self.fragment_map[last_fragment_index])
+        elif last_fragment_index in self.fragment_info:
+            last_count = self.fragment_info[last_fragment_index]["count"]
+        else:
+            self.load_fragment(last_fragment_index)
+            last_count = len(self.fragment_map[last_fragment_index])
+
+        return last_fragment_index * self.fragment_size + last_count
 
     def __getitem__(self, index):
         if isinstance(index, slice):
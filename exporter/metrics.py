@@ -0,0 +1,234 @@
+import bisect
+import contextlib
+import time
+from typing import Any, Dict, List, Sequence
+
+# Upper bounds of the API call latency buckets, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Prefix of every metric in the Prometheus textfile
+PROMETHEUS_PREFIX = "slack_exporter"
+
+class Histogram:
+    """Counts observations into fixed buckets, like a Prometheus histogram (but not cumulative)."""
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, data: Dict[str, Any]):
+        for n, count in enumerate(data["counts"]):
+            self.counts[n] += count
+
+        self.sum += data["sum"]
+        self.count += data["count"]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"buckets": list(self.buckets), "counts": list(self.counts), "sum": self.sum, "count": self.count}
+
+class MethodMetrics:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.rate_limited = 0
+        # Seconds slept after 429s, and seconds spent waiting on our own pacing
+        self.backoff_time = 0.0
+        self.pacing_time = 0.0
+        self.latency = Histogram()
+
+    def merge(self, data: Dict[str, Any]):
+        self.calls += data["calls"]
+        self.errors += data["errors"]
+        self.rate_limited += data["rate_limited"]
+        self.backoff_time += data["backoff_time"]
+        self.pacing_time += data["pacing_time"]
+        self.latency.merge(data["latency"])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "rate_limited": self.rate_limited,
+            "backoff_time": self.backoff_time,
+            "pacing_time": self.pacing_time,
+            "latency": self.latency.to_dict()
+        }
+
+class Metrics:
+    """
+    Counts what an export spends its time on: calls per Slack API method
+    and how long they took, rate limiting, the wall time of each phase, and
+    downloads.
+
+    Metrics from other processes are added in with `merge`, from their
+    `to_dict`.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.methods: Dict[str, MethodMetrics] = {}
+        self.phases: Dict[str, float] = {}
+
+        self.files_downloaded = 0
+        self.files_failed = 0
+        self.bytes_downloaded = 0
+        # Seconds spent downloading, summed over files, and when the first download started and the last one
+        # ended, in wall clock time so they compare across processes
+        self.download_time = 0.0
+        self.first_download: float = None
+        self.last_download: float = None
+
+    def method(self, name: str) -> MethodMetrics:
+        if name not in self.methods:
+            self.methods[name] = MethodMetrics()
+
+        return self.methods[name]
+
+    def record_call(self, method: str, seconds: float, error: bool = False):
+        metrics = self.method(method)
+        metrics.calls += 1
+        metrics.latency.observe(seconds)
+
+        if error:
+            metrics.errors += 1
+
+    def record_rate_limited(self, method: str, backoff: float):
+        metrics = self.method(method)
+        metrics.rate_limited += 1
+        metrics.backoff_time += backoff
+
+    def record_pacing(self, method: str, seconds: float):
+        self.method(method).pacing_time += seconds
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """Adds the time spent in the block to the phase called `name`."""
+
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def record_download(self, seconds: float):
+        now = time.time()
+
+        self.files_downloaded += 1
+        self.download_time += seconds
+        self._record_download_span(now - seconds, now)
+
+    def _record_download_span(self, first: float, last: float):
+        if self.first_download is None or first < self.first_download:
+            self.first_download = first
+
+        if self.last_download is None or last > self.last_download:
+            self.last_download = last
+
+    def record_download_bytes(self, count: int):
+        self.bytes_downloaded += count
+
+    def record_download_failure(self):
+        self.files_failed += 1
+
+    @property
+    def download_throughput(self) -> float:
+        """Bytes downloaded per second, from the start of the first download to the end of the last."""
+
+        if self.first_download is None or self.last_download <= self.first_download:
+            return 0.0
+
+        return self.bytes_downloaded / (self.last_download - self.first_download)
+
+    def merge(self, data: Dict[str, Any]):
+        for name, method in data["methods"].items():
+            self.method(name).merge(method)
+
+        for name, seconds in data["phases"].items():
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+        downloads = data["downloads"]
+        self.files_downloaded += downloads["files"]
+        self.files_failed += downloads["failed"]
+        self.bytes_downloaded += downloads["bytes"]
+        self.download_time += downloads["time"]
+
+        if downloads["first"] is not None:
+            self._record_download_span(downloads["first"], downloads["last"])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "started": self.started,
+            "duration": time.time() - self.started,
+            "methods": {name: method.to_dict() for name, method in sorted(self.methods.items())},
+            "phases": dict(self.phases),
+            "downloads": {
+                "files": self.files_downloaded,
+                "failed": self.files_failed,
+                "bytes": self.bytes_downloaded,
+                "time": self.download_time,
+                "first": self.first_download,
+                "last": self.last_download,
+                "throughput": self.download_throughput
+            }
+        }
+
+    def to_prometheus(self) -> str:
+        """The metrics in Prometheus' text format, for node_exporter's textfile collector."""
+
+        lines: List[str] = []
+
+        def metric(name: str, kind: str, help: str, samples):
+            name = f"{PROMETHEUS_PREFIX}_{name}"
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+
+            for suffix, labels, value in samples:
+                label_text = ",".join(f'{key}="{value}"' for key, value in labels.items())
+                lines.append(f"{name}{suffix}{{{label_text}}} {value}" if label_text else f"{name}{suffix} {value}")
+
+        methods = sorted(self.methods.items())
+
+        metric("api_calls_total", "counter", "Slack API calls made, by method.",
+            [("", {"method": name}, method.calls) for name, method in methods])
+        metric("api_errors_total", "counter", "Slack API calls that failed, by method.",
+            [("", {"method": name}, method.errors) for name, method in methods])
+        metric("api_rate_limited_total", "counter", "Slack API calls rejected with a 429, by method.",
+            [("", {"method": name}, method.rate_limited) for name, method in methods])
+        metric("api_backoff_seconds_total", "counter", "Seconds slept after 429s, by method.",
+            [("", {"method": name}, method.backoff_time) for name, method in methods])
+        metric("api_pacing_seconds_total", "counter", "Seconds spent pacing calls under the rate limits, by method.",
+            [("", {"method": name}, method.pacing_time) for name, method in methods])
+
+        latency = []
+        for name, method in methods:
+            cumulative = 0
+
+            for bound, count in zip(method.latency.buckets + ("+Inf",), method.latency.counts):
+                cumulative += count
+                latency.append(("_bucket", {"method": name, "le": bound}, cumulative))
+
+            latency.append(("_sum", {"method": name}, method.latency.sum))
+            latency.append(("_count", {"method": name}, method.latency.count))
+
+        metric("api_call_duration_seconds", "histogram", "Slack API call latency, by method.", latency)
+
+        metric("phase_duration_seconds", "gauge", "Wall time of each export phase in the last run.",
+            [("", {"phase": name}, seconds) for name, seconds in self.phases.items()])
+
+        metric("download_files_total", "counter", "Files downloaded in the last run.", [("", {}, self.files_downloaded)])
+        metric("download_failures_total", "counter", "Files that failed to download in the last run.",
+            [("", {}, self.files_failed)])
+        metric("download_bytes_total", "counter", "Bytes downloaded in the last run.", [("", {}, self.bytes_downloaded)])
+        metric("download_bytes_per_second", "gauge", "Download throughput in the last run.",
+            [("", {}, self.download_throughput)])
+        metric("last_run_timestamp_seconds", "gauge", "When the last run started.", [("", {}, self.started)])
+
+        return "\n".join(lines) + "\n"
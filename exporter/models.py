@@ -17,9 +17,27 @@ class SlackFile:
     def id(self):
         return self.data["id"]
 
+    @property
+    def size(self):
+        return self.data.get("size")
+
+    @staticmethod
+    def is_complete(data: Dict[str, Any]) -> bool:
+        """Whether a file object (e.g. one embedded in a message) has enough metadata to be exported."""
+
+        return (
+            "id" in data and "mimetype" in data and "filetype" in data and
+            ("url_private" in data or "external_type" in data)
+        )
+
     @classmethod
     async def from_id(cls, context: context.ExporterContext, id: str):
+        cached = context.file_cache.get(id)
+        if cached is not None:
+            return cls(cached)
+
         slack_response = await utils.with_retry(context.slack_client.files_info, file=id)
+        context.file_cache.put(slack_response.data["file"])
 
         return cls(slack_response.data["file"])
 
@@ -103,9 +121,13 @@ class SlackMessage:
         if len(files) == 0:
             return []
 
-        files_done, _ = await asyncio.wait([SlackFile.from_id(context, f["id"]) for f in files])
+        # Files embedded in the message are usually complete already, so only
+        # fall back to files.info for ones we know nothing about
+        for f in files:
+            if f["id"] not in context.file_cache and SlackFile.is_complete(f):
+                context.file_cache.put(f)
 
-        return [await f for f in files_done]
+        return await asyncio.gather(*[SlackFile.from_id(context, f["id"]) for f in files])
 
     async def populate_replies(self, context: context.ExporterContext, channel: Union[str, SlackConversation]):
         if not self.has_replies:
@@ -0,0 +1,165 @@
+import asyncio
+import contextlib
+import cProfile
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+log = logging.getLogger("profiling")
+
+# How often the event loop is checked for lag, in seconds
+LAG_INTERVAL = 0.05
+
+# Number of functions listed in each phase's text summary
+SUMMARY_FUNCTIONS = 40
+
+def _percentile(values: List[float], fraction: float) -> float:
+    if len(values) == 0:
+        return 0.0
+
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+class Profiler:
+    """
+    Profiles an export, phase by phase, and writes what it found to `directory`.
+
+    - `phase` runs cProfile over a phase; its profile is written as
+      `{phase}.pstats` (for `python -m pstats`, snakeviz or flameprof) and
+      summarized in `{phase}.txt`. Phases run one after another, so only the
+      outermost one is profiled.
+    - `section` times sub-phases, such as fetching replies or serializing
+      JSON, which may run on any thread; totals go to `sections.json`.
+      Calls that overlap, like concurrent conversations fetching replies,
+      each count in full.
+    - `run_background` profiles work done on the background writer's
+      thread, which cProfile can't see from the event loop's; it's written
+      as `writer.pstats`.
+    - Between `start` and `stop`, the event loop is checked every
+      `lag_interval` seconds for how late it wakes up; per-phase
+      percentiles and the samples themselves go to `loop_lag.json`.
+    """
+
+    def __init__(self, directory: str, lag_interval: float = LAG_INTERVAL):
+        self.directory = directory
+        self.lag_interval = lag_interval
+
+        self._phase = None
+        self._sections: Dict[str, Dict[str, float]] = {}
+        self._sections_lock = threading.Lock()
+        self._background = cProfile.Profile()
+        self._background_calls = 0
+
+        self._started = time.perf_counter()
+        self._lag: List[List[Any]] = []
+        self._sampler: asyncio.Task = None
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    async def start(self):
+        self._sampler = asyncio.create_task(self._sample_lag())
+
+        # Lets the sampler take its first timestamp
+        await asyncio.sleep(0)
+
+    async def stop(self):
+        if self._sampler is not None:
+            self._sampler.cancel()
+            await asyncio.gather(self._sampler, return_exceptions=True)
+            self._sampler = None
+
+        self._write_json("sections.json", self._sections)
+        self._write_json("loop_lag.json", {
+            "interval": self.lag_interval,
+            "phases": self._summarize_lag(),
+            "samples": self._lag
+        })
+
+        if self._background_calls > 0:
+            self._dump(self._background, "writer")
+
+        log.info(f"Wrote profiles to {self.directory}")
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        if self._phase is not None:
+            yield
+            return
+
+        profile = cProfile.Profile()
+        self._phase = name
+        profile.enable()
+
+        try:
+            yield
+        finally:
+            profile.disable()
+            self._phase = None
+            self._dump(profile, name)
+
+    @contextlib.contextmanager
+    def section(self, name: str):
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+
+            with self._sections_lock:
+                section = self._sections.setdefault(name, {"count": 0, "seconds": 0.0})
+                section["count"] += 1
+                section["seconds"] += elapsed
+
+    def run_background(self, fn: Callable, *args: Any):
+        """Calls `fn(*args)` under the background profile. Only ever called from the writer's thread."""
+
+        # From 3.12, only one profiler can be active at a time, across all threads
+        if sys.version_info >= (3, 12):
+            return fn(*args)
+
+        self._background_calls += 1
+        return self._background.runcall(fn, *args)
+
+    async def _sample_lag(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.lag_interval)
+            now = time.perf_counter()
+
+            self._lag.append([round(now - self._started, 3), round(now - start - self.lag_interval, 6), self._phase])
+
+    def _summarize_lag(self) -> Dict[str, Dict[str, float]]:
+        by_phase: Dict[str, List[float]] = {}
+
+        for _, lag, phase in self._lag:
+            by_phase.setdefault(phase or "other", []).append(lag)
+
+        summary = {}
+
+        for phase, lags in by_phase.items():
+            lags.sort()
+            summary[phase] = {
+                "samples": len(lags),
+                "mean": sum(lags) / len(lags),
+                "p50": _percentile(lags, 0.5),
+                "p95": _percentile(lags, 0.95),
+                "p99": _percentile(lags, 0.99),
+                "max": lags[-1]
+            }
+
+        return summary
+
+    def _dump(self, profile: cProfile.Profile, name: str):
+        profile.dump_stats(os.path.join(self.directory, f"{name}.pstats"))
+
+        with open(os.path.join(self.directory, f"{name}.txt"), "w") as fd:
+            pstats.Stats(profile, stream=fd).sort_stats("cumulative").print_stats(SUMMARY_FUNCTIONS)
+
+    def _write_json(self, filename: str, content: Any):
+        with open(os.path.join(self.directory, filename), "w") as fd:
+            json.dump(content, fd, indent=2)
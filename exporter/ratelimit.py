@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from typing import Dict, List, Optional
+
+log = logging.getLogger("ratelimit")
+
+# Requests per minute allowed by each of Slack's rate limit tiers.
+# https://api.slack.com/docs/rate-limits
+TIER_RATES = {
+    1: 1,
+    2: 20,
+    3: 50,
+    4: 100,
+}
+
+METHOD_TIERS = {
+    "conversations.history": 3,
+    "conversations.info": 3,
+    "conversations.list": 2,
+    "conversations.replies": 3,
+    "emoji.list": 2,
+    "files.info": 4,
+    "files.list": 3,
+    "pins.list": 2,
+    "reminders.list": 2,
+    "team.info": 3,
+    "users.info": 4,
+    "users.list": 2,
+}
+
+# How far a method's rate may drop after repeated 429s, relative to its tier
+MIN_RATE_FACTOR = 0.1
+
+# Fraction of the tier's rate that is added back after every successful call
+RECOVERY_FACTOR = 0.05
+
+class TokenBucket:
+    """
+    Token bucket that hands out reservations instead of blocking.
+
+    Tokens may go negative; each caller is told how long to wait for its
+    token, so concurrent callers are spaced out evenly without a lock.
+    `updated` may lie in the future, while the bucket is blocked after a 429:
+    tokens only start coming in again from then.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def reserve(self, now: float = None) -> float:
+        """Takes a token, returning the number of seconds to wait before using it."""
+
+        if now is None:
+            now = time.monotonic()
+
+        self._refill(now)
+        self.tokens -= 1
+
+        delay = self.updated - now
+
+        if self.tokens < 0:
+            delay += -self.tokens / self.rate
+
+        return delay
+
+    def penalize(self, retry_after: float, now: float = None):
+        """Halves the rate and blocks the bucket for `retry_after` seconds.
+
+        Callers that reserve while it's blocked are spaced out at the new rate
+        from the end of the block, rather than all let through when it ends."""
+
+        if now is None:
+            now = time.monotonic()
+
+        self._refill(now)
+        self.rate = max(self.max_rate * MIN_RATE_FACTOR, self.rate / 2)
+        self.tokens = min(self.tokens, 1)
+        self.updated = max(self.updated, now + retry_after)
+
+    def reward(self):
+        """Additively creeps the rate back up towards the tier's limit."""
+
+        self.rate = min(self.max_rate, self.rate + self.max_rate * RECOVERY_FACTOR)
+
+class RateLimiter:
+    """
+    Paces Slack API calls per method so that they stay under Slack's tiers.
+
+    Methods without a known tier are not paced.
+    """
+
+    def __init__(self, headroom: float = 0.9, burst: float = 1.0, tiers: Dict[str, int] = None):
+        self._headroom = headroom
+        self._burst = burst
+        self._tiers = METHOD_TIERS if tiers is None else tiers
+        self._buckets: Dict[str, TokenBucket] = {}
+
+        # Seconds spent pacing calls, and seconds Slack told us to back off for
+        self.sleep_time = 0.0
+        self.rate_limited_time = 0.0
+
+    def _create_bucket(self, method: str, rate: float) -> TokenBucket:
+        return TokenBucket(rate, self._burst)
+
+    def get_bucket(self, method: str) -> Optional[TokenBucket]:
+        if method in self._buckets:
+            return self._buckets[method]
+
+        tier = self._tiers.get(method)
+        if tier is None:
+            return None
+
+        rate = TIER_RATES[tier] * self._headroom / 60
+        self._buckets[method] = self._create_bucket(method, rate)
+
+        return self._buckets[method]
+
+    async def acquire(self, method: str):
+        """Waits until a call to `method` fits within its rate limit."""
+
+        bucket = self.get_bucket(method)
+        if bucket is None:
+            return
+
+        delay = bucket.reserve()
+
+        if delay > 0:
+            self.sleep_time += delay
+            await asyncio.sleep(delay)
+
+    def on_rate_limited(self, method: str, retry_after: float):
+        self.rate_limited_time += retry_after
+
+        bucket = self.get_bucket(method)
+        if bucket is None:
+            return
+
+        bucket.penalize(retry_after)
+        log.info(f"Lowered pace of {method} to {bucket.rate * 60:.1f} calls per minute")
+
+    def on_success(self, method: str):
+        bucket = self.get_bucket(method)
+        if bucket is None:
+            return
+
+        bucket.reward()
+
+def _shared_field(index: int):
+    def get(self):
+        return self._state[self._offset + index]
+
+    def set(self, value):
+        self._state[self._offset + index] = value
+
+    return property(get, set)
+
+class SharedTokenBucket(TokenBucket):
+    """
+    TokenBucket whose state is kept in shared memory, so that several
+    processes draw on the same budget. Created through a `SharedRateBudget`.
+    """
+
+    FIELD_COUNT = 3
+
+    rate = _shared_field(0)
+    tokens = _shared_field(1)
+    updated = _shared_field(2)
+
+    def __init__(self, state, lock, slot: int, rate: float, capacity: float):
+        # The shared state was initialized by the budget; don't reset it
+        self._state = state
+        self._lock = lock
+        self._offset = slot * self.FIELD_COUNT
+        self.max_rate = rate
+        self.capacity = capacity
+
+    def reserve(self, now: float = None) -> float:
+        with self._lock:
+            return super().reserve(now)
+
+    def penalize(self, retry_after: float, now: float = None):
+        with self._lock:
+            super().penalize(retry_after, now)
+
+    def reward(self):
+        with self._lock:
+            super().reward()
+
+class SharedRateBudget:
+    """
+    Rate limit state for every paced method, in shared memory.
+
+    Pass it to worker processes when starting them, and build a
+    `SharedRateLimiter` from it in each. Times are `time.monotonic`, which
+    is system-wide on the platforms we run on.
+    """
+
+    def __init__(self, headroom: float = 0.9, burst: float = 1.0, tiers: Dict[str, int] = None, context=multiprocessing):
+        self.headroom = headroom
+        self.burst = burst
+        self.tiers = dict(METHOD_TIERS if tiers is None else tiers)
+        self.methods: List[str] = sorted(self.tiers)
+
+        self.lock = context.Lock()
+        self.state = context.Array("d", len(self.methods) * SharedTokenBucket.FIELD_COUNT, lock=False)
+
+        now = time.monotonic()
+
+        for slot, method in enumerate(self.methods):
+            offset = slot * SharedTokenBucket.FIELD_COUNT
+            self.state[offset:offset + SharedTokenBucket.FIELD_COUNT] = [self.rate(method), burst, now]
+
+    def rate(self, method: str) -> float:
+        return TIER_RATES[self.tiers[method]] * self.headroom / 60
+
+class SharedRateLimiter(RateLimiter):
+    """RateLimiter that paces calls across every process sharing `budget`."""
+
+    def __init__(self, budget: SharedRateBudget):
+        super().__init__(headroom=budget.headroom, burst=budget.burst, tiers=budget.tiers)
+
+        self._budget = budget
+
+    def _create_bucket(self, method: str, rate: float) -> TokenBucket:
+        slot = self._budget.methods.index(method)
+
+        return SharedTokenBucket(self._budget.state, self._budget.lock, slot, rate, self._burst)
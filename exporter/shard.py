@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+from typing import Any, Callable, Dict, List, Sequence
+
+log = logging.getLogger("shard")
+
+# How often to check on workers while waiting for their results
+POLL_INTERVAL = 1.0
+
+class ShardPool:
+    """
+    Exports conversations in several worker processes.
+
+    Conversations are handed out through a shared queue as they are listed,
+    so a worker busy with a large channel doesn't hold up the rest. Each
+    worker runs `target(shard, conversations, results, *args)`: it takes raw
+    conversation dicts from `conversations` until it gets None, then puts
+    `(shard, failed_conversation_ids)` on `results`, optionally followed by
+    the worker's `Metrics.to_dict()`, which ends up in `metrics`.
+    """
+
+    def __init__(self, processes: int, target: Callable, args: Sequence[Any] = (), context=None):
+        self._context = context if context is not None else multiprocessing.get_context("spawn")
+
+        self.conversations = self._context.Queue()
+        self.results = self._context.Queue()
+
+        self._processes = [
+            self._context.Process(
+                target=target,
+                args=(shard, self.conversations, self.results) + tuple(args),
+                name=f"shard-{shard}"
+            )
+            for shard in range(processes)
+        ]
+
+        self.metrics: List[Dict[str, Any]] = []
+
+    def __len__(self) -> int:
+        return len(self._processes)
+
+    def start(self):
+        for process in self._processes:
+            process.start()
+
+    def put(self, conversation: Dict[str, Any]):
+        self.conversations.put(conversation)
+
+    async def join(self) -> List[str]:
+        """Tells the workers that no more conversations are coming, and waits for them to finish.
+
+        Returns the IDs of conversations that failed. Raises a RuntimeError if
+        a worker exited without reporting back."""
+
+        for _ in self._processes:
+            self.conversations.put(None)
+
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(None, self._collect)
+
+    def _collect(self) -> List[str]:
+        failed: List[str] = []
+        pending = set(range(len(self._processes)))
+        crashed = []
+
+        while len(pending) > 0:
+            try:
+                shard, shard_failed, *shard_metrics = self.results.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                # A worker that exited was given one more poll to report back
+                for shard in list(pending):
+                    if not self._processes[shard].is_alive():
+                        if shard in crashed:
+                            pending.discard(shard)
+                        else:
+                            crashed.append(shard)
+
+                continue
+
+            pending.discard(shard)
+            failed.extend(shard_failed)
+            self.metrics.extend(shard_metrics)
+
+            if shard in crashed:
+                crashed.remove(shard)
+
+        for process in self._processes:
+            process.join()
+
+        if len(crashed) > 0:
+            codes = ", ".join(f"shard {shard} exited with {self._processes[shard].exitcode}" for shard in crashed)
+            raise RuntimeError(f"Export workers stopped without finishing ({codes}); run the exporter again to resume")
+
+        return failed
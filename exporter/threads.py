@@ -0,0 +1,67 @@
+import json
+import logging
+import os
+from typing import Any, Dict, Iterable, List, Tuple
+
+from . import utils
+
+log = logging.getLogger("threads")
+
+class ThreadIndex:
+    """
+    Records, for every thread in a conversation, where its parent message is
+    stored in the history and the latest reply that was exported with it.
+    """
+
+    def __init__(self, filename: str):
+        self._filename = filename
+        self._dirty = False
+
+        self.threads: Dict[str, Dict[str, Any]] = {}
+
+    def exists(self) -> bool:
+        return os.path.isfile(self._filename)
+
+    def load(self):
+        utils.wait_for_writes(self._filename)
+
+        if not self.exists():
+            return
+
+        try:
+            with open(self._filename, "r") as fd:
+                self.threads = json.load(fd)
+        except ValueError as e:
+            log.warning(f"Ignoring unreadable thread index {self._filename}", exc_info=e)
+
+    def save(self):
+        if not self._dirty:
+            return
+
+        utils.write_json_atomic(self._filename, self.threads)
+        self._dirty = False
+
+    def record(self, message: Dict[str, Any], index: int):
+        """Records `message`, stored at `index` in the history, if it starts a thread."""
+
+        thread_ts = message.get("thread_ts")
+
+        if thread_ts is None or thread_ts != message.get("ts") or "latest_reply" not in message:
+            return
+
+        self.threads[thread_ts] = {"latest_reply": message["latest_reply"], "index": index}
+        self._dirty = True
+
+    def build(self, history: Iterable[Dict[str, Any]]):
+        """Indexes every thread in an existing history."""
+
+        for index, message in enumerate(history):
+            self.record(message, index)
+
+    def active_since(self, since: float) -> List[Tuple[str, Dict[str, Any]]]:
+        """Threads whose last exported reply is newer than `since`."""
+
+        return [
+            (thread_ts, thread) for thread_ts, thread in self.threads.items()
+            if float(thread["latest_reply"]) >= since
+        ]
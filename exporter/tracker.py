@@ -0,0 +1,207 @@
+import asyncio
+import collections
+import logging
+import multiprocessing
+import sys
+import time
+from typing import Any, Dict, Optional, TextIO
+
+log = logging.getLogger("progress")
+
+# Seconds between redraws of the progress line, and between log lines when stderr isn't a terminal
+REFRESH_INTERVAL = 1.0
+LOG_INTERVAL = 30.0
+
+# Rates are measured over roughly this many seconds
+RATE_WINDOW = 10.0
+
+# Counted by the export as it goes, through `add`
+COUNTERS = (
+    "messages",
+    "users",
+    "files",
+    "conversations_listed",
+    "conversations_done",
+    # Conversations whose history was fetched in this run, and the messages fetched for them
+    "conversations_exported",
+    "conversation_messages",
+    "api_calls",
+    "downloads"
+)
+
+def create_shared_counts(shards: int, context=multiprocessing):
+    """Shared memory for `shards` worker processes to publish their counts in, one row each."""
+
+    return context.Array("q", shards * len(COUNTERS), lock=False)
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02}"
+
+class ProgressTracker:
+    """
+    Keeps count of what the export has done, and reports it at a fixed rate.
+
+    Counting is just adding to a dict, so it's cheap enough to do for every
+    message; reporting happens every `interval` seconds between `start` and
+    `stop`, however many workers are counting. On a terminal, one line on
+    `stream` is redrawn in place; otherwise, a structured log line is logged
+    every `log_interval` seconds.
+
+    Worker processes each get a `shard` row of `shared` (see
+    `create_shared_counts`) and publish their counts there instead of
+    reporting them; the tracker of the process without a `shard` adds every
+    row to its own counts.
+
+    The ETA only covers the conversations phase. It assumes the conversations
+    left are, on average, as big as the ones exported so far, so it's rough
+    until a good number of them are done.
+    """
+
+    def __init__(self, stream: TextIO = None, interval: float = REFRESH_INTERVAL,
+            log_interval: float = LOG_INTERVAL, interactive: bool = None, shared=None, shard: int = None):
+        self.stream = stream if stream is not None else sys.stderr
+        self.interactive = interactive if interactive is not None else self.stream.isatty()
+        self.interval = interval if self.interactive or shard is not None else log_interval
+        self.shared = shared
+        self.shard = shard
+
+        self.counts: Dict[str, int] = dict.fromkeys(COUNTERS, 0)
+        self.phase: str = None
+
+        self._window = collections.deque()
+        self._task: asyncio.Task = None
+        self._drawn = False
+
+    def add(self, counter: str, count: int = 1):
+        self.counts[counter] += count
+
+    def set_phase(self, name: str):
+        self.phase = name
+
+        # Shows the new phase straight away, rather than on the next refresh
+        if self._task is not None:
+            self.refresh()
+
+    async def start(self):
+        self._window.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+        self.refresh()
+
+        if self._drawn:
+            self.stream.write("\n")
+            self.stream.flush()
+            self._drawn = False
+
+    def totals(self) -> Dict[str, int]:
+        """This process' counts, plus those published by worker processes."""
+
+        totals = dict(self.counts)
+
+        if self.shared is not None and self.shard is None:
+            for offset in range(0, len(self.shared), len(COUNTERS)):
+                for name, value in zip(COUNTERS, self.shared[offset:offset + len(COUNTERS)]):
+                    totals[name] += value
+
+        return totals
+
+    def snapshot(self) -> Dict[str, Any]:
+        """The totals, with rates over the last `RATE_WINDOW` seconds and an ETA. Call it once per refresh."""
+
+        totals = self.totals()
+        now = time.monotonic()
+
+        self._window.append((now, totals["messages"], totals["api_calls"]))
+
+        while len(self._window) > 2 and now - self._window[0][0] > RATE_WINDOW:
+            self._window.popleft()
+
+        message_rate = 0.0
+        call_rate = 0.0
+
+        since, messages, calls = self._window[0]
+        if now > since:
+            message_rate = (totals["messages"] - messages) / (now - since)
+            call_rate = (totals["api_calls"] - calls) / (now - since)
+
+        snapshot: Dict[str, Any] = dict(totals)
+        snapshot["phase"] = self.phase
+        snapshot["messages_per_second"] = message_rate
+        snapshot["api_calls_per_second"] = call_rate
+        snapshot["eta"] = self._eta(totals, message_rate)
+
+        return snapshot
+
+    def refresh(self):
+        if self.shard is not None:
+            self._publish()
+            return
+
+        snapshot = self.snapshot()
+
+        if self.interactive:
+            self.stream.write("\r" + self.format_line(snapshot) + "\x1b[K")
+            self.stream.flush()
+            self._drawn = True
+        else:
+            log.info(self.format_log(snapshot))
+
+    def _eta(self, totals: Dict[str, int], message_rate: float) -> Optional[float]:
+        if self.phase != "conversations" or totals["conversations_exported"] == 0 or message_rate <= 0:
+            return None
+
+        average = totals["conversation_messages"] / totals["conversations_exported"]
+        remaining = totals["conversations_listed"] - totals["conversations_done"]
+        # Messages already fetched for conversations still being exported
+        in_progress = totals["messages"] - totals["conversation_messages"]
+
+        return max(0.0, remaining * average - in_progress) / message_rate
+
+    @staticmethod
+    def format_line(snapshot: Dict[str, Any]) -> str:
+        parts = [
+            f"{snapshot['messages']:,} messages ({snapshot['messages_per_second']:,.0f}/s)",
+            f"{snapshot['api_calls']:,} API calls ({snapshot['api_calls_per_second']:,.1f}/s)"
+        ]
+
+        if snapshot["conversations_listed"] > 0:
+            parts.append(f"{snapshot['conversations_done']:,}/{snapshot['conversations_listed']:,} conversations")
+
+        for name in ("users", "files", "downloads"):
+            if snapshot[name] > 0:
+                parts.append(f"{snapshot[name]:,} {name}")
+
+        if snapshot["eta"] is not None:
+            parts.append(f"ETA {format_duration(snapshot['eta'])}")
+
+        return f"[{snapshot['phase'] or 'starting'}] " + ", ".join(parts)
+
+    @staticmethod
+    def format_log(snapshot: Dict[str, Any]) -> str:
+        fields = [f"phase={snapshot['phase'] or 'starting'}"]
+        fields += [f"{name}={snapshot[name]}" for name in COUNTERS]
+        fields.append(f"messages_per_second={snapshot['messages_per_second']:.1f}")
+        fields.append(f"api_calls_per_second={snapshot['api_calls_per_second']:.1f}")
+
+        if snapshot["eta"] is not None:
+            fields.append(f"eta_seconds={snapshot['eta']:.0f}")
+
+        return "progress " + " ".join(fields)
+
+    def _publish(self):
+        offset = self.shard * len(COUNTERS)
+        self.shared[offset:offset + len(COUNTERS)] = [self.counts[name] for name in COUNTERS]
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.refresh()
@@ -0,0 +1,126 @@
+import bisect
+import json
+import logging
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from . import utils
+
+log = logging.getLogger("tsindex")
+
+def ts_key(ts: str) -> Tuple[int, int]:
+    """Sort key for a Slack ts, which is seconds and microseconds joined by a dot."""
+
+    seconds, _, micros = ts.partition(".")
+    return (int(seconds), int(micros.ljust(6, "0")))
+
+class TsIndex:
+    """
+    Maps the ts of every message in a conversation's history to where the
+    message is stored in it, kept sorted by ts so that point and range
+    lookups are binary searches.
+
+    Positions are indices into the history; `FragmentedJsonList.fragment_index`
+    turns one into a fragment and offset.
+    """
+
+    def __init__(self, filename: str):
+        self._filename = filename
+        self._dirty = False
+
+        self._keys: List[Tuple[int, int]] = []
+        self._ts: List[str] = []
+        self._positions: List[int] = []
+
+        # Length of the history as of the last update, to tell when the index is behind it
+        self.length = 0
+
+    def __len__(self) -> int:
+        return len(self._ts)
+
+    def __contains__(self, ts: str) -> bool:
+        return self.find(ts) is not None
+
+    def exists(self) -> bool:
+        return os.path.isfile(self._filename)
+
+    def load(self):
+        utils.wait_for_writes(self._filename)
+
+        if not self.exists():
+            return
+
+        try:
+            with open(self._filename, "r") as fd:
+                data = json.load(fd)
+        except ValueError as e:
+            log.warning(f"Ignoring unreadable ts index {self._filename}", exc_info=e)
+            return
+
+        self._ts = data["ts"]
+        self._positions = data["positions"]
+        self.length = data["length"]
+        self._keys = [ts_key(ts) for ts in self._ts]
+
+    def save(self):
+        if not self._dirty:
+            return
+
+        utils.write_json_atomic(self._filename, {"ts": self._ts, "positions": self._positions, "length": self.length})
+        self._dirty = False
+
+    def add(self, ts: str, position: int):
+        """Records that the message with `ts` is stored at `position`, replacing any earlier position."""
+
+        key = ts_key(ts)
+        slot = bisect.bisect_left(self._keys, key)
+
+        if slot < len(self._keys) and self._keys[slot] == key:
+            self._positions[slot] = position
+        else:
+            self._keys.insert(slot, key)
+            self._ts.insert(slot, ts)
+            self._positions.insert(slot, position)
+
+        self.length = max(self.length, position + 1)
+        self._dirty = True
+
+    def build(self, history: Iterable[Dict[str, Any]]):
+        """Indexes every message in an existing history."""
+
+        entries = []
+        self.length = 0
+
+        for position, message in enumerate(history):
+            if "ts" in message:
+                entries.append((ts_key(message["ts"]), message["ts"], position))
+
+            self.length = position + 1
+
+        # Sorting by position too leaves the last stored copy of a duplicate last
+        entries.sort()
+        entries = [entry for n, entry in enumerate(entries) if n + 1 == len(entries) or entries[n + 1][0] != entry[0]]
+
+        self._keys = [entry[0] for entry in entries]
+        self._ts = [entry[1] for entry in entries]
+        self._positions = [entry[2] for entry in entries]
+        self._dirty = True
+
+    def find(self, ts: str) -> Optional[int]:
+        """Position of the message with `ts`, or None if it isn't stored."""
+
+        key = ts_key(ts)
+        slot = bisect.bisect_left(self._keys, key)
+
+        if slot < len(self._keys) and self._keys[slot] == key:
+            return self._positions[slot]
+
+        return None
+
+    def find_range(self, oldest: str = None, latest: str = None) -> List[Tuple[str, int]]:
+        """(ts, position) of every message with a ts between `oldest` and `latest`, inclusive, oldest first."""
+
+        start = 0 if oldest is None else bisect.bisect_left(self._keys, ts_key(oldest))
+        end = len(self._keys) if latest is None else bisect.bisect_right(self._keys, ts_key(latest))
+
+        return list(zip(self._ts[start:end], self._positions[start:end]))
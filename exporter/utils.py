@@ -1,17 +1,137 @@
 import asyncio
+import contextlib
+import functools
+import inspect
+import json
 import logging
+import os
+import shutil
 import time
-from typing import Coroutine, List
+from typing import Any, Coroutine, Dict, List
 
 from slack_sdk.web.async_client import AsyncSlackResponse
 from slack_sdk.errors import SlackApiError
 
+from .metrics import Metrics
+from .ratelimit import RateLimiter
+from .tracker import ProgressTracker
+
 log = logging.getLogger("utils")
 
+class JsonSerializable:
+    def to_json(self) -> str:
+        return json.dumps(self.__dict__, separators=(',', ':'))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return self.__dict__
+
+# Makes the writes below in the background when set; see exporter.writer.BackgroundWriter
+writer = None
+
+def write_json_atomic(filename: str, content: Any, barrier: bool = False):
+    """Writes JSON to a temporary file first, so `filename` is never seen half-written.
+
+    With a background writer, `content` is encoded right away and written
+    after every write queued before it. With `barrier`, those earlier writes
+    are also synced to disk first."""
+
+    with profile_section("json serialization"):
+        encoded = json.dumps(content, separators=(',', ':'))
+
+    if writer is None:
+        _write_text_atomic(filename, encoded)
+    else:
+        writer.submit(filename, _write_text_atomic, filename, encoded, barrier=barrier)
+
+def write_text_atomic(filename: str, text: str):
+    """Like `write_json_atomic`, for text that is already encoded."""
+
+    if writer is None:
+        _write_text_atomic(filename, text)
+    else:
+        writer.submit(filename, _write_text_atomic, filename, text)
+
+def _write_text_atomic(filename: str, text: str):
+    temp_filename = filename + ".tmp"
+
+    with open(temp_filename, "w") as fd:
+        fd.write(text)
+
+    os.replace(temp_filename, filename)
+
+def remove_path(path: str):
+    """Removes a file or a directory tree, after any writes queued for it."""
+
+    if writer is None:
+        _remove_path(path)
+    else:
+        writer.submit(path, _remove_path, path)
+
+def _remove_path(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+def wait_for_writes(path: str):
+    """Waits for queued writes to `path`, or to files under it, before it is read."""
+
+    if writer is not None:
+        writer.wait(path)
+
+# Shared by every call made through with_retry; replace it to change pacing
+rate_limiter = RateLimiter()
+
+# Collects what the export spends its time on; see exporter.metrics.Metrics
+metrics = Metrics()
+
+# Profiles the export when set; see exporter.profiling.Profiler
+profiler = None
+
+# Counts what the export has done, for its progress line; see exporter.tracker.ProgressTracker
+tracker = ProgressTracker()
+
+def profile_phase(name: str):
+    """Profiles the block as the phase called `name`, when profiling."""
+
+    if profiler is None:
+        return contextlib.nullcontext()
+
+    return profiler.phase(name)
+
+def profile_section(name: str):
+    """Times the block as part of the sub-phase called `name`, when profiling."""
+
+    if profiler is None:
+        return contextlib.nullcontext()
+
+    return profiler.section(name)
+
+def profiled(name: str):
+    """Decorator that times every call of a function, or coroutine function, under `profile_section(name)`."""
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                with profile_section(name):
+                    return await fn(*args, **kwargs)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with profile_section(name):
+                    return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
 class AsyncIteratorWithRetry:
     def __init__(self, coro: Coroutine, retries=5, *args, **kwargs):
         self._iterator = None
         self._retries = retries
+        self._method = get_method_name(coro)
+        self._started = False
 
         self._coro = (coro, args, kwargs)
 
@@ -27,25 +147,77 @@ class AsyncIteratorWithRetry:
         return self
 
     async def __anext__(self):
-        return await with_retry(self._iterator.__anext__, retries=self._retries)
+        # The first step hands back the response from run() without a request
+        method = self._method if self._started else None
+        self._started = True
+
+        return await _with_retry(self._iterator.__anext__, method, self._retries)
+
+def get_method_name(coro: Coroutine) -> str:
+    """Guesses the Slack API method (e.g. conversations.history) behind a client call."""
+
+    owner = getattr(coro, "__self__", None)
+    if isinstance(owner, AsyncSlackResponse):
+        return owner.api_url.split("/")[-1]
+
+    return getattr(coro, "__name__", "").replace("_", ".")
 
 async def with_retry(coro: Coroutine, retries=5, *args, **kwargs):
+    return await _with_retry(coro, get_method_name(coro), retries, *args, **kwargs)
+
+async def _with_retry(coro: Coroutine, method: str, retries: int, *args, **kwargs):
     retry = 0
     while retry < retries:
+        if method is not None:
+            start = time.perf_counter()
+            await rate_limiter.acquire(method)
+            metrics.record_pacing(method, time.perf_counter() - start)
+
+        start = time.perf_counter()
+
         try:
-            return await coro(*args, **kwargs)
+            result = await coro(*args, **kwargs)
         except SlackApiError as e:
+            if method is not None:
+                metrics.record_call(method, time.perf_counter() - start, error=True)
+                tracker.add("api_calls")
+
             if e.response["error"] == "ratelimited":
                 delay = int(e.response.headers["Retry-After"])
                 log.warning(f"API call {coro.__name__} rate limited by Slack for {delay} seconds")
 
+                if method is not None:
+                    rate_limiter.on_rate_limited(method, delay)
+                    metrics.record_rate_limited(method, delay + retry)
+
                 await asyncio.sleep(delay + retry) # crappy additive increase
                 retry += 1
             else:
                 raise e
+        else:
+            if method is not None:
+                metrics.record_call(method, time.perf_counter() - start)
+                tracker.add("api_calls")
+                rate_limiter.on_success(method)
+
+            return result
     else:
         raise RuntimeError("Rate limited by Slack")
 
+async def gather_or_cancel(*coros: Coroutine) -> List[Any]:
+    """Like asyncio.gather, but as soon as one raises, the others are cancelled and waited for before it's re-raised."""
+
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
 class AggregateError(Exception):
     def __init__(self, message: str, errors: List[Exception]):
         self.errors = errors
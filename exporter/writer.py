@@ -0,0 +1,210 @@
+import collections
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, List, Optional
+
+from . import utils
+from .utils import AggregateError
+
+log = logging.getLogger("writer")
+
+class BackgroundWriter:
+    """
+    Performs file writes on a dedicated thread, so that serializing and
+    writing JSON doesn't hold up the event loop.
+
+    Writes are queued as functions to call, and run one at a time in the
+    order they were submitted. Whatever is written to a file, or deleted,
+    therefore lands in the same order it was asked for. The queue is bounded:
+    once `queue_size` writes are waiting, `submit` blocks until the writer
+    catches up. That, `wait` and `flush` block the calling thread; called
+    from a coroutine, they hold up the event loop, so coroutines that can
+    should run them with `run_in_executor`.
+
+    Written files are fsynced in batches: when the queue runs dry, at most
+    every `sync_interval` seconds; once `sync_batch` files are waiting to be
+    synced; and before any write
+    submitted with `barrier=True` (used for checkpoints, which must never
+    describe data that isn't on disk yet). Once any write has failed, barrier
+    writes are no longer made: `submit` raises an AggregateError for them, and
+    any already queued are skipped, until `flush` reports the failure.
+
+    Anything handed to a write must not be changed afterwards.
+    """
+
+    def __init__(self, queue_size: int = 256, sync_batch: int = 64, sync_interval: float = 1.0, fsync: bool = True):
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._sync_batch = sync_batch
+        self._sync_interval = sync_interval
+        self._fsync = fsync
+        self._last_sync = time.monotonic()
+
+        self._condition = threading.Condition()
+        self._pending: collections.Counter = collections.Counter()
+        self._unsynced = set()
+        self._errors: List[Exception] = []
+
+        # Counters, for reporting
+        self.writes = 0
+        self.syncs = 0
+        self.blocked_time = 0.0
+        self.wait_time = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, path: Optional[str], fn: Callable, *args: Any, barrier: bool = False):
+        """Queues `fn(*args)`, which writes to or removes `path`.
+
+        Raises an AggregateError for a barrier write to `path` if an earlier write failed."""
+
+        if path is not None:
+            # Matched against the paths passed to `wait`, however either was spelled
+            path = os.path.abspath(path)
+
+        if barrier and path is not None:
+            with self._condition:
+                errors = list(self._errors)
+
+            if len(errors) > 0:
+                raise AggregateError(f"Not writing {path}, as an earlier write failed.", errors)
+
+        if path is not None:
+            with self._condition:
+                self._pending[path] += 1
+
+        start = time.perf_counter()
+        self._queue.put((path, fn, args, barrier))
+        self.blocked_time += time.perf_counter() - start
+
+    def wait(self, path: str):
+        """Blocks until every queued write to `path`, or to files under it, has been made."""
+
+        start = time.perf_counter()
+        path = os.path.abspath(path)
+        prefix = path.rstrip(os.sep) + os.sep
+
+        with self._condition:
+            self._condition.wait_for(lambda: not any(
+                pending == path or pending.startswith(prefix) for pending in self._pending
+            ))
+
+        self.wait_time += time.perf_counter() - start
+
+    def flush(self):
+        """Blocks until every queued write has been made and synced to disk.
+
+        Raises an AggregateError if any of them failed since the last flush."""
+
+        done = threading.Event()
+        self.submit(None, done.set, barrier=True)
+        done.wait()
+
+        with self._condition:
+            errors, self._errors = self._errors, []
+
+        if len(errors) > 0:
+            raise AggregateError("One or more writes failed.", errors)
+
+    def close(self):
+        """Flushes, then stops the writer thread."""
+
+        try:
+            self.flush()
+        finally:
+            self._queue.put(None)
+            self._thread.join()
+
+        log.info(f"Made {self.writes} writes with {self.syncs} rounds of syncing; callers spent "
+                 f"{self.blocked_time:.2f}s blocked on a full queue and {self.wait_time:.2f}s waiting for writes")
+
+    def stats(self):
+        return {
+            "writes": self.writes,
+            "syncs": self.syncs,
+            "blocked_time": self.blocked_time,
+            "wait_time": self.wait_time
+        }
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+
+            if item is None:
+                self._queue.task_done()
+                return
+
+            path, fn, args, barrier = item
+
+            if barrier:
+                self._sync()
+
+            skip = False
+            if barrier and path is not None:
+                with self._condition:
+                    skip = len(self._errors) > 0
+
+            try:
+                if skip:
+                    # It may describe the data that failed to be written
+                    log.error(f"Skipped write to {path}, as an earlier write failed")
+                elif utils.profiler is not None:
+                    utils.profiler.run_background(fn, *args)
+                else:
+                    fn(*args)
+            except Exception as e:
+                log.error(f"Write to {path} failed", exc_info=e)
+
+                with self._condition:
+                    self._errors.append(e)
+
+            self.writes += 1
+
+            if path is not None:
+                self._unsynced.add(path)
+
+                with self._condition:
+                    self._pending[path] -= 1
+
+                    if self._pending[path] <= 0:
+                        del self._pending[path]
+
+                    self._condition.notify_all()
+
+            self._queue.task_done()
+
+            if len(self._unsynced) >= self._sync_batch or \
+                    (self._queue.empty() and time.monotonic() - self._last_sync >= self._sync_interval):
+                self._sync()
+
+    def _sync(self):
+        if len(self._unsynced) == 0:
+            return
+
+        paths, self._unsynced = self._unsynced, set()
+        self._last_sync = time.monotonic()
+
+        if not self._fsync:
+            return
+
+        # Syncing the directories as well makes renames and removals durable
+        directories = set(os.path.dirname(path) for path in paths)
+
+        for path in list(paths) + list(directories):
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except OSError:
+                # Removed since, or a directory on a platform that can't open one
+                continue
+
+            try:
+                os.fsync(fd)
+            except OSError:
+                pass
+            finally:
+                os.close(fd)
+
+        self.syncs += 1
@@ -28,6 +28,8 @@ def process_scopes(scopes):
     return scopes.split(",")
 
 slack_token = os.getenv("SLACK_TOKEN")
+# Base URL of the Web API, e.g. to point the exporter at benchmarks.slack_server
+slack_api_url = os.getenv("SLACK_API_URL", "https://slack.com/api/")
 
 slack_client_id = os.getenv("SLACK_CLIENT_ID")
 slack_client_secret = os.getenv("SLACK_CLIENT_SECRET")
@@ -37,6 +39,63 @@ slack_state_dir = os.getenv("SLACK_STATE_DIR", "./state")
 
 file_output_directory = os.getenv("FILE_OUTPUT_DIRECTORY", "./data")
 
+# Number of processes to export conversations in; above 1, the conversation list is sharded across them
+shard_processes = int(os.getenv("SHARD_PROCESSES", 1))
+
+# Number of conversations to export at the same time (per process)
+conversation_workers = int(os.getenv("CONVERSATION_WORKERS", 1))
+# Number of threads per page of history to fetch replies for at the same time
+reply_concurrency = int(os.getenv("REPLY_CONCURRENCY", 8))
+# Incremental runs look for new replies in threads that were active this many days ago; 0 checks every thread
+thread_refresh_days = int(os.getenv("THREAD_REFRESH_DAYS", 30))
+
+# Number of files to download at the same time
+download_concurrency = int(os.getenv("DOWNLOAD_CONCURRENCY", 10))
+# Number of downloads that may wait for a worker before exporting pauses
+download_queue_size = int(os.getenv("DOWNLOAD_QUEUE_SIZE", 1000))
+# Number of times to resume a download after the connection drops
+download_retries = int(os.getenv("DOWNLOAD_RETRIES", 3))
+# Files at least this large (in bytes) are downloaded as parallel byte ranges
+download_chunk_threshold = int(os.getenv("DOWNLOAD_CHUNK_THRESHOLD", 64 * 1024 * 1024))
+download_chunk_count = int(os.getenv("DOWNLOAD_CHUNK_COUNT", 4))
+
+# Connections to open at once for downloads; 0 sizes the pool to the download concurrency and chunk count
+http_max_connections = int(os.getenv("HTTP_MAX_CONNECTIONS", 0))
+# Connections to open at once for Slack API calls
+api_max_connections = int(os.getenv("API_MAX_CONNECTIONS", 16))
+# Seconds to keep idle connections open for reuse
+http_keepalive_expiry = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30))
+# Whether downloads may use HTTP/2 (needs httpx[http2])
+http2 = os.getenv("HTTP2", "false").lower() in ("1", "true", "yes")
+
+# Maximum number of history fragments, and roughly how many bytes of them, to keep in memory per conversation
+fragment_cache_size = int(os.getenv("FRAGMENT_CACHE_SIZE", 4))
+fragment_cache_bytes = int(os.getenv("FRAGMENT_CACHE_BYTES", 0)) or None
+# Compress newly written history fragments with "gzip" or "zstd" (needs zstandard); unset to store them as plain text
+fragment_compression = os.getenv("FRAGMENT_COMPRESSION") or None
+
+# Number of file writes that may be queued up for the background writer, and whether it fsyncs what it writes
+write_queue_size = int(os.getenv("WRITE_QUEUE_SIZE", 256))
+write_fsync = os.getenv("WRITE_FSYNC", "true").lower() in ("1", "true", "yes")
+
+# Directory of a content-addressed store to keep downloaded files in once; unset to disable
+blob_store_directory = os.getenv("BLOB_STORE_DIRECTORY")
+
+# Fraction of each Slack rate limit tier to pace API calls at
+rate_limit_headroom = float(os.getenv("RATE_LIMIT_HEADROOM", 0.9))
+# Number of calls per method that may be made back to back before pacing kicks in
+rate_limit_burst = float(os.getenv("RATE_LIMIT_BURST", 1))
+
+# Seconds between redraws of the progress line, and between progress log lines when stderr isn't a terminal
+progress_interval = float(os.getenv("PROGRESS_INTERVAL", 1))
+progress_log_interval = float(os.getenv("PROGRESS_LOG_INTERVAL", 30))
+
+# Also write the run's metrics here in Prometheus' text format, e.g. into node_exporter's textfile directory
+metrics_textfile = os.getenv("METRICS_TEXTFILE")
+
+# Whether to keep file metadata on disk so later runs can skip files.info calls
+file_cache_persist = os.getenv("FILE_CACHE_PERSIST", "false").lower() in ("1", "true", "yes")
+
 auth_redir_url = os.getenv("AUTH_REDIR_URL", "http://localhost:5000/slack/oauth/callback")
 auth_http_bind = os.getenv("AUTH_HTTP_BIND", "127.0.0.1")
 auth_http_port = os.getenv("AUTH_HTTP_PORT", 5000)
\ No newline at end of file
@@ -0,0 +1,138 @@
+import asyncio
+from typing import Any, Callable, Dict, List, Optional
+
+class FakeResponse:
+    """Mimics the paging behaviour of AsyncSlackResponse (as patched by exporter.patch)."""
+
+    def __init__(self, fetch_page: Callable[[Optional[str]], Dict[str, Any]], cursor: str = None):
+        self._fetch_page = fetch_page
+        self._iteration = 0
+        self.data = fetch_page(cursor)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def __aiter__(self):
+        self._iteration = 0
+        return self
+
+    async def __anext__(self):
+        self._iteration += 1
+        if self._iteration == 1:
+            return self
+
+        cursor = self.data.get("response_metadata", {}).get("next_cursor")
+        if not cursor:
+            raise StopAsyncIteration
+
+        self.data = self._fetch_page(cursor)
+        return self
+
+class FakeSlackClient:
+    """Serves conversation history and threads from memory."""
+
+    def __init__(self, history: Dict[str, List[Dict[str, Any]]], replies: Dict[str, List[Dict[str, Any]]] = None):
+        self.history = history
+        self.replies = replies or {}
+        self.calls: List[str] = []
+        self.fail_after_pages = None
+
+        # Threads take this long to fetch, and the ones in fail_threads raise straight away
+        self.reply_delay = 0.0
+        self.fail_threads = set()
+        self.active_replies = 0
+        self.max_active_replies = 0
+        self.cancelled_replies = 0
+
+        # Conversations take this long to fetch history for, and the ones in fail_channels raise
+        self.history_delay = 0.0
+        self.fail_channels = set()
+        self.active_histories = 0
+        self.max_active_histories = 0
+
+    def _page(self, method: str, messages: List[Dict[str, Any]], limit: int, cursor: Optional[str]):
+        self.calls.append(method)
+
+        if self.fail_after_pages is not None:
+            if self.fail_after_pages == 0:
+                raise ConnectionError("Connection dropped")
+
+            self.fail_after_pages -= 1
+
+        start = int(cursor or 0)
+        end = start + limit
+        next_cursor = str(end) if end < len(messages) else ""
+
+        return {
+            "ok": True,
+            "messages": messages[start:end],
+            "has_more": next_cursor != "",
+            "response_metadata": {"next_cursor": next_cursor}
+        }
+
+    async def conversations_list(self, limit=100, types=None, cursor=None):
+        channels = [{"id": channel, "name": channel.lower(), "is_channel": True, "is_archived": False} for channel in self.history]
+
+        def page(cursor):
+            self.calls.append("conversations.list")
+
+            start = int(cursor or 0)
+            next_cursor = str(start + limit) if start + limit < len(channels) else ""
+
+            return {"ok": True, "channels": channels[start:start + limit], "response_metadata": {"next_cursor": next_cursor}}
+
+        return FakeResponse(page, cursor)
+
+    async def conversations_history(self, channel, limit=100, latest=None, oldest=None, cursor=None):
+        self.active_histories += 1
+        self.max_active_histories = max(self.max_active_histories, self.active_histories)
+
+        try:
+            await asyncio.sleep(self.history_delay)
+        finally:
+            self.active_histories -= 1
+
+        if channel in self.fail_channels:
+            raise ConnectionError("Connection dropped")
+
+        # Newest first, like Slack
+        messages = [
+            msg for msg in reversed(self.history[channel])
+            if (latest is None or float(msg["ts"]) < float(latest)) and
+               (oldest is None or float(msg["ts"]) > float(oldest))
+        ]
+
+        return FakeResponse(lambda c: self._page("conversations.history", messages, limit, c), cursor)
+
+    async def conversations_replies(self, channel, ts, oldest=None, limit=100, cursor=None):
+        if ts in self.fail_threads:
+            raise ConnectionError("Connection dropped")
+
+        self.active_replies += 1
+        self.max_active_replies = max(self.max_active_replies, self.active_replies)
+
+        try:
+            await asyncio.sleep(self.reply_delay)
+        except asyncio.CancelledError:
+            self.cancelled_replies += 1
+            raise
+        finally:
+            self.active_replies -= 1
+
+        parent = next(msg for msg in self.history[channel] if msg["ts"] == ts)
+        replies = [
+            msg for msg in self.replies.get(ts, [])
+            if oldest is None or float(msg["ts"]) > float(oldest)
+        ]
+
+        return FakeResponse(lambda c: self._page("conversations.replies", [parent] + replies, limit, c), cursor)
+
+    async def pins_list(self, channel):
+        self.calls.append("pins.list")
+        return {"ok": True, "items": []}
+
+def create_messages(count: int, start: int = 1) -> List[Dict[str, Any]]:
+    return [{"type": "message", "ts": f"{n}.000100", "text": str(n)} for n in range(start, start + count)]
@@ -0,0 +1,29 @@
+from benchmarks.bench_fragment import OPERATIONS, compare, run_case
+
+def create_results(per_second, peak_rss_mb=50.0):
+    return {
+        "cases": {
+            "records=100,fragment_size=10": {
+                "operations": {name: {"seconds": 1.0, "per_second": per_second.get(name, 100.0)} for name in OPERATIONS},
+                "peak_rss_mb": peak_rss_mb
+            }
+        }
+    }
+
+def test_run_case_measures_every_operation():
+    results = run_case(1000, 100, 30, lookups=20, slice_length=150, full_messages=False, compression=None)
+
+    assert set(results["operations"]) == set(OPERATIONS)
+    assert all(result["per_second"] > 0 for result in results["operations"].values())
+    assert results["peak_rss_mb"] > 0
+
+def test_compare_flags_regressions_beyond_thresholds():
+    baseline = create_results({}, peak_rss_mb=50.0)
+
+    assert compare(create_results({"append": 80.0}, peak_rss_mb=55.0), baseline, 0.25, 0.25) == []
+
+    regressions = compare(create_results({"append": 70.0, "stream": 200.0}, peak_rss_mb=70.0), baseline, 0.25, 0.25)
+
+    assert len(regressions) == 2
+    assert regressions[0].startswith("records=100,fragment_size=10 append: 70/s, -30%")
+    assert "peak RSS: 70.0 MB, +40%" in regressions[1]
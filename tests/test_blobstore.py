@@ -0,0 +1,90 @@
+from exporter.blobstore import BlobStore
+
+import multiprocessing
+import os
+
+def save_entries(directory, shard, count):
+    store = BlobStore(directory)
+    store.load()
+
+    for n in range(count):
+        store.remember(f"https://shard{shard}/{n}", f"{shard}-{n}")
+
+    store.save()
+
+def write_file(filename, content):
+    with open(filename, "wb") as fd:
+        fd.write(content)
+
+def test_ingest_deduplicates(tmp_path):
+    store = BlobStore(os.path.join(tmp_path, "blobs"))
+
+    first = os.path.join(tmp_path, "first")
+    second = os.path.join(tmp_path, "second")
+    write_file(first, b"avatar")
+    write_file(second, b"avatar")
+
+    digest = store.ingest(first)
+
+    assert store.ingest(second) == digest
+    assert store.deduplicated == 1
+    assert not os.path.exists(first) and not os.path.exists(second)
+
+    store.link(digest, first)
+    store.link(digest, second)
+
+    assert os.stat(first).st_ino == os.stat(second).st_ino
+    with open(second, "rb") as fd:
+        assert fd.read() == b"avatar"
+
+def test_index_persists(tmp_path):
+    directory = os.path.join(tmp_path, "blobs")
+    filename = os.path.join(tmp_path, "file")
+    write_file(filename, b"emoji")
+
+    store = BlobStore(directory)
+    digest = store.ingest(filename)
+    store.remember("https://emoji.slack-edge.com/T1/party.gif", digest)
+    store.save()
+
+    loaded = BlobStore(directory)
+    loaded.load()
+
+    assert loaded.lookup("https://emoji.slack-edge.com/T1/party.gif") == digest
+    assert loaded.lookup("https://emoji.slack-edge.com/T1/other.gif") is None
+
+def test_save_merges_with_other_stores(tmp_path):
+    directory = os.path.join(tmp_path, "blobs")
+
+    first = BlobStore(directory)
+    second = BlobStore(directory)
+
+    first.remember("https://a", "aa")
+    second.remember("https://b", "bb")
+    first.save()
+    second.save()
+
+    loaded = BlobStore(directory)
+    loaded.load()
+
+    assert loaded._index == {"https://a": "aa", "https://b": "bb"}
+
+def test_concurrent_saves_keep_every_entry(tmp_path):
+    directory = os.path.join(tmp_path, "blobs")
+    context = multiprocessing.get_context("spawn")
+
+    processes = [context.Process(target=save_entries, args=(directory, shard, 200)) for shard in range(4)]
+
+    for process in processes:
+        process.start()
+
+    for process in processes:
+        process.join()
+
+    assert all(process.exitcode == 0 for process in processes)
+
+    loaded = BlobStore(directory)
+    loaded.load()
+
+    assert len(loaded._index) == 800
+    assert [name for name in os.listdir(directory) if name.endswith(".tmp")] == []
@@ -0,0 +1,66 @@
+from exporter.cache import FileMetadataCache
+from exporter.models import SlackMessage
+
+import asyncio
+import os
+import types
+
+def create_file(id, **kwargs):
+    data = {
+        "id": id,
+        "mimetype": "text/plain",
+        "filetype": "text",
+        "url_private": f"https://files.slack.com/files-pri/{id}/file.txt"
+    }
+    data.update(kwargs)
+
+    return data
+
+def create_context(cache, files_info):
+    return types.SimpleNamespace(
+        file_cache=cache,
+        slack_client=types.SimpleNamespace(files_info=files_info)
+    )
+
+def test_get_counts_hits_and_misses():
+    cache = FileMetadataCache()
+    cache.put(create_file("F1"))
+
+    assert cache.get("F1")["id"] == "F1"
+    assert cache.get("F2") is None
+    assert cache.hits == 1 and cache.misses == 1
+
+def test_save_and_load(tmp_path):
+    filename = os.path.join(tmp_path, "files", "cache.json")
+
+    cache = FileMetadataCache(filename)
+    cache.put(create_file("F1"))
+    cache.save()
+
+    loaded = FileMetadataCache(filename)
+    loaded.load()
+
+    assert "F1" in loaded and len(loaded) == 1
+
+def test_get_files_only_fetches_unknown_files():
+    requested = []
+
+    async def files_info(file):
+        requested.append(file)
+        return types.SimpleNamespace(data={"file": create_file(file)})
+
+    cache = FileMetadataCache()
+    cache.put(create_file("F2"))
+    ctx = create_context(cache, files_info)
+
+    message = SlackMessage({
+        "type": "message",
+        "ts": "1.0",
+        "files": [create_file("F1"), {"id": "F2"}, {"id": "F3", "mode": "hidden_by_limit"}]
+    })
+
+    files = asyncio.run(message.get_files(ctx))
+
+    assert [f.id for f in files] == ["F1", "F2", "F3"]
+    assert requested == ["F3"]
+    assert "F3" in cache
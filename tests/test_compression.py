@@ -0,0 +1,27 @@
+from exporter.compression import GzipCodec, ZstdCodec, detect_codec, get_codec
+
+import pytest
+
+def test_gzip_frames_are_concatenated():
+    codec = GzipCodec()
+    content = codec.compress(b"first\n") + codec.compress(b"second\n")
+
+    assert codec.decompress(content) == (b"first\nsecond\n", len(content))
+
+def test_torn_frame_is_discarded():
+    codec = GzipCodec()
+    first = codec.compress(b"first\n")
+    content = first + codec.compress(b"second\n")[:-3]
+
+    assert codec.decompress(content) == (b"first\n", len(first))
+
+def test_detect_codec():
+    pytest.importorskip("zstandard")
+
+    assert isinstance(detect_codec(GzipCodec().compress(b"{}\n")), GzipCodec)
+    assert isinstance(detect_codec(ZstdCodec().compress(b"{}\n")), ZstdCodec)
+    assert detect_codec(b'{"ts":') is None
+    assert get_codec(None) is None
+
+    with pytest.raises(ValueError):
+        get_codec("lz4")
@@ -0,0 +1,71 @@
+from exporter.connections import Connections, ConnectionSettings
+from exporter.downloader import FileDownloader
+
+import asyncio
+import os
+
+from aiohttp import web
+
+async def start_server():
+    async def handler(request):
+        return web.Response(body=b"content")
+
+    app = web.Application()
+    app.router.add_get("/{name}", handler)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+
+    port = runner.addresses[0][1]
+
+    return runner, f"http://127.0.0.1:{port}"
+
+def test_downloads_reuse_connections(tmp_path):
+    async def run():
+        runner, url = await start_server()
+        connections = Connections(ConnectionSettings(max_connections=2, max_keepalive_connections=2))
+        downloader = FileDownloader(str(tmp_path), None, concurrency=2, httpclient=connections.download_client)
+
+        try:
+            for n in range(10):
+                await downloader.enqueue_download(f"{url}/file{n}", f"file{n}")
+
+            await downloader.close()
+
+            # The shared client outlives the downloader
+            assert not connections.download_client.is_closed
+        finally:
+            await connections.close()
+            await runner.cleanup()
+
+        return connections.stats()
+
+    stats = asyncio.run(run())
+
+    assert stats["downloads"]["requests"] == 10
+    assert 1 <= stats["downloads"]["connections"] <= 2
+    assert stats["downloads"]["reused"] >= 8
+    assert stats["downloads"]["tls_handshakes"] == 0
+    assert sorted(os.listdir(tmp_path)) == [f"file{n}" for n in range(10)]
+
+def test_api_calls_reuse_connections():
+    async def run():
+        runner, url = await start_server()
+        connections = Connections()
+
+        try:
+            for n in range(5):
+                async with connections.api_session.get(f"{url}/api{n}") as res:
+                    assert await res.read() == b"content"
+        finally:
+            await connections.close()
+            await runner.cleanup()
+
+        return connections.stats()
+
+    stats = asyncio.run(run())
+
+    assert stats["api"] == {"requests": 5, "connections": 1, "tls_handshakes": 0, "reused": 4}
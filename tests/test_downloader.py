@@ -0,0 +1,289 @@
+from exporter.downloader import FileDownloader, IncompleteDownloadError
+from exporter.utils import AggregateError
+
+import asyncio
+import os
+
+import httpx
+import ujson as json
+
+CONTENT = bytes(range(256)) * 4
+
+class FakeFileServer:
+    """Serves CONTENT for every URL, honoring Range requests unless told otherwise."""
+
+    def __init__(self, ranges=True, wrong_range=False, fail_after=None, delay=0.0):
+        self.ranges = ranges
+        self.wrong_range = wrong_range
+        self.fail_after = fail_after
+        self.delay = delay
+
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+
+    def client(self):
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handle))
+
+    async def handle(self, request):
+        self.requests.append(request)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+
+        try:
+            await asyncio.sleep(self.delay)
+
+            if request.url.path.endswith("/missing"):
+                return httpx.Response(404)
+
+            byte_range = request.headers.get("Range")
+
+            if byte_range is None or not self.ranges:
+                return httpx.Response(200, content=self.body(CONTENT))
+
+            start, _, end = byte_range[len("bytes="):].partition("-")
+            start = 0 if self.wrong_range else int(start)
+            end = int(end) if end else len(CONTENT) - 1
+
+            if start >= len(CONTENT):
+                return httpx.Response(416, headers={"Content-Range": f"bytes */{len(CONTENT)}"})
+
+            return httpx.Response(206, content=self.body(CONTENT[start:end + 1]),
+                headers={"Content-Range": f"bytes {start}-{end}/{len(CONTENT)}"})
+        finally:
+            self.active -= 1
+
+    def body(self, content):
+        if self.fail_after is None:
+            return content
+
+        fail_after = self.fail_after
+        self.fail_after = None
+
+        async def stream():
+            yield content[:fail_after]
+            raise httpx.ReadError("connection reset")
+
+        return stream()
+
+def download(tmp_path, server, files, retries=3, **kwargs):
+    """Downloads `files`, a list of (url, filename, size), and returns the errors."""
+
+    async def run():
+        downloader = FileDownloader(str(tmp_path), None, httpclient=server.client(), retries=retries, **kwargs)
+
+        for url, filename, size in files:
+            await downloader.enqueue_download(url, filename, size=size)
+
+        try:
+            await downloader.close()
+        except AggregateError as e:
+            return e.errors
+
+        return []
+
+    return asyncio.run(run())
+
+def read_bytes(tmp_path, filename):
+    with open(os.path.join(tmp_path, filename), "rb") as fd:
+        return fd.read()
+
+def write_bytes(tmp_path, filename, content):
+    with open(os.path.join(tmp_path, filename), "wb") as fd:
+        fd.write(content)
+
+def read_json(tmp_path, filename):
+    with open(os.path.join(tmp_path, filename), "r") as fd:
+        return json.load(fd)
+
+def test_append_json_list_creates_file(tmp_path):
+    downloader = FileDownloader(str(tmp_path), None)
+
+    downloader.append_json_list("files/files.json", [{"id": "F1"}])
+
+    assert read_json(tmp_path, "files/files.json") == [{"id": "F1"}]
+
+def test_append_json_list_extends_array(tmp_path):
+    downloader = FileDownloader(str(tmp_path), None)
+
+    downloader.write_json("files.json", [])
+    downloader.append_json_list("files.json", [])
+    downloader.append_json_list("files.json", [{"id": "F1"}])
+    downloader.append_json_list("files.json", [{"id": "F2", "pinned_to": ["C1"]}, {"id": "F3"}])
+
+    assert read_json(tmp_path, "files.json") == [
+        {"id": "F1"},
+        {"id": "F2", "pinned_to": ["C1"]},
+        {"id": "F3"}
+    ]
+
+def test_append_json_list_handles_whitespace(tmp_path):
+    downloader = FileDownloader(str(tmp_path), None)
+
+    with open(os.path.join(tmp_path, "files.json"), "w") as fd:
+        fd.write('[\n  {"id": "F1"}\n]\n')
+
+    downloader.append_json_list("files.json", [{"id": "F2"}])
+
+    assert read_json(tmp_path, "files.json") == [{"id": "F1"}, {"id": "F2"}]
+
+def test_resume_json_list_drops_what_was_appended_after_length(tmp_path):
+    downloader = FileDownloader(str(tmp_path), None)
+
+    downloader.write_json("files.json", [])
+    length = downloader.append_json_list("files.json", [{"id": "F1"}])
+    downloader.append_json_list("files.json", [{"id": "F2"}])
+
+    # A run that died partway through writing a third page
+    with open(os.path.join(tmp_path, "files.json"), "ab") as fd:
+        fd.write(b',{"id":"F3"')
+
+    assert length == downloader.json_list_length("files.json") - len(',{"id":"F2"}')
+
+    downloader = FileDownloader(str(tmp_path), None)
+    downloader.resume_json_list("files.json", length)
+    downloader.append_json_list("files.json", [{"id": "F4"}])
+
+    assert read_json(tmp_path, "files.json") == [{"id": "F1"}, {"id": "F4"}]
+
+def test_download_is_streamed_to_a_partial_file(tmp_path):
+    seen = []
+
+    async def handle(request):
+        async def stream():
+            for n in range(4):
+                yield CONTENT[n * 256:(n + 1) * 256]
+                seen.append(sorted(os.listdir(tmp_path)))
+
+        return httpx.Response(200, content=stream())
+
+    async def run():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handle))
+        downloader = FileDownloader(str(tmp_path), None, httpclient=client)
+
+        await downloader.enqueue_download("https://files/f", "f.bin")
+        await downloader.close()
+
+    asyncio.run(run())
+
+    # The body is written as it arrives, and only renamed once it's complete
+    assert seen == [["f.bin.part"]] * 4
+    assert read_bytes(tmp_path, "f.bin") == CONTENT
+    assert os.listdir(tmp_path) == ["f.bin"]
+
+def test_interrupted_download_is_only_kept_as_partial_file(tmp_path):
+    server = FakeFileServer(fail_after=300)
+
+    errors = download(tmp_path, server, [("https://files/f", "f.bin", len(CONTENT))], retries=0)
+
+    assert len(errors) == 1
+    assert os.listdir(tmp_path) == ["f.bin.part"]
+    assert read_bytes(tmp_path, "f.bin.part") == CONTENT[:300]
+
+    # The next attempt picks up where it left off
+    assert download(tmp_path, server, [("https://files/f", "f.bin", len(CONTENT))]) == []
+
+    assert server.requests[-1].headers["Range"] == "bytes=300-"
+    assert read_bytes(tmp_path, "f.bin") == CONTENT
+
+def test_workers_are_bounded_and_fail_per_file(tmp_path):
+    server = FakeFileServer(delay=0.01)
+    files = [(f"https://files/{n}", f"{n}.bin", None) for n in range(8)] + [("https://files/missing", "missing.bin", None)]
+
+    errors = download(tmp_path, server, files, concurrency=3)
+
+    assert [error.url for error in errors] == ["https://files/missing"]
+    assert server.max_active == 3
+    assert sorted(os.listdir(tmp_path)) == sorted(f"{n}.bin" for n in range(8))
+
+def test_enqueue_waits_while_the_queue_is_full(tmp_path):
+    server = FakeFileServer(delay=0.01)
+    started = []
+
+    async def run():
+        downloader = FileDownloader(str(tmp_path), None, httpclient=server.client(), concurrency=1, queue_size=2)
+
+        for n in range(6):
+            await downloader.enqueue_download(f"https://files/{n}", f"{n}.bin")
+            started.append(len(server.requests))
+
+        await downloader.close()
+
+    asyncio.run(run())
+
+    # With one worker and two waiting, the last file could only be queued once three had started
+    assert started[0] == 0
+    assert started[-1] >= 3
+    assert sorted(os.listdir(tmp_path)) == [f"{n}.bin" for n in range(6)]
+
+def test_files_already_queued_are_skipped(tmp_path):
+    server = FakeFileServer()
+
+    assert download(tmp_path, server, [("https://files/f", "f.bin", None)] * 3) == []
+    assert len(server.requests) == 1
+
+def test_download_resumes_partial_file_with_range(tmp_path):
+    server = FakeFileServer()
+    write_bytes(tmp_path, "f.bin.part", CONTENT[:100])
+
+    assert download(tmp_path, server, [("https://files/f", "f.bin", len(CONTENT))]) == []
+
+    assert read_bytes(tmp_path, "f.bin") == CONTENT
+    assert server.requests[0].headers["Range"] == "bytes=100-"
+    assert not os.path.exists(os.path.join(tmp_path, "f.bin.part"))
+
+def test_download_starts_over_when_range_is_ignored(tmp_path):
+    server = FakeFileServer(ranges=False)
+    write_bytes(tmp_path, "f.bin.part", b"stale")
+
+    assert download(tmp_path, server, [("https://files/f", "f.bin", len(CONTENT))]) == []
+    assert read_bytes(tmp_path, "f.bin") == CONTENT
+
+def test_download_starts_over_when_the_wrong_range_is_sent(tmp_path):
+    server = FakeFileServer(wrong_range=True)
+    write_bytes(tmp_path, "f.bin.part", CONTENT[:100])
+
+    assert download(tmp_path, server, [("https://files/f", "f.bin", len(CONTENT))]) == []
+
+    assert read_bytes(tmp_path, "f.bin") == CONTENT
+    assert "Range" not in server.requests[-1].headers
+
+def test_download_of_complete_partial_file_finishes_on_416(tmp_path):
+    server = FakeFileServer()
+    write_bytes(tmp_path, "f.bin.part", CONTENT)
+
+    assert download(tmp_path, server, [("https://files/f", "f.bin", len(CONTENT))]) == []
+
+    assert server.requests[0].headers["Range"] == f"bytes={len(CONTENT)}-"
+    assert read_bytes(tmp_path, "f.bin") == CONTENT
+
+def test_chunked_download_is_reassembled(tmp_path):
+    server = FakeFileServer()
+
+    assert download(tmp_path, server, [("https://files/f", "f.bin", len(CONTENT))],
+        chunk_threshold=100, chunk_count=3) == []
+
+    assert read_bytes(tmp_path, "f.bin") == CONTENT
+    assert sorted(request.headers["Range"] for request in server.requests) == \
+        ["bytes=0-341", "bytes=342-683", "bytes=684-1023"]
+    assert os.listdir(tmp_path) == ["f.bin"]
+
+def test_chunked_download_falls_back_to_streaming(tmp_path):
+    server = FakeFileServer(ranges=False)
+    # Left by an earlier attempt, when the server still honored ranges
+    write_bytes(tmp_path, "f.bin.part.0", CONTENT[:10])
+
+    assert download(tmp_path, server, [("https://files/f", "f.bin", len(CONTENT))],
+        chunk_threshold=100, chunk_count=3) == []
+
+    assert read_bytes(tmp_path, "f.bin") == CONTENT
+    assert os.listdir(tmp_path) == ["f.bin"]
+
+def test_size_mismatch_is_an_error(tmp_path):
+    server = FakeFileServer()
+
+    errors = download(tmp_path, server, [("https://files/f", "f.bin", len(CONTENT) + 1)])
+
+    assert len(errors) == 1
+    assert isinstance(errors[0].inner_exception, IncompleteDownloadError)
+    assert not os.path.exists(os.path.join(tmp_path, "f.bin"))
@@ -0,0 +1,312 @@
+from exporter import constants, export, utils
+from exporter.checkpoint import ConversationCheckpoint
+from exporter.context import ExporterContext
+from exporter.downloader import FileDownloader
+from exporter.fragment import FragmentFactory, FragmentedJsonList
+from exporter.models import SlackConversation, SlackMessage
+from exporter.ratelimit import RateLimiter
+from exporter.writer import BackgroundWriter
+from tests.fake_slack import FakeSlackClient, create_messages
+
+import asyncio
+import os
+import queue
+import time
+
+import pytest
+
+channel = SlackConversation({"id": "C1", "name": "general", "is_channel": True, "is_archived": False})
+
+@pytest.fixture(autouse=True)
+def patch(monkeypatch):
+    monkeypatch.setattr(utils, "rate_limiter", RateLimiter(tiers={}))
+    monkeypatch.setattr(constants, "ITEM_COUNT_LIMIT", 10)
+
+def create_context(tmp_path, client, export_time=1000, last_export_time=0):
+    return ExporterContext(
+        export_time=export_time,
+        last_export_time=last_export_time,
+        output_directory=str(tmp_path),
+        slack_client=client,
+        downloader=FileDownloader(str(tmp_path), None),
+        fragments=FragmentFactory()
+    )
+
+def run_export(ctx):
+    async def run():
+        try:
+            return await export.export_conversation(ctx, channel)
+        finally:
+            await ctx.close()
+
+    return asyncio.run(run())
+
+def read_history(tmp_path):
+    history = FragmentedJsonList(os.path.join(tmp_path, constants.CONVERSATIONS_EXPORT_DIR, "C1", constants.HISTORY_JSON_DIR))
+
+    return [msg["ts"] for msg in history]
+
+def test_history_is_stored_oldest_first(tmp_path):
+    messages = create_messages(25)
+    client = FakeSlackClient({"C1": messages})
+
+    assert run_export(create_context(tmp_path, client))
+    assert read_history(tmp_path) == [msg["ts"] for msg in messages]
+    assert client.calls.count("conversations.history") == 3
+
+def test_history_resumes_after_failure(tmp_path):
+    messages = create_messages(25)
+    client = FakeSlackClient({"C1": messages})
+    client.fail_after_pages = 2
+
+    assert not run_export(create_context(tmp_path, client))
+    assert read_history(tmp_path) == []
+
+    client.fail_after_pages = None
+    client.calls.clear()
+
+    assert run_export(create_context(tmp_path, client))
+    assert read_history(tmp_path) == [msg["ts"] for msg in messages]
+
+    # Only the page that failed is fetched again, and pins aren't
+    assert client.calls == ["conversations.history"]
+
+def test_history_resume_drops_pages_committed_after_the_checkpoint(tmp_path):
+    messages = create_messages(25)
+    client = FakeSlackClient({"C1": messages})
+    client.fail_after_pages = 2
+
+    assert not run_export(create_context(tmp_path, client))
+
+    # A page that made it to disk, but not into the checkpoint, before the run died
+    partial = FragmentedJsonList(os.path.join(tmp_path, constants.CONVERSATIONS_EXPORT_DIR, "C1", constants.HISTORY_PARTIAL_DIR))
+    partial.extend(create_messages(1, start=100))
+    partial.close()
+
+    client.fail_after_pages = None
+
+    assert run_export(create_context(tmp_path, client))
+    assert read_history(tmp_path) == [msg["ts"] for msg in messages]
+
+def test_completed_conversation_is_skipped(tmp_path):
+    client = FakeSlackClient({"C1": create_messages(5)})
+
+    assert run_export(create_context(tmp_path, client))
+
+    client.calls.clear()
+
+    assert run_export(create_context(tmp_path, client))
+    assert client.calls == []
+    assert len(read_history(tmp_path)) == 5
+
+def test_interrupted_merge_is_redone(tmp_path):
+    messages = create_messages(5)
+    client = FakeSlackClient({"C1": messages})
+
+    assert run_export(create_context(tmp_path, client))
+
+    # Pretend the run died halfway through merging a second batch of messages
+    checkpoint_filename = os.path.join(tmp_path, constants.CONVERSATIONS_EXPORT_DIR, "C1", constants.CHECKPOINT_JSON_FILE)
+    new_messages = create_messages(2, start=6)
+
+    history = FragmentedJsonList(os.path.join(tmp_path, constants.CONVERSATIONS_EXPORT_DIR, "C1", constants.HISTORY_JSON_DIR))
+    history.extend(new_messages[:1])
+    history.close()
+
+    partial = FragmentedJsonList(os.path.join(tmp_path, constants.CONVERSATIONS_EXPORT_DIR, "C1", constants.HISTORY_PARTIAL_DIR))
+    partial.extend(new_messages[::-1])
+    partial.close()
+
+    ConversationCheckpoint(2000, pins_complete=True, history_latest_ts="1.000100", history_merge_length=5).save(checkpoint_filename)
+
+    client.calls.clear()
+
+    assert run_export(create_context(tmp_path, client, export_time=2000))
+    assert client.calls == []
+    assert read_history(tmp_path) == [msg["ts"] for msg in messages + new_messages]
+
+def test_new_replies_to_old_threads_are_exported(tmp_path):
+    messages = create_messages(5)
+    parent = messages[2]
+    parent.update({"thread_ts": parent["ts"], "reply_count": 1, "latest_reply": "10.000100"})
+
+    replies = [{"type": "message", "ts": "10.000100", "thread_ts": parent["ts"], "text": "first"}]
+    client = FakeSlackClient({"C1": messages}, {parent["ts"]: replies})
+
+    assert run_export(create_context(tmp_path, client))
+
+    # Someone replies to the thread after the first export
+    replies.append({"type": "message", "ts": "1500.000100", "thread_ts": parent["ts"], "text": "second"})
+    parent.update({"reply_count": 2, "latest_reply": "1500.000100"})
+
+    assert run_export(create_context(tmp_path, client, export_time=2000, last_export_time=1000))
+
+    history = FragmentedJsonList(os.path.join(tmp_path, constants.CONVERSATIONS_EXPORT_DIR, "C1", constants.HISTORY_JSON_DIR))
+    stored = history[2]
+
+    assert len(history) == 5
+    assert stored["latest_reply"] == "1500.000100"
+    assert [reply["text"] for reply in stored[constants.REPLIES_KEY]] == ["first", "second"]
+
+def export_conversations(ctx):
+    async def run():
+        try:
+            await export.export_conversations(ctx)
+        finally:
+            await ctx.close()
+
+    asyncio.run(run())
+
+def test_conversations_are_exported_concurrently_up_to_the_worker_count(tmp_path):
+    client = FakeSlackClient({f"C{n}": create_messages(5) for n in range(8)})
+    client.history_delay = 0.02
+
+    ctx = create_context(tmp_path, client)
+    ctx.conversation_workers = 3
+
+    export_conversations(ctx)
+
+    assert client.max_active_histories == 3
+
+    for n in range(8):
+        history = FragmentedJsonList(os.path.join(tmp_path, constants.CONVERSATIONS_EXPORT_DIR, f"C{n}", constants.HISTORY_JSON_DIR))
+        assert len(history) == 5
+
+def test_failed_conversation_doesnt_stop_the_others(tmp_path):
+    client = FakeSlackClient({f"C{n}": create_messages(5) for n in range(4)})
+    client.fail_channels = {"C1"}
+
+    ctx = create_context(tmp_path, client)
+    ctx.conversation_workers = 2
+
+    with pytest.raises(RuntimeError, match="^1 conversations did not finish"):
+        export_conversations(ctx)
+
+    for n in (0, 2, 3):
+        checkpoint_filename = os.path.join(tmp_path, constants.CONVERSATIONS_EXPORT_DIR, f"C{n}", constants.CHECKPOINT_JSON_FILE)
+        assert ConversationCheckpoint.load(checkpoint_filename, ctx.export_time).complete
+
+def create_threads(count):
+    messages = create_messages(count)
+    replies = {}
+
+    for msg in messages:
+        msg.update({"thread_ts": msg["ts"], "reply_count": 1})
+        replies[msg["ts"]] = [{"type": "message", "ts": f"{msg['ts']}1", "thread_ts": msg["ts"], "text": "reply"}]
+
+    return messages, replies
+
+def test_replies_are_fetched_concurrently_up_to_the_limit(tmp_path):
+    messages, replies = create_threads(10)
+    client = FakeSlackClient({"C1": messages}, replies)
+    client.reply_delay = 0.01
+
+    ctx = create_context(tmp_path, client)
+    ctx.reply_concurrency = 3
+    message_objs = [SlackMessage(msg) for msg in messages]
+
+    asyncio.run(export.populate_replies(ctx, channel, message_objs))
+
+    assert client.max_active_replies == 3
+    assert all(len(msg.data[constants.REPLIES_KEY]) == 1 for msg in message_objs)
+
+def test_failed_reply_fetch_cancels_the_others(tmp_path):
+    messages, replies = create_threads(6)
+    client = FakeSlackClient({"C1": messages}, replies)
+    client.reply_delay = 0.05
+    client.fail_threads = {messages[0]["ts"]}
+
+    ctx = create_context(tmp_path, client)
+
+    async def run():
+        with pytest.raises(ConnectionError):
+            await export.populate_replies(ctx, channel, [SlackMessage(msg) for msg in messages])
+
+        # Nothing is left running once the error is raised
+        assert client.active_replies == 0
+
+    asyncio.run(run())
+
+    assert client.cancelled_replies == 5
+    assert client.calls == []
+
+def test_overlapping_window_is_deduplicated(tmp_path):
+    messages = create_messages(5)
+    client = FakeSlackClient({"C1": messages})
+
+    assert run_export(create_context(tmp_path, client))
+
+    # The next run starts before the last one ended, and a message was edited in between
+    messages[3] = dict(messages[3], text="edited")
+    messages.extend(create_messages(2, start=6))
+
+    assert run_export(create_context(tmp_path, client, export_time=2000, last_export_time=2))
+
+    history = FragmentedJsonList(os.path.join(tmp_path, constants.CONVERSATIONS_EXPORT_DIR, "C1", constants.HISTORY_JSON_DIR))
+
+    assert [msg["ts"] for msg in history] == [msg["ts"] for msg in messages]
+    assert history[3]["text"] == "edited"
+
+    ts_index = export.load_ts_index(os.path.join(tmp_path, constants.CONVERSATIONS_EXPORT_DIR, "C1"), history)
+
+    assert ts_index.find("6.000100") == 5
+    assert ts_index.find("6.5") is None
+
+def test_history_is_written_in_the_background(tmp_path, monkeypatch):
+    writer = BackgroundWriter(queue_size=4)
+    monkeypatch.setattr(utils, "writer", writer)
+
+    messages = create_messages(25)
+    client = FakeSlackClient({"C1": messages})
+
+    ctx = create_context(tmp_path, client)
+    ctx.fragments = FragmentFactory(writer=writer)
+    ctx.writer = writer
+
+    assert run_export(ctx)
+    assert read_history(tmp_path) == [msg["ts"] for msg in messages]
+
+    checkpoint = ConversationCheckpoint.load(os.path.join(tmp_path, constants.CONVERSATIONS_EXPORT_DIR, "C1", constants.CHECKPOINT_JSON_FILE), 1000)
+    assert checkpoint.complete
+    assert not os.path.exists(os.path.join(tmp_path, constants.CONVERSATIONS_EXPORT_DIR, "C1", constants.HISTORY_PARTIAL_DIR))
+
+def test_relative_output_directory_is_written_in_the_background(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    writer = BackgroundWriter(queue_size=4)
+    monkeypatch.setattr(utils, "writer", writer)
+
+    # Holds the writer up, so removing the old partial store is still queued
+    # when the export opens a new one
+    writer.submit(None, time.sleep, 0.2)
+
+    messages = create_messages(25)
+    client = FakeSlackClient({"C1": messages})
+
+    ctx = create_context("data", client)
+    ctx.fragments = FragmentFactory(writer=writer)
+    ctx.writer = writer
+
+    assert run_export(ctx)
+    assert read_history(tmp_path / "data") == [msg["ts"] for msg in messages]
+
+def test_shard_exports_handed_out_conversations(tmp_path):
+    messages = create_messages(5)
+    client = FakeSlackClient({"C1": messages, "C2": messages})
+
+    conversations = queue.Queue()
+    for convo_id in ("C1", "C2"):
+        conversations.put({"id": convo_id, "name": convo_id, "is_channel": True, "is_archived": False})
+    conversations.put(None)
+
+    client.fail_after_pages = 1
+
+    async def run(ctx):
+        try:
+            return await export.export_shard(ctx, conversations)
+        finally:
+            await ctx.close()
+
+    # The second conversation's history fails, and is reported back
+    assert asyncio.run(run(create_context(tmp_path, client))) == ["C2"]
+    assert read_history(tmp_path) == [msg["ts"] for msg in messages]
@@ -2,6 +2,8 @@ from exporter.fragment import FragmentedJsonList
 
 import os
 
+import pytest
+
 data_dir = "data"
 last_fragment_size = 3
 fragment_size = 5
@@ -42,6 +44,7 @@ def patch(monkeypatch):
     monkeypatch.setattr(os.path, "isfile", patch_path_exists)
 
     monkeypatch.setattr(FragmentedJsonList, "_write_json", patch_return())
+    monkeypatch.setattr(FragmentedJsonList, "_write_manifest", patch_return())
     monkeypatch.setattr(FragmentedJsonList, "_read_json", patch_read_json)
 
 def test_read_basic(monkeypatch):
@@ -162,4 +165,209 @@ def test_write_commit(monkeypatch, mocker):
     fragment.commit_fragments()
 
     assert len(fragment.dirty_fragments) == 0
-    assert write_json_spy.call_count in [20, 21]
\ No newline at end of file
+    assert write_json_spy.call_count in [20, 21]
+
+def test_stream(monkeypatch):
+    patch(monkeypatch)
+    fragment = FragmentedJsonList(data_dir, fragment_size=fragment_size)
+    length = len(fragment)
+
+    assert [i["data"] for i in fragment.stream()] == list(range(length))
+    assert [i["data"] for i in fragment.stream(reverse=True)] == list(range(length))[::-1]
+
+    # Only the last fragment, which len() needs, stays loaded
+    assert list(fragment.fragment_map.keys()) == [num_fragments - 1]
+
+def test_write_extend_from(monkeypatch, mocker):
+    patch(monkeypatch)
+    write_json_spy = mocker.spy(FragmentedJsonList, "_write_json")
+
+    fragment = FragmentedJsonList(data_dir, fragment_size=fragment_size)
+    length = len(fragment)
+
+    fragments_to_create = 20
+    extension = list(range(fragment_size * fragments_to_create))
+
+    fragment.extend_from(iter(extension))
+
+    assert len(fragment) == length + len(extension)
+    assert len(fragment.dirty_fragments) == 0
+    assert len(fragment.fragment_map) <= 2
+    assert write_json_spy.call_count >= fragments_to_create
+
+def test_lru_eviction(monkeypatch):
+    patch(monkeypatch)
+    fragment = FragmentedJsonList(data_dir, fragment_size=fragment_size, max_fragments=3)
+    length = len(fragment)
+
+    for i in range(length):
+        assert fragment[i]["data"] == i
+
+    # len() loaded the last fragment before the scan started
+    assert len(fragment.fragment_map) == 3
+    assert fragment.misses == num_fragments + 1
+    assert fragment.evictions == num_fragments + 1 - 3
+
+    # Recently used fragments are hits
+    fragment[length - 1]
+    assert fragment.misses == num_fragments + 1
+
+def test_lru_commits_dirty_fragments(monkeypatch, mocker):
+    patch(monkeypatch)
+    write_json_spy = mocker.spy(FragmentedJsonList, "_write_json")
+    fragment = FragmentedJsonList(data_dir, fragment_size=fragment_size, max_fragments=1)
+
+    fragment.update(0, {"data": "updated"})
+    fragment[fragment_size]
+
+    assert write_json_spy.call_count == 1
+    assert 0 not in fragment.dirty_fragments and not fragment.is_fragment_loaded(0)
+
+def read_bytes(filename):
+    with open(filename, "rb") as fd:
+        return fd.read()
+
+def read_lines(filename):
+    return read_bytes(filename).split(b"\n")
+
+def test_jsonl_commit_appends(tmp_path, mocker):
+    rewrite_spy = mocker.spy(FragmentedJsonList, "_write_jsonl")
+    append_spy = mocker.spy(FragmentedJsonList, "_append_jsonl")
+
+    fragment = FragmentedJsonList(str(tmp_path), fragment_size=fragment_size)
+    fragment.extend(create_mock_data(range(3)))
+    fragment.commit_fragments()
+    fragment.extend(create_mock_data(range(3, 7)))
+    fragment.commit_fragments()
+
+    assert rewrite_spy.call_count == 0
+    assert append_spy.call_count == 3
+    assert read_lines(os.path.join(tmp_path, "0.jsonl")) == [b'{"data":0}', b'{"data":1}', b'{"data":2}', b'{"data":3}', b'{"data":4}', b""]
+
+    fragment.update(1, {"data": "updated"})
+    fragment.commit_fragments()
+
+    assert rewrite_spy.call_count == 1
+
+    reopened = FragmentedJsonList(str(tmp_path), fragment_size=fragment_size)
+    assert reopened.is_jsonl
+    assert [i["data"] for i in reopened] == [0, "updated", 2, 3, 4, 5, 6]
+
+def test_jsonl_torn_write_is_discarded(tmp_path):
+    with open(os.path.join(tmp_path, "0.jsonl"), "wb") as fd:
+        fd.write(b'{"data":0}\n{"data":1}\n{"da')
+
+    fragment = FragmentedJsonList(str(tmp_path), fragment_size=fragment_size)
+    assert len(fragment) == 2
+
+    fragment.append({"data": 2})
+    fragment.close()
+
+    assert read_lines(os.path.join(tmp_path, "0.jsonl")) == [b'{"data":0}', b'{"data":1}', b'{"data":2}', b""]
+
+def test_compact_converts_legacy_layout(tmp_path):
+    for n in range(3):
+        with open(os.path.join(tmp_path, f"{n}.json"), "w") as fd:
+            fd.write(str([{"data": i} for i in range(n * fragment_size, (n + 1) * fragment_size)]).replace("'", '"'))
+
+    fragment = FragmentedJsonList(str(tmp_path), fragment_size=fragment_size)
+    assert not fragment.is_jsonl
+
+    fragment.compact()
+    fragment.append({"data": "new"})
+    fragment.close()
+
+    assert sorted(os.listdir(tmp_path)) == ["0.jsonl", "1.jsonl", "2.jsonl", "3.jsonl", "manifest.json"]
+
+    reopened = FragmentedJsonList(str(tmp_path), fragment_size=fragment_size)
+    assert [i["data"] for i in reopened] == list(range(3 * fragment_size)) + ["new"]
+
+def create_ts_data(generator):
+    return [{"ts": f"{n}.000100"} for n in generator]
+
+def test_manifest_opens_without_reading_fragments(tmp_path, mocker):
+    fragment = FragmentedJsonList(str(tmp_path), fragment_size=fragment_size)
+    fragment.extend_from(create_ts_data(range(23)))
+    fragment.close()
+
+    read_spy = mocker.spy(FragmentedJsonList, "_read_jsonl")
+    isfile_spy = mocker.spy(os.path, "isfile")
+
+    reopened = FragmentedJsonList(str(tmp_path), fragment_size=fragment_size)
+
+    assert len(reopened) == 23
+    assert reopened.fragment_count == 5
+    assert read_spy.call_count == 0
+    assert isfile_spy.call_count < 5
+
+def test_stale_manifest_is_ignored(tmp_path, monkeypatch):
+    fragment = FragmentedJsonList(str(tmp_path), fragment_size=fragment_size)
+    fragment.extend(create_ts_data(range(7)))
+    fragment.close()
+
+    # Pretend the run died between appending to a fragment and updating the manifest
+    with monkeypatch.context() as m:
+        m.setattr(FragmentedJsonList, "_write_manifest", patch_return())
+
+        fragment = FragmentedJsonList(str(tmp_path), fragment_size=fragment_size)
+        fragment.extend(create_ts_data(range(7, 12)))
+        fragment.close()
+
+    reopened = FragmentedJsonList(str(tmp_path), fragment_size=fragment_size)
+
+    assert len(reopened) == 12
+    assert reopened.fragment_count == 3
+
+def test_seek_ts_reads_one_fragment(tmp_path, mocker):
+    fragment = FragmentedJsonList(str(tmp_path), fragment_size=fragment_size)
+    fragment.extend_from(create_ts_data(range(0, 46, 2)))
+    fragment.close()
+
+    read_spy = mocker.spy(FragmentedJsonList, "_read_jsonl")
+    reopened = FragmentedJsonList(str(tmp_path), fragment_size=fragment_size)
+
+    assert reopened.fragments_in_range("11", "21") == [1, 2]
+    assert reopened.seek_ts("13") == 7
+    assert read_spy.call_count == 1
+
+    assert reopened.seek_ts("0") == 0
+    assert reopened.seek_ts("100") == 23
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_compressed_commit_appends(tmp_path, mocker, compression):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+
+    rewrite_spy = mocker.spy(FragmentedJsonList, "_write_jsonl")
+
+    fragment = FragmentedJsonList(str(tmp_path), fragment_size=fragment_size, compression=compression)
+    fragment.extend(create_mock_data(range(3)))
+    fragment.commit_fragments()
+    fragment.extend(create_mock_data(range(3, 7)))
+    fragment.close()
+
+    assert rewrite_spy.call_count == 0
+    assert not read_bytes(os.path.join(tmp_path, "0.jsonl")).startswith(b"{")
+
+    # Reading doesn't need to be told about the compression
+    reopened = FragmentedJsonList(str(tmp_path), fragment_size=fragment_size)
+    assert [i["data"] for i in reopened] == list(range(7))
+
+def test_plain_and_compressed_fragments_mix(tmp_path):
+    fragment = FragmentedJsonList(str(tmp_path), fragment_size=fragment_size)
+    fragment.extend(create_mock_data(range(3)))
+    fragment.close()
+
+    fragment = FragmentedJsonList(str(tmp_path), fragment_size=fragment_size, compression="gzip")
+    fragment.extend(create_mock_data(range(3, 7)))
+    fragment.close()
+
+    # The existing fragment is still appended to as plain text; only the new one is compressed
+    assert read_bytes(os.path.join(tmp_path, "0.jsonl")).startswith(b"{")
+    assert read_bytes(os.path.join(tmp_path, "1.jsonl")).startswith(b"\x1f\x8b")
+
+    reopened = FragmentedJsonList(str(tmp_path), fragment_size=fragment_size, compression="gzip")
+    reopened.compact()
+
+    assert read_bytes(os.path.join(tmp_path, "0.jsonl")).startswith(b"\x1f\x8b")
+    assert [i["data"] for i in reopened] == list(range(7))
@@ -0,0 +1,76 @@
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web.async_slack_response import AsyncSlackResponse
+
+from exporter import utils
+from exporter.metrics import Histogram, Metrics
+from exporter.ratelimit import RateLimiter
+
+import asyncio
+
+def rate_limited_then_ok(failures):
+    async def emoji_list():
+        if failures:
+            failures.pop()
+
+            response = AsyncSlackResponse(client=None, http_verb=None, api_url=None, req_args=None,
+                data={"ok": False, "error": "ratelimited"}, headers={"Retry-After": 0}, status_code=429)
+
+            raise SlackApiError("The request to the Slack API failed.", response)
+
+        return {"ok": True}
+
+    return emoji_list
+
+def test_histogram_buckets_are_upper_bounds():
+    histogram = Histogram((0.1, 1.0))
+
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.count == 4
+    assert histogram.sum == 2.65
+
+def test_with_retry_records_calls_and_rate_limits(monkeypatch):
+    monkeypatch.setattr(utils, "metrics", Metrics())
+    monkeypatch.setattr(utils, "rate_limiter", RateLimiter(tiers={}))
+
+    assert asyncio.run(utils.with_retry(rate_limited_then_ok([1, 1]))) == {"ok": True}
+
+    method = utils.metrics.to_dict()["methods"]["emoji.list"]
+
+    assert method["calls"] == 3
+    assert method["errors"] == 2
+    assert method["rate_limited"] == 2
+    # Retry-After of 0, plus the additive increase of the second retry
+    assert method["backoff_time"] == 1
+    assert method["latency"]["count"] == 3
+
+def test_merge_and_prometheus_output():
+    shard = Metrics()
+    shard.record_call("conversations.history", 0.2)
+    shard.record_download_bytes(100)
+    shard.record_download(0.5)
+
+    with shard.phase("conversations"):
+        pass
+
+    metrics = Metrics()
+    metrics.record_call("conversations.history", 3.0)
+    metrics.merge(shard.to_dict())
+
+    report = metrics.to_dict()
+
+    assert report["methods"]["conversations.history"]["calls"] == 2
+    assert report["downloads"]["files"] == 1
+    assert report["downloads"]["bytes"] == 100
+    # Only the shard downloaded anything, over the half second before it recorded the download
+    assert abs(report["downloads"]["throughput"] - 100 / 0.5) < 1
+    assert "conversations" in report["phases"]
+
+    text = metrics.to_prometheus()
+
+    assert 'slack_exporter_api_calls_total{method="conversations.history"} 2' in text
+    assert 'slack_exporter_api_call_duration_seconds_bucket{method="conversations.history",le="0.25"} 1' in text
+    assert 'slack_exporter_api_call_duration_seconds_bucket{method="conversations.history",le="+Inf"} 2' in text
+    assert "slack_exporter_download_bytes_total 100" in text
@@ -0,0 +1,45 @@
+from exporter import utils
+from exporter.profiling import Profiler
+
+import asyncio
+import json
+import os
+import pstats
+import time
+
+def test_profiler_writes_phases_sections_and_lag(tmp_path, monkeypatch):
+    profiler = Profiler(str(tmp_path), lag_interval=0.01)
+    monkeypatch.setattr(utils, "profiler", profiler)
+
+    @utils.profiled("serialization")
+    def serialize():
+        return json.dumps(list(range(1000)))
+
+    async def run():
+        await profiler.start()
+
+        with utils.profile_phase("users"):
+            # Nested phases are only timed as part of the outer one
+            with utils.profile_phase("inner"):
+                serialize()
+
+            # Blocks the event loop, which the sampler should notice
+            time.sleep(0.05)
+            await asyncio.sleep(0.05)
+
+        profiler.run_background(serialize)
+
+        await profiler.stop()
+
+    asyncio.run(run())
+
+    assert sorted(name for name in os.listdir(tmp_path) if name.endswith(".pstats")) == ["users.pstats", "writer.pstats"]
+    assert pstats.Stats(os.path.join(tmp_path, "users.pstats")).total_calls > 0
+
+    with open(os.path.join(tmp_path, "sections.json")) as fd:
+        assert json.load(fd)["serialization"]["count"] == 2
+
+    with open(os.path.join(tmp_path, "loop_lag.json")) as fd:
+        lag = json.load(fd)
+
+    assert lag["phases"]["users"]["max"] >= 0.03
@@ -0,0 +1,67 @@
+from exporter.ratelimit import RateLimiter, TokenBucket
+
+import asyncio
+import time
+
+def test_bucket_spaces_out_reservations():
+    bucket = TokenBucket(rate=2, capacity=1)
+    now = bucket.updated
+
+    assert bucket.reserve(now) == 0
+    assert abs(bucket.reserve(now) - 0.5) < 1e-9
+    assert abs(bucket.reserve(now) - 1.0) < 1e-9
+
+def test_bucket_refills_over_time():
+    bucket = TokenBucket(rate=2, capacity=1)
+    now = bucket.updated
+
+    bucket.reserve(now)
+
+    assert bucket.reserve(now + 0.5) == 0
+
+def test_bucket_penalize_and_recover():
+    bucket = TokenBucket(rate=1, capacity=1)
+    now = bucket.updated
+
+    bucket.penalize(3, now)
+
+    assert bucket.rate == 0.5
+    assert bucket.reserve(now) >= 3
+
+    for _ in range(100):
+        bucket.reward()
+
+    assert bucket.rate == bucket.max_rate
+
+def test_bucket_spaces_out_callers_blocked_by_penalize():
+    bucket = TokenBucket(rate=1, capacity=1)
+    now = bucket.updated
+
+    bucket.penalize(5, now)
+
+    delays = [bucket.reserve(now + 1) for _ in range(5)]
+
+    # Let through one at a time from the end of the block, at the halved rate
+    for delay, expected in zip(delays, [4, 6, 8, 10, 12]):
+        assert abs(delay - expected) < 1e-6
+
+def test_limiter_ignores_unknown_methods():
+    limiter = RateLimiter()
+
+    assert limiter.get_bucket("not.a.method") is None
+    assert limiter.get_bucket("conversations.history") is not None
+
+def test_limiter_paces_calls():
+    limiter = RateLimiter(tiers={"fast.method": 4}, headroom=60 / 100 * 20)
+
+    async def run():
+        for _ in range(3):
+            await limiter.acquire("fast.method")
+
+    time_start = time.time()
+    asyncio.run(run())
+    time_end = time.time()
+
+    # 20 calls per second, with the first one free
+    assert abs(time_end - time_start - 0.1) <= 0.05
+    assert abs(limiter.sleep_time - 0.1) <= 0.01
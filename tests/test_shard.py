@@ -0,0 +1,78 @@
+from exporter.ratelimit import SharedRateBudget, SharedRateLimiter
+from exporter.shard import ShardPool
+
+import asyncio
+import multiprocessing
+import os
+import time
+
+import pytest
+
+mp_context = multiprocessing.get_context("spawn")
+
+def reserve_tokens(budget, count):
+    bucket = SharedRateLimiter(budget).get_bucket("conversations.history")
+
+    for _ in range(count):
+        bucket.reserve()
+
+def export_conversations(shard, conversations, results, fail_id):
+    failed = []
+
+    while True:
+        convo = conversations.get()
+
+        if convo is None:
+            break
+
+        if convo["id"] == fail_id:
+            failed.append(convo["id"])
+
+    results.put((shard, failed))
+
+def crash(shard, conversations, results):
+    os._exit(3)
+
+def test_limiters_share_a_budget():
+    budget = SharedRateBudget(headroom=1.0, burst=1, tiers={"conversations.history": 3}, context=mp_context)
+
+    first = SharedRateLimiter(budget).get_bucket("conversations.history")
+    second = SharedRateLimiter(budget).get_bucket("conversations.history")
+    now = time.monotonic()
+
+    assert first.reserve(now) == 0.0
+    # Tier 3 is 50 calls per minute; the other limiter has to wait for the next token
+    assert second.reserve(now) == pytest.approx(60 / 50)
+
+    second.penalize(30, now)
+    assert first.rate == pytest.approx(25 / 60)
+    assert first.reserve(now) >= 30
+
+def test_budget_is_shared_across_processes():
+    budget = SharedRateBudget(headroom=1.0, burst=1, tiers={"conversations.history": 3}, context=mp_context)
+
+    process = mp_context.Process(target=reserve_tokens, args=(budget, 5))
+    process.start()
+    process.join()
+
+    assert process.exitcode == 0
+
+    # The other process used the burst token and four more in advance
+    delay = SharedRateLimiter(budget).get_bucket("conversations.history").reserve()
+    assert delay > 4 * 60 / 50
+
+def test_pool_collects_failed_conversations():
+    pool = ShardPool(2, export_conversations, ("C3",), context=mp_context)
+    pool.start()
+
+    for n in range(5):
+        pool.put({"id": f"C{n}"})
+
+    assert asyncio.run(pool.join()) == ["C3"]
+
+def test_pool_reports_crashed_workers():
+    pool = ShardPool(1, crash, context=mp_context)
+    pool.start()
+
+    with pytest.raises(RuntimeError, match="exited with 3"):
+        asyncio.run(pool.join())
@@ -0,0 +1,82 @@
+from benchmarks.slack_server import BASE_TS, FakeSlackServer, FakeWorkspace, RateLimits
+from exporter import patch
+
+import asyncio
+
+import httpx
+import pytest
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web.async_client import AsyncWebClient
+
+def run_against(server: FakeSlackServer, fn):
+    async def run():
+        url = await server.start()
+        client = AsyncWebClient(token="xoxb-test", base_url=f"{url}/api/")
+
+        try:
+            return await fn(client, url)
+        finally:
+            await server.stop()
+
+    patch.patch()
+    return asyncio.run(run())
+
+def test_history_pages_newest_first_within_bounds():
+    server = FakeSlackServer(FakeWorkspace(channels=1, messages=250, thread_ratio=0, file_ratio=0))
+
+    async def fetch(client, url):
+        pages = []
+
+        async for page in await client.conversations_history(channel="C00000000", limit=100,
+                latest=BASE_TS + 240, oldest=BASE_TS + 9):
+            pages.append([message["ts"] for message in page["messages"]])
+
+        return pages
+
+    pages = run_against(server, fetch)
+
+    assert [len(page) for page in pages] == [100, 100, 30]
+    assert pages[0][0] == f"{BASE_TS + 239}.000000"
+    assert pages[-1][-1] == f"{BASE_TS + 10}.000000"
+    assert server.messages_served == 230
+
+def test_threads_and_files_are_served():
+    workspace = FakeWorkspace(channels=1, messages=100, files=5, thread_ratio=1, replies=3, file_ratio=1, file_size=1000)
+    server = FakeSlackServer(workspace)
+
+    async def fetch(client, url):
+        history = await client.conversations_history(channel="C00000000", limit=1)
+        parent = history["messages"][0]
+        replies = await client.conversations_replies(channel="C00000000", ts=parent["thread_ts"])
+
+        async with httpx.AsyncClient() as http:
+            res = await http.get(parent["files"][0]["url_private"], headers={"Range": "bytes=600-"})
+
+        return parent, replies["messages"], res
+
+    parent, replies, res = run_against(server, fetch)
+
+    assert parent["reply_count"] == 3
+    assert [message["ts"] for message in replies[1:]] == [f"{parent['ts'][:-1]}{n}" for n in range(1, 4)]
+    assert res.status_code == 206
+    assert res.headers["Content-Range"] == "bytes 600-999/1000"
+    assert len(res.content) == 400
+
+def test_rate_limited_calls_get_retry_after():
+    server = FakeSlackServer(FakeWorkspace(channels=1, messages=10), RateLimits(speedup=1, burst=2))
+
+    async def fetch(client, url):
+        await client.pins_list(channel="C00000000")
+        await client.pins_list(channel="C00000000")
+
+        with pytest.raises(SlackApiError) as e:
+            await client.pins_list(channel="C00000000")
+
+        return e.value.response
+
+    response = run_against(server, fetch)
+
+    assert response.status_code == 429
+    assert response["error"] == "ratelimited"
+    assert int(response.headers["Retry-After"]) >= 1
+    assert server.stats()["rate_limited"] == {"pins.list": 1}
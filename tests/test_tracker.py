@@ -0,0 +1,71 @@
+from exporter.tracker import COUNTERS, ProgressTracker, create_shared_counts
+
+import asyncio
+import io
+import logging
+
+def test_tracker_adds_shard_counts_and_estimates_eta():
+    shared = create_shared_counts(2)
+
+    shard = ProgressTracker(shared=shared, shard=1)
+    shard.add("messages", 300)
+    shard.add("conversations_done", 2)
+    shard.add("conversations_exported", 2)
+    shard.add("conversation_messages", 200)
+    shard.refresh()
+
+    tracker = ProgressTracker(stream=io.StringIO(), interactive=True, shared=shared)
+    tracker.set_phase("conversations")
+    tracker.add("conversations_listed", 10)
+    tracker.add("api_calls", 20)
+
+    totals = tracker.totals()
+
+    assert totals["messages"] == 300
+    assert totals["api_calls"] == 20
+    assert totals["conversations_done"] == 2
+
+    # 100 messages per conversation, 8 left, 100 of which were already fetched
+    assert tracker._eta(totals, 10.0) == 70.0
+    assert tracker._eta(totals, 0.0) is None
+
+def test_tracker_redraws_one_line_on_a_terminal():
+    stream = io.StringIO()
+    tracker = ProgressTracker(stream=stream, interval=0.01, interactive=True)
+
+    async def run():
+        await tracker.start()
+        tracker.set_phase("users")
+        tracker.add("users", 1234)
+        await asyncio.sleep(0.05)
+        await tracker.stop()
+
+    asyncio.run(run())
+
+    output = stream.getvalue()
+
+    assert output.count("\r") >= 2
+    assert output.endswith("\n")
+    assert output.count("\n") == 1
+    assert "[users] 0 messages (0/s), 0 API calls (0.0/s), 1,234 users" in output
+
+def test_tracker_logs_structured_lines_otherwise(caplog):
+    stream = io.StringIO()
+    tracker = ProgressTracker(stream=stream, log_interval=60, interactive=False)
+    tracker.add("messages", 5)
+
+    async def run():
+        await tracker.start()
+        tracker.set_phase("files")
+        await tracker.stop()
+
+    with caplog.at_level(logging.INFO, logger="progress"):
+        asyncio.run(run())
+
+    assert stream.getvalue() == ""
+    assert len(caplog.records) == 2
+
+    message = caplog.records[-1].getMessage()
+
+    assert message.startswith("progress phase=files messages=5 ")
+    assert all(f" {name}=" in message for name in COUNTERS)
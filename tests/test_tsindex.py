@@ -0,0 +1,43 @@
+from exporter.tsindex import TsIndex, ts_key
+
+def create_history(*timestamps):
+    return [{"ts": ts} for ts in timestamps]
+
+def test_ts_key_orders_numerically():
+    assert ts_key("999.000001") < ts_key("1000.000000")
+    assert ts_key("1000.5") == ts_key("1000.500000")
+
+def test_find_and_find_range(tmp_path):
+    ts_index = TsIndex(str(tmp_path / "ts_index.json"))
+    ts_index.build(create_history("3.000000", "1.000000", "2.000000", "10.000000"))
+
+    assert ts_index.find("1.000000") == 1
+    assert ts_index.find("4.000000") is None
+    assert "10.000000" in ts_index
+
+    assert ts_index.find_range("2.000000", "9.000000") == [("2.000000", 2), ("3.000000", 0)]
+    assert ts_index.find_range(oldest="3.000000") == [("3.000000", 0), ("10.000000", 3)]
+    assert ts_index.find_range(latest="1.000000") == [("1.000000", 1)]
+
+def test_build_keeps_last_duplicate():
+    ts_index = TsIndex("unused")
+    ts_index.build(create_history("1.000000", "2.000000", "1.000000"))
+
+    assert len(ts_index) == 2
+    assert ts_index.find("1.000000") == 2
+    assert ts_index.length == 3
+
+def test_add_save_and_load(tmp_path):
+    filename = str(tmp_path / "ts_index.json")
+
+    ts_index = TsIndex(filename)
+    ts_index.add("2.000000", 0)
+    ts_index.add("1.000000", 1)
+    ts_index.add("2.000000", 2)
+    ts_index.save()
+
+    loaded = TsIndex(filename)
+    loaded.load()
+
+    assert loaded.find_range() == [("1.000000", 1), ("2.000000", 2)]
+    assert loaded.length == 3
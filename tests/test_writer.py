@@ -0,0 +1,96 @@
+from exporter.utils import AggregateError
+from exporter.writer import BackgroundWriter
+
+import threading
+
+import pytest
+
+def test_writes_are_made_in_order(tmp_path):
+    writer = BackgroundWriter(queue_size=2)
+    filename = str(tmp_path / "out.txt")
+
+    def append(text):
+        with open(filename, "a") as fd:
+            fd.write(text)
+
+    for n in range(10):
+        writer.submit(filename, append, str(n))
+
+    writer.close()
+
+    with open(filename, "r") as fd:
+        assert fd.read() == "0123456789"
+
+    assert writer.writes == 11
+    assert writer.syncs >= 1
+
+def test_wait_covers_files_under_a_directory(tmp_path):
+    writer = BackgroundWriter()
+    release = threading.Event()
+    written = []
+
+    def write():
+        release.wait()
+        written.append(True)
+
+    writer.submit(str(tmp_path / "dir" / "0.jsonl"), write)
+
+    waiter = threading.Thread(target=writer.wait, args=(str(tmp_path / "dir"),))
+    waiter.start()
+    waiter.join(0.05)
+    assert waiter.is_alive()
+
+    release.set()
+    waiter.join()
+    assert written == [True]
+
+    # Unrelated paths don't wait
+    writer.wait(str(tmp_path / "directory"))
+    writer.close()
+
+def test_flush_raises_failed_writes(tmp_path):
+    writer = BackgroundWriter()
+
+    def fail():
+        raise OSError("disk full")
+
+    writer.submit(str(tmp_path / "out.txt"), fail)
+
+    with pytest.raises(AggregateError):
+        writer.flush()
+
+    # Errors are only reported once
+    writer.close()
+
+def test_checkpoints_are_not_written_after_a_failed_write(tmp_path):
+    writer = BackgroundWriter()
+    release = threading.Event()
+    checkpoint = str(tmp_path / "checkpoint.json")
+
+    def fail():
+        release.wait()
+        raise OSError("No space left on device")
+
+    def save():
+        with open(checkpoint, "w") as fd:
+            fd.write("{}")
+
+    writer.submit(str(tmp_path / "0.jsonl"), fail)
+    # Queued before the failure, so only the writer thread can hold it back
+    writer.submit(checkpoint, save, barrier=True)
+    release.set()
+
+    writer.wait(checkpoint)
+    assert not (tmp_path / "checkpoint.json").exists()
+
+    # Later ones are refused straight away
+    with pytest.raises(AggregateError):
+        writer.submit(checkpoint, save, barrier=True)
+
+    with pytest.raises(AggregateError):
+        writer.flush()
+
+    writer.submit(checkpoint, save, barrier=True)
+    writer.close()
+
+    assert (tmp_path / "checkpoint.json").exists()
@@ -0,0 +1,26 @@
+from exporter import constants
+from exporter.fragment import FragmentedJsonList
+import settings
+
+import os
+import sys
+
+# Rewrites every conversation's history as JSON Lines, compressed with FRAGMENT_COMPRESSION.
+# Usage: python -m utils.compact [export directory]
+output_dir = sys.argv[1] if len(sys.argv) > 1 else settings.file_output_directory
+conversations_dir = os.path.join(output_dir, constants.CONVERSATIONS_EXPORT_DIR)
+
+for convo_id in sorted(os.listdir(conversations_dir)):
+    history_dir = os.path.join(conversations_dir, convo_id, constants.HISTORY_JSON_DIR)
+
+    if not os.path.isdir(history_dir):
+        continue
+
+    history = FragmentedJsonList(history_dir, compression=settings.fragment_compression)
+    history.compact()
+    message_count = len(history)
+    history.close()
+
+    print(f"Compacted {convo_id}: {message_count} messages")
+
+print("OK")
@@ -1,14 +1,17 @@
 class BlobDataManipulator:
-    def __init__(self, endpoint: str, access_key: str, secret_key: str, bucket: str, secure: bool, bearer_token: str):
+    def __init__(self, endpoint: str, access_key: str, secret_key: str, bucket: str, secure: bool, bearer_token: str,
+            httpclient: httpx.AsyncClient = None):
         self._bucket = bucket
         self._bearer_token = bearer_token
         self._minio = Minio(endpoint, access_key, secret_key, secure=secure)
-        self._httpclient = httpx.AsyncClient()
+        self._owns_httpclient = httpclient is None
+        self._httpclient = httpclient if httpclient is not None else httpx.AsyncClient()
 
         self._download_queue: List[asyncio.Task] = []
 
     async def close(self):
-        await self._httpclient.aclose()
+        if self._owns_httpclient:
+            await self._httpclient.aclose()
 
     def _ensure_bucket_exists(self):
         if not self._minio.bucket_exists(self._bucket):
@@ -11,14 +11,14 @@ with tempfile.TemporaryDirectory() as tempdir:
     src = FragmentedJsonList(src_dir)
     dst = FragmentedJsonList(tempdir)
 
-    dst.extend(src[::-1])
+    dst.extend_from(src.stream(reverse=True))
 
     src.close()
 
     shutil.rmtree(src_dir)
 
     src = FragmentedJsonList(src_dir)
-    src.extend(dst[::])
+    src.extend_from(dst.stream())
     src.close()
     dst.close()
 